@@ -0,0 +1,102 @@
+"""
+Benchmark images/sec and peak memory of the data augmentation paths on CIFAR-10 shaped uint8 data:
+
+    legacy  - the previous augment_data_set: tf.image.random_flip_left_right, np.pad and tf.image.random_crop
+              over the whole (duplicated) data set.
+    numpy   - utils.augmentation.flip_pad_crop_data_set over the whole data set, in chunks.
+    tf      - utils.data_pipeline.random_flip_pad_crop applied per batch.
+
+Synthetic images are used so no download is needed. Each method runs in a fresh process so that the
+peak RSS of one does not leak into the other.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_augmentation --n_images 50000 --batch_size 128
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+METHODS = ["legacy", "numpy", "tf"]
+
+
+def legacy_augment(x, crop_height=40, crop_width=40):
+    import tensorflow as tf
+
+    height, width = x.shape[1:3]
+    data_x = np.concatenate((x, x), axis=0)
+    data_x = tf.image.random_flip_left_right(data_x)
+    npad = ((0, 0), (crop_height - height, crop_width - width), (crop_height - height, crop_width - width), (0, 0))
+    data_x = np.pad(data_x, npad, "constant", constant_values=125)
+    return tf.image.random_crop(data_x, [2 * x.shape[0], height, width, x.shape[3]])
+
+
+def run_method(method, n_images, batch_size):
+    """ Augment n_images with the given method and report images/sec and peak RSS. """
+    x = np.random.default_rng(0).integers(0, 256, (n_images, 32, 32, 3), dtype=np.uint8)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if method == "legacy":
+        legacy_augment(x)
+        n_augmented = 2 * n_images
+
+    elif method == "numpy":
+        from utils.augmentation import flip_pad_crop_data_set
+
+        flip_pad_crop_data_set(x)
+        n_augmented = n_images
+
+    else:
+        import tensorflow as tf
+        from utils.data_pipeline import normalize_images, random_flip_pad_crop
+
+        augment = tf.function(lambda batch: random_flip_pad_crop(normalize_images(batch)))
+        augment(x[:batch_size])
+
+        start = time.perf_counter()
+        for i in range(0, n_images, batch_size):
+            augment(x[i : i + batch_size])
+        n_augmented = n_images
+
+    run_time = time.perf_counter() - start
+
+    # ru_maxrss is reported in KB on linux.
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "method": method,
+        "images_per_sec": round(n_augmented / run_time, 1),
+        "peak_rss_mb": round(rss_after / 1024, 1),
+        "peak_rss_increase_mb": round((rss_after - rss_before) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n_images", type=int, default=50_000)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--method", choices=METHODS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.method is not None:
+        print(json.dumps(run_method(args.method, args.n_images, args.batch_size)))
+        return
+
+    template = "{:<8} {:>14} {:>14} {:>22}"
+    print(template.format("method", "images / sec", "peak RSS MB", "peak RSS increase MB"))
+    for method in METHODS:
+        cmd = [sys.executable, "-m", "benchmarks.bench_augmentation", "--method", method]
+        cmd += ["--n_images", str(args.n_images), "--batch_size", str(args.batch_size)]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        r = json.loads(output.strip().split("\n")[-1])
+        print(template.format(r["method"], r["images_per_sec"], r["peak_rss_mb"], r["peak_rss_increase_mb"]))
+
+
+if __name__ == "__main__":
+    main()
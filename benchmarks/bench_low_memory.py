@@ -0,0 +1,84 @@
+"""
+Benchmark the peak memory and input throughput of load_data in its default float32 mode against the
+low_memory uint8 mode, with batches normalized (and optionally augmented) by make_data_pipeline.
+
+Each mode is run in a fresh process so the peak RSS of one does not leak into the other.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_low_memory --data_set cifar10 --n_batches 500 --augment
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def run_mode(data_set, low_memory, augment, n_batches, batch_size):
+    """ Load the data in the given mode, stream n_batches through the pipeline and report RSS / throughput. """
+    from utils.train_utils import load_data
+    from utils.data_pipeline import make_data_pipeline
+
+    start = time.perf_counter()
+    (x_train, y_train), _, _ = load_data(data_set, 0.1, sample_size=None, low_memory=low_memory)
+    load_time = time.perf_counter() - start
+
+    train_data = make_data_pipeline(x_train, y_train, batch_size, augment_data=augment)
+
+    # first batch includes the pipeline start up cost.
+    iterator = iter(train_data.repeat())
+    next(iterator)
+
+    start = time.perf_counter()
+    for _ in range(n_batches):
+        images, _ = next(iterator)
+    images.numpy()
+    run_time = time.perf_counter() - start
+
+    return {
+        "mode": "uint8" if low_memory else "float32",
+        "load_time_s": round(load_time, 2),
+        "images_per_sec": round(n_batches * batch_size / run_time, 1),
+        # ru_maxrss is reported in KB on linux.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data_set", default="cifar10")
+    parser.add_argument("--n_batches", type=int, default=500)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--augment", action="store_true")
+    parser.add_argument("--mode", choices=["float32", "uint8"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        result = run_mode(
+            args.data_set, args.mode == "uint8", args.augment, args.n_batches, args.batch_size
+        )
+        print(json.dumps(result))
+        return
+
+    results = []
+    for mode in ["float32", "uint8"]:
+        cmd = [sys.executable, "-m", "benchmarks.bench_low_memory", "--mode", mode]
+        cmd += ["--data_set", args.data_set, "--n_batches", str(args.n_batches)]
+        cmd += ["--batch_size", str(args.batch_size)] + (["--augment"] if args.augment else [])
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().split("\n")[-1]))
+
+    template = "{:<8} {:>12} {:>16} {:>14}"
+    print(template.format("mode", "load time s", "images / sec", "peak RSS MB"))
+    for r in results:
+        print(template.format(r["mode"], r["load_time_s"], r["images_per_sec"], r["peak_rss_mb"]))
+
+    saving = results[0]["peak_rss_mb"] - results[1]["peak_rss_mb"]
+    speed_up = results[1]["images_per_sec"] / results[0]["images_per_sec"]
+    print(f"RSS saving: {saving:.1f} MB, uint8 / float32 throughput: {speed_up:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
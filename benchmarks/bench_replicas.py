@@ -0,0 +1,105 @@
+"""
+Benchmark training several replicas of a conv net (e.g. one per label noise level or seed) as the towers of
+one model, as train_conv_net_replicas does, against training the same replicas one after the other:
+
+    sequential  - one model.fit per replica, each on its own label vector.
+    fused       - one model.fit of a make_convNet_towers model with a tower per replica, sharing the input
+                  pipeline and the compiled training step.
+
+Both train with model.fit on the same make_data_pipeline input. Reported are the replica images per second
+(images trained per second, summed over the replicas), after one warm-up epoch (tracing) per model.
+Synthetic CIFAR-10 shaped data is used so no download is needed.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_replicas --n_images 2560 --n_epochs 2 --widths 2 8 --n_replicas 1 3 6
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+
+def compile_model(model):
+    import tensorflow as tf
+    from utils.train_utils import inverse_squareroot_schedule, _tower_metrics
+
+    model.compile(
+        optimizer=tf.keras.optimizers.SGD(learning_rate=inverse_squareroot_schedule()),
+        loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+        metrics=_tower_metrics(model),
+    )
+
+
+def timed_fit(model, data, n_epochs):
+    """ Train one warm-up epoch, then return the time of n_epochs more epochs. """
+    model.fit(data, epochs=1, verbose=0)
+
+    start = time.perf_counter()
+    model.fit(data, epochs=1 + n_epochs, initial_epoch=1, verbose=0)
+    return time.perf_counter() - start
+
+
+def run_sequential(width, x, y_replicas, batch_size, n_epochs):
+    """ Replica images per second of training every replica as its own model. """
+    import tensorflow as tf
+    from models.conv_nets import make_convNet
+    from utils.data_pipeline import make_data_pipeline
+
+    run_time = 0.0
+    for i in range(y_replicas.shape[1]):
+        tf.keras.backend.clear_session()
+        model = make_convNet([32, 32, 3], depth=5, init_channels=width)[0]
+        compile_model(model)
+        data = make_data_pipeline(x, y_replicas[:, i : i + 1], batch_size)
+        run_time += timed_fit(model, data, n_epochs)
+
+    return y_replicas.shape[1] * n_epochs * x.shape[0] / run_time
+
+
+def run_fused(width, x, y_replicas, batch_size, n_epochs):
+    """ Replica images per second of training all replicas as the towers of one model. """
+    import tensorflow as tf
+    from models.conv_nets import make_convNet_towers
+    from utils.data_pipeline import make_data_pipeline
+
+    n_replicas = y_replicas.shape[1]
+    tf.keras.backend.clear_session()
+    model = make_convNet_towers([32, 32, 3], 5, [width] * n_replicas)[0]
+    compile_model(model)
+
+    # every tower reads its own column of the stacked label vectors, as in train_conv_net_replicas.
+    split_labels = lambda images, labels: (
+        images,
+        {f"tower_{i}": labels[:, i : i + 1] for i in range(n_replicas)},
+    )
+    data = make_data_pipeline(x, y_replicas, batch_size).map(split_labels)
+
+    return n_replicas * n_epochs * x.shape[0] / timed_fit(model, data, n_epochs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n_images", type=int, default=5120)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--n_epochs", type=int, default=3)
+    parser.add_argument("--widths", type=int, nargs="+", default=[2, 8, 32])
+    parser.add_argument("--n_replicas", type=int, nargs="+", default=[1, 3, 6])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 256, (args.n_images, 32, 32, 3), dtype=np.uint8)
+    y_replicas = rng.integers(0, 10, (args.n_images, max(args.n_replicas)), dtype=np.uint8)
+
+    template = "{:>6} {:>9} {:>17} {:>17} {:>8}"
+    print(template.format("width", "replicas", "sequential img/s", "fused img/s", "speedup"))
+    for width in args.widths:
+        for n_replicas in args.n_replicas:
+            y = y_replicas[:, :n_replicas]
+            sequential = run_sequential(width, x, y, args.batch_size, args.n_epochs)
+            fused = run_fused(width, x, y, args.batch_size, args.n_epochs)
+            print(template.format(width, n_replicas, round(sequential), round(fused), f"{fused / sequential:.2f}x"))
+
+
+if __name__ == "__main__":
+    main()
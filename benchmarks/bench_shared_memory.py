@@ -0,0 +1,101 @@
+"""
+Benchmark the per-worker memory of sweep workers which each load their own float32 copy of the data set
+against workers which attach zero-copy views of a single shared uint8 copy (utils.shared_data).
+
+Every worker streams one epoch through make_data_pipeline, then reports its RSS, PSS (shared pages
+divided between the processes using them) and private memory from /proc/self/smaps_rollup.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_shared_memory --data_set cifar10 --n_workers 4
+"""
+
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def memory_usage_mb():
+    """ RSS, PSS and private memory of this process in MB (linux only). """
+    usage = {}
+    with open("/proc/self/smaps_rollup", "r") as f:
+        for line in f:
+            fields = line.split()
+            if fields[0].rstrip(":") in ["Rss", "Pss", "Private_Clean", "Private_Dirty"]:
+                usage[fields[0].rstrip(":")] = int(fields[1]) / 1024
+
+    return {
+        "rss": usage["Rss"],
+        "pss": usage["Pss"],
+        "private": usage["Private_Clean"] + usage["Private_Dirty"],
+    }
+
+
+def copy_worker(data_set, label_noise, seed, batch_size):
+    from utils.train_utils import load_data
+    from utils.data_pipeline import make_data_pipeline
+
+    (x_train, y_train), _, _ = load_data(data_set, label_noise, seed=seed)
+    for _ in make_data_pipeline(x_train, y_train, batch_size):
+        pass
+
+    return memory_usage_mb(), int(np.sum(y_train))
+
+
+def shared_worker(descriptor, batch_size):
+    from utils.shared_data import attach_shared_data
+    from utils.data_pipeline import make_data_pipeline
+
+    ((x_train, y_train), _, _), blocks = attach_shared_data(descriptor)
+    for _ in make_data_pipeline(x_train, y_train, batch_size):
+        pass
+
+    return memory_usage_mb(), int(np.sum(y_train))
+
+
+def run_workers(function, args, n_workers):
+    with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return [f.result() for f in [executor.submit(function, *args) for _ in range(n_workers)]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data_set", default="cifar10")
+    parser.add_argument("--label_noise", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n_workers", type=int, default=4)
+    parser.add_argument("--batch_size", type=int, default=128)
+    args = parser.parse_args()
+
+    from utils.train_utils import load_data
+    from utils.shared_data import SharedData
+
+    copy_results = run_workers(
+        copy_worker, (args.data_set, args.label_noise, args.seed, args.batch_size), args.n_workers
+    )
+
+    data = load_data(args.data_set, args.label_noise, low_memory=True, seed=args.seed)
+    with SharedData(data) as shared:
+        shared_results = run_workers(shared_worker, (shared.descriptor, args.batch_size), args.n_workers)
+
+    template = "{:<8} {:>14} {:>14} {:>18}"
+    print(template.format("mode", "mean RSS MB", "mean PSS MB", "mean private MB"))
+    for mode, results in [("copy", copy_results), ("shared", shared_results)]:
+        usage = [r[0] for r in results]
+        print(
+            template.format(
+                mode,
+                round(np.mean([u["rss"] for u in usage]), 1),
+                round(np.mean([u["pss"] for u in usage]), 1),
+                round(np.mean([u["private"] for u in usage]), 1),
+            )
+        )
+
+    # all workers must have trained on the same noisy labels.
+    label_sums = {r[1] for r in copy_results + shared_results}
+    print(f"identical labels across workers: {len(label_sums) == 1}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import tensorflow as tf
 import numpy as np
 
-from tensorflow.keras import Sequential
+from tensorflow.keras import Sequential, Model, Input
 from tensorflow.keras.layers import (
     Dense,
     Flatten,
@@ -13,7 +13,7 @@ from tensorflow.keras.layers import (
 
 
 def make_convNet(
-    input_shape, depth, n_classes=10, init_channels=64, layer_initializer=None
+    input_shape, depth, n_classes=10, init_channels=64, layer_initializer=None, name=None
 ):
     """
     Returns A tensorflow Sequential Model with depth-1 Convolutional layers, and a final Softmax output layer.
@@ -30,10 +30,12 @@ def make_convNet(
             Number of filters in the network at layer 0.
         layer_initializer - str or tf.keras.initializer
             specify which method to use in initializing the conv net.
+        name - str
+            Optional name of the Sequential model.
 
     Note: Depth will be limited by the input dimension, as the dimensions are halved after each layer.
     """
-    conv_net = Sequential()
+    conv_net = Sequential(name=name)
 
     if depth < 2:
         raise Exception("Conv Net Depth Must be greater than or equal to 2.")
@@ -82,3 +84,50 @@ def make_convNet(
     model_id = f"conv_net_depth_{depth}_width_{init_channels}"
 
     return conv_net, model_id
+
+
+def make_convNet_towers(
+    input_shape, depth, widths, n_classes=10, layer_initializer=None
+):
+    """
+    Returns a single tensorflow Model made of independent conv nets ("towers") which all read the same
+    input, so that they can be trained together in one compiled training step on one input pipeline.
+
+    Each tower is a make_convNet model with its own parameters and BatchNorm statistics, and with an
+    output named tower_{i}. Keras sums the per-output losses, so each tower receives exactly the gradient
+    it would get if it was trained on its own.
+
+    Returns the combined model, the list of towers (which can be saved like a make_convNet model) and the
+    list of their model ids.
+
+    Parameters
+    ----------
+        input_shape - list
+            Input dimensions of image data
+        depth - int
+            Number of layers in each network (including the dense output layer)
+        widths - list[int]
+            init_channels of each tower. Repeat a width to train several replicas of the same model.
+        N_Classes - int
+            Output dimension of the final softmax layer.
+        layer_initializer - str or tf.keras.initializer
+            specify which method to use in initializing the conv nets.
+    """
+    inputs = Input(shape=input_shape)
+
+    towers, model_ids = [], []
+    for i, width in enumerate(widths):
+        tower, model_id = make_convNet(
+            input_shape,
+            depth,
+            n_classes=n_classes,
+            init_channels=width,
+            layer_initializer=layer_initializer,
+            name=f"tower_{i}",
+        )
+        towers.append(tower)
+        model_ids.append(model_id)
+
+    model = Model(inputs=inputs, outputs=[tower(inputs) for tower in towers])
+
+    return model, towers, model_ids
@@ -0,0 +1,5 @@
+import os
+
+# the models are built with Keras 2 (tf_keras) and saved as TensorFlow checkpoints, which Keras 3 does not
+# support. Must be set before TensorFlow is imported, spawned worker processes inherit it.
+os.environ.setdefault("TF_USE_LEGACY_KERAS", "1")
@@ -0,0 +1,71 @@
+"""
+End to end test of utils.work_queue: several local worker processes train a tiny grid from a queue with
+an abandoned lease, and every job must be trained and marked done exactly once.
+
+Usage (from the repository root):
+    python -m pytest tests
+
+conftest.py sets TF_USE_LEGACY_KERAS=1, the training code needs Keras 2 (tf_keras).
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+from utils.experiment_grid import grid_cells
+from utils.work_queue import submit_grid, run_local_workers, queue_status, _hashes, _path
+
+
+def _write_tiny_data_set(path, n_train=64, n_test=32, seed=0):
+    rng = np.random.default_rng(seed)
+    np.savez(
+        path,
+        x_train=rng.integers(0, 256, (n_train, 32, 32, 3), dtype=np.uint8),
+        y_train=rng.integers(0, 10, (n_train, 1), dtype=np.uint8),
+        x_test=rng.integers(0, 256, (n_test, 32, 32, 3), dtype=np.uint8),
+        y_test=rng.integers(0, 10, (n_test, 1), dtype=np.uint8),
+    )
+
+
+def test_local_workers_with_stale_lease(tmp_path, monkeypatch):
+    # results and weights are written relative to the working directory, which the workers inherit.
+    monkeypatch.chdir(tmp_path)
+    data_path = str(tmp_path / "tiny.npz")
+    _write_tiny_data_set(data_path)
+
+    config = {
+        "grid": {"model": "conv_net", "data_set": "npz:" + data_path, "depth": 2, "width": [1, 2, 3], "seed": 0},
+        "train_kwargs": {"n_batch_steps": 4, "batch_size": 32, "live_metrics": True},
+    }
+    queue_dir = str(tmp_path / "queue")
+    assert submit_grid(queue_dir, config) == 3
+
+    # a worker which crashed an hour ago while training the largest width.
+    cells = grid_cells(config)
+    stale_hash = max(cells, key=lambda cell: cell["width"])["hash"]
+    lease_path = _path(queue_dir, "leases", stale_hash, ".lease")
+    with open(lease_path, "w") as f:
+        json.dump({"worker": "crashed", "claimed": time.time() - 3600, "attempts": 1}, f)
+    os.utime(lease_path, (time.time() - 3600, time.time() - 3600))
+
+    status = run_local_workers(queue_dir, 2, lease_timeout=600, heartbeat_interval=1)
+
+    jobs = sorted(cell["hash"] for cell in cells)
+    errors = []
+    for name in os.listdir(os.path.join(queue_dir, "failed")):
+        with open(os.path.join(queue_dir, "failed", name)) as f:
+            errors.append(json.load(f)["error"])
+    assert status == {"pending": 0, "running": 0, "done": 3, "failed": 0}, "\n".join(errors)
+    assert sorted(_hashes(queue_dir, "done")) == jobs
+    assert os.listdir(os.path.join(queue_dir, "leases")) == []
+    assert sorted(os.listdir(os.path.join(queue_dir, "done"))) == [job_hash + ".json" for job_hash in jobs]
+
+    # every job was trained in exactly one session, including the one taken over from the crashed worker.
+    streams = tmp_path.glob("experimental_results_tiny/live_metrics/*/*.jsonl")
+    sessions = {}
+    for stream in streams:
+        with open(stream) as f:
+            sessions[stream.stem] = sum("start" in json.loads(line) for line in f if line.strip())
+    assert sessions == {f"conv_net_depth_2_width_{width}": 1 for width in [1, 2, 3]}
@@ -0,0 +1,265 @@
+"""
+Aggregate the runs of several label noise seeds into per-width statistics.
+
+Every run is reduced to a summary of its final and optimal early stopping (epoch of the lowest test error)
+train/test error and loss. The summaries of the runs of a sweep (its results files for every seed, see the
+'_seed_{s}' suffix of utils.experiment_grid) are combined per width with Welford's streaming mean and
+variance updates, so a new or extended seed only updates the statistics of its own width instead of
+reprocessing every history. The state is saved in 'seed_aggregates.json' next to the catalog cache.
+
+Example:
+
+    aggregator = SeedAggregator()
+    aggregator.update(ResultsCatalog(), depth=5, label_noise_as_int=10)
+    stats = aggregator.statistics("cifar10/conv_nets_depth_5_10pct_noise")
+    stats["widths"], stats["final_test_error"]["mean"], stats["final_test_error"]["ci_low"]
+"""
+
+import os
+import re
+import json
+
+import numpy as np
+
+from utils.results_catalog import ResultsCatalog
+
+
+STATE_NAME = "seed_aggregates.json"
+
+# version of the saved state, older states are rebuilt from the catalog.
+STATE_VERSION = 2
+
+# summary statistics of a run.
+SUMMARY_KEYS = [
+    "final_train_error",
+    "final_test_error",
+    "final_train_loss",
+    "final_test_loss",
+    "early_train_error",
+    "early_test_error",
+    "early_train_loss",
+    "early_test_loss",
+]
+
+
+class welford:
+    """ Streaming mean and variance of a sample, which values can be added to and removed from. """
+
+    def __init__(self, n=0, mean=0.0, m2=0.0):
+        self.n, self.mean, self.m2 = n, mean, m2
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        if self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+
+        delta = value - self.mean
+        self.mean -= delta / (self.n - 1)
+        self.m2 -= delta * (value - self.mean)
+        self.n -= 1
+
+    @property
+    def std(self):
+        """ Sample standard deviation, NaN for fewer than two values. """
+        return np.sqrt(max(self.m2, 0.0) / (self.n - 1)) if self.n > 1 else np.nan
+
+
+def run_summary(history):
+    """
+    Summary statistics of a run's history: the final and optimal early stopping (epoch with the lowest test
+    error among the evaluated epochs) train and test error and loss. None if no epoch of the run was
+    evaluated (e.g. a partial run).
+    """
+    train_error = 1 - np.asarray(history["accuracy"], dtype=float)
+    test_error = 1 - np.asarray(history["val_accuracy"], dtype=float)
+    train_loss = np.asarray(history["loss"], dtype=float)
+    test_loss = np.asarray(history["val_loss"], dtype=float)
+
+    # test metrics are NaN at epochs which were not evaluated, the final epoch is always evaluated.
+    evaluated = np.flatnonzero(~np.isnan(test_error))
+    if len(evaluated) == 0:
+        return None
+    final = evaluated[-1]
+    early = evaluated[np.argmin(test_error[evaluated])]
+
+    return {
+        "final_train_error": float(train_error[final]),
+        "final_test_error": float(test_error[final]),
+        "final_train_loss": float(train_loss[final]),
+        "final_test_loss": float(test_loss[final]),
+        "early_train_error": float(train_error[early]),
+        "early_test_error": float(test_error[early]),
+        "early_train_loss": float(train_loss[early]),
+        "early_test_loss": float(test_loss[early]),
+    }
+
+
+def sweep_key(run):
+    """ Key of the seed-independent sweep of a catalog run, e.g. 'cifar10/conv_nets_depth_5_10pct_noise'. """
+    return run["data_set"] + "/" + re.sub(r"_seed_\d+", "", run["sweep"])
+
+
+def run_key(run):
+    """ Key of a catalog run which does not depend on its file, e.g. 'conv_nets_depth_5_10pct_noise_seed_0:conv_net_depth_5_width_8'. """
+    return run["sweep"] + ":" + run["model_id"]
+
+
+def _remove_run(width, key):
+    """ Remove the summary of a run from the statistics of its width. """
+    summary = width["runs"].pop(key)[2]
+    for summary_key in SUMMARY_KEYS:
+        stats = welford(*width["stats"][summary_key])
+        stats.remove(summary[summary_key])
+        width["stats"][summary_key] = [stats.n, stats.mean, stats.m2]
+
+
+class SeedAggregator:
+    """
+    Per-width statistics of the summaries (see run_summary) of the seeds of every sweep, kept up to date
+    incrementally. See the module docstring.
+    """
+
+    def __init__(self, root=".", n_bootstrap=1000, confidence=0.95):
+        """
+        Parameters
+        ----------
+        root: str
+            Directory containing the experimental_results_* directories. The state is saved here.
+        n_bootstrap: int
+            Number of bootstrap resamples of the confidence intervals.
+        confidence: float
+            Confidence level of the bootstrap confidence intervals.
+        """
+        self.state_path = os.path.join(root, STATE_NAME)
+        self.n_bootstrap = n_bootstrap
+        self.confidence = confidence
+
+        # {sweep key: {width: {'runs': {run key: [path, stamp, summary]}, 'stats': {summary key: [n, mean, m2]}}}}
+        self.sweeps = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION:
+                self.sweeps = state["sweeps"]
+
+    def update(self, catalog, **filters):
+        """
+        Add the new runs matching the filters of a ResultsCatalog (see ResultsCatalog.query), replace the
+        summaries of runs whose results file changed since they were added, and remove the runs which are not
+        in the catalog anymore (e.g. deleted results files). Runs are keyed by their sweep and model id, so a
+        run moved from its .pkl file into the results store replaces its old summary. Returns the number of
+        runs added, replaced or removed.
+        """
+        n_updated = 0
+
+        # remove the runs of deleted results files.
+        present = {(sweep_key(run), str(run["width"]), run_key(run)) for run in catalog.runs}
+        for key, widths in self.sweeps.items():
+            for width, entry in widths.items():
+                for key_of_run in [k for k in entry["runs"] if (key, width, k) not in present]:
+                    _remove_run(entry, key_of_run)
+                    n_updated += 1
+
+        for run in catalog.query(**filters):
+            width = self.sweeps.setdefault(sweep_key(run), {}).setdefault(str(run["width"]), {"runs": {}, "stats": {}})
+            key_of_run = run_key(run)
+
+            old = width["runs"].get(key_of_run)
+            if old is not None and old[:2] == [run["path"], run["stamp"]]:
+                continue
+            if old is not None:
+                _remove_run(width, key_of_run)
+                n_updated += 1
+
+            history = catalog.history(run, ["loss", "accuracy", "val_loss", "val_accuracy"])
+            if len(history) < 4 or len(history["loss"]) == 0:
+                continue
+            summary = run_summary(history)
+            if summary is None:
+                continue
+
+            for key in SUMMARY_KEYS:
+                stats = welford(*width["stats"].get(key, [0, 0.0, 0.0]))
+                stats.add(summary[key])
+                width["stats"][key] = [stats.n, stats.mean, stats.m2]
+
+            width["runs"][key_of_run] = [run["path"], run["stamp"], summary]
+            n_updated += 1
+
+        # drop the widths and sweeps left without runs.
+        for key in list(self.sweeps):
+            self.sweeps[key] = {width: entry for width, entry in self.sweeps[key].items() if entry["runs"]}
+            if not self.sweeps[key]:
+                del self.sweeps[key]
+
+        if n_updated:
+            self.save()
+        return n_updated
+
+    def statistics(self, key, seed=0):
+        """
+        Per-width statistics of a sweep: 'widths' and 'n_seeds' arrays, and for every SUMMARY_KEYS entry a
+        dictionary of 'mean', 'std', 'ci_low' and 'ci_high' arrays, where the confidence interval is a
+        percentile bootstrap of the mean over seeds (NaN for a single seed).
+        """
+        sweep = self.sweeps[key]
+        widths = sorted(sweep, key=int)
+        rng = np.random.default_rng(seed)
+
+        stats = {"widths": np.array([int(width) for width in widths])}
+        stats["n_seeds"] = np.array([len(sweep[width]["runs"]) for width in widths])
+
+        for summary_key in SUMMARY_KEYS:
+            columns = {name: [] for name in ["mean", "std", "ci_low", "ci_high"]}
+            for width in widths:
+                running = welford(*sweep[width]["stats"][summary_key])
+                values = np.array([summary[summary_key] for _, _, summary in sweep[width]["runs"].values()])
+                ci_low, ci_high = self._bootstrap_interval(values, rng)
+
+                columns["mean"].append(running.mean)
+                columns["std"].append(running.std)
+                columns["ci_low"].append(ci_low)
+                columns["ci_high"].append(ci_high)
+
+            stats[summary_key] = {name: np.array(column) for name, column in columns.items()}
+
+        return stats
+
+    def save(self):
+        tmp_path = self.state_path + ".tmp_%d" % os.getpid()
+        with open(tmp_path, "w") as f:
+            json.dump({"version": STATE_VERSION, "sweeps": self.sweeps}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _bootstrap_interval(self, values, rng):
+        if len(values) < 2:
+            return np.nan, np.nan
+
+        resamples = rng.choice(values, size=(self.n_bootstrap, len(values)), replace=True).mean(axis=1)
+        alpha = (1 - self.confidence) / 2
+        return tuple(np.quantile(resamples, [alpha, 1 - alpha]))
+
+
+def sweep_statistics(path, **kwargs):
+    """
+    Per-width seed statistics (see SeedAggregator.statistics) of the sweep of a results path, e.g.
+    'experimental_results_cifar10/conv_nets_depth_5_10pct_noise_seed_0.pkl', over all of its seeds.
+    Keyword arguments are passed on to SeedAggregator.
+    """
+    results_dir = os.path.dirname(os.path.abspath(path))
+    root = os.path.dirname(results_dir)
+    sweep = re.sub(r"_seed_\d+", "", os.path.basename(path)[: -len(".pkl")])
+    data_set = os.path.basename(results_dir)[len("experimental_results_") :]
+
+    catalog = ResultsCatalog(root)
+    aggregator = SeedAggregator(root, **kwargs)
+    aggregator.update(
+        catalog, data_set=data_set, sweep=lambda name: re.sub(r"_seed_\d+", "", name) == sweep
+    )
+    return aggregator.statistics(f"{data_set}/{sweep}")
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def flip_pad_crop_batch(images, crop_height=40, crop_width=40, fill_value=125, rng=None):
+    """
+    Randomly flip and pad-crop a batch of images with NumPy, using a different flip and offset per image.
+
+    The result is the same as padding each image by (crop_height - height, crop_width - width) pixels on
+    every side with fill_value and taking a random crop of the original size, but the padded batch is
+    never built: every output pixel is read from the input with a single fancy-indexing gather of shifted
+    row / column indices (the flip is folded into the column indices), and the pixels which fall in the
+    padding are then overwritten with fill_value. The only allocation of batch size is the output.
+
+    Works on any dtype, so uint8 batches can be augmented before they are normalized.
+
+    Parameters
+    ----------
+    images: np.array
+        Batch of images with shape [batch, height, width, channels].
+    crop_height, crop_width: int
+        Padded image size, as in augment_data_set.
+    fill_value: int or float
+        Value used for the pixels which fall in the padding.
+    rng: np.random.Generator
+        Random generator to draw the flips and offsets from.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+
+    batch, height, width = images.shape[:3]
+    pad_height, pad_width = crop_height - height, crop_width - width
+
+    # offset of each crop relative to the original image, in [-pad, pad].
+    rows = np.arange(height) + rng.integers(-pad_height, pad_height + 1, (batch, 1))
+    cols = np.arange(width) + rng.integers(-pad_width, pad_width + 1, (batch, 1))
+
+    # flipping the crop is the same as reading its columns in reverse order.
+    flip = rng.random((batch, 1)) < 0.5
+    cols = np.where(flip, width - 1 - cols, cols)
+
+    row_mask = (0 <= rows) & (rows < height)
+    col_mask = (0 <= cols) & (cols < width)
+
+    out = images[
+        np.arange(batch)[:, None, None],
+        np.clip(rows, 0, height - 1)[:, :, None],
+        np.clip(cols, 0, width - 1)[:, None, :],
+    ]
+    out[~(row_mask[:, :, None] & col_mask[:, None, :])] = fill_value
+
+    return out
+
+
+def flip_pad_crop_data_set(images, crop_height=40, crop_width=40, fill_value=125, rng=None, chunk_size=4096, out=None):
+    """
+    Apply flip_pad_crop_batch to a whole data set, chunk by chunk, writing into a single output array.
+
+    Peak memory is the output plus one chunk, instead of several padded copies of the data set.
+
+    Parameters
+    ----------
+    images: np.array
+        Images with shape [n, height, width, channels].
+    chunk_size: int
+        Number of images augmented at once.
+    out: np.array
+        Optional preallocated output array with the same shape as images.
+
+    See flip_pad_crop_batch for the other parameters.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    out = np.empty_like(images) if out is None else out
+
+    for start in range(0, images.shape[0], chunk_size):
+        out[start : start + chunk_size] = flip_pad_crop_batch(
+            images[start : start + chunk_size], crop_height, crop_width, fill_value, rng
+        )
+
+    return out
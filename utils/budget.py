@@ -0,0 +1,194 @@
+import numpy as np
+import tensorflow as tf
+
+
+# history entries written by plateau_budget.record.
+STOP_KEYS = ["stop_reason", "stop_epoch", "budget_epochs"]
+
+
+class plateau_stopping(tf.keras.callbacks.Callback):
+    """
+    Stop training once a run has converged:
+
+        'interpolated' - the train error is at most train_error_threshold, and the train loss has not improved
+                         (relatively) by min_delta for patience epochs.
+        'plateau'      - neither the train loss nor the test error have improved by min_delta for patience
+                         epochs.
+
+    Training is only stopped at epochs with a test evaluation, so the final test metrics of a stopped run are
+    exact. Epochs without one (NaN test metrics, see utils.evaluation) do not count as test improvements.
+    With require_evaluation=False (e.g. when the test set is evaluated asynchronously), runs may stop at any
+    epoch, and the plateau rule then effectively only depends on the train loss.
+
+    Note that a test error plateau can end late in training (epoch-wise double descent), so patience should
+    be generous when that regime is of interest.
+    """
+
+    def __init__(
+        self, patience=50, min_delta=1e-3, train_error_threshold=0.0, log_prefix="", require_evaluation=True
+    ):
+        """
+        Parameters
+        ----------
+        patience: int
+            Number of epochs without improvement before stopping.
+        min_delta: float
+            Minimum relative decrease of the train loss, and absolute decrease of the test error, that counts
+            as an improvement.
+        train_error_threshold: float
+            Train error at or below which the model is considered to interpolate the training data.
+        log_prefix: str
+            Prefix of the logged metric names, e.g. 'tower_0_' for a make_convNet_towers model.
+        require_evaluation: bool
+            if True, only stop at epochs where the test set was evaluated.
+        """
+        super().__init__()
+
+        self.patience = patience
+        self.min_delta = min_delta
+        self.train_error_threshold = train_error_threshold
+        self.log_prefix = log_prefix
+        self.require_evaluation = require_evaluation
+
+    def on_train_begin(self, logs=None):
+        self.best_loss, self.loss_epoch = np.inf, None
+        self.best_test_error, self.test_error_epoch = np.inf, None
+        self.stop_reason, self.stop_epoch = None, None
+
+    def on_epoch_end(self, epoch, logs=None):
+        prefix = self.log_prefix
+        train_loss = logs[prefix + "loss"]
+        train_error = 1 - logs[prefix + "accuracy"]
+        test_error = 1 - logs.get("val_" + prefix + "accuracy", np.nan)
+
+        if self.loss_epoch is None or train_loss < self.best_loss * (1 - self.min_delta):
+            self.best_loss, self.loss_epoch = train_loss, epoch
+        if self.test_error_epoch is None or test_error < self.best_test_error - self.min_delta:
+            self.best_test_error, self.test_error_epoch = test_error, epoch
+
+        if self.require_evaluation and np.isnan(test_error):
+            return
+
+        loss_stalled = self.patience <= epoch - self.loss_epoch
+        test_error_stalled = self.patience <= epoch - self.test_error_epoch
+
+        if loss_stalled and train_error <= self.train_error_threshold:
+            self.stop_reason = "interpolated"
+        elif loss_stalled and test_error_stalled:
+            self.stop_reason = "plateau"
+
+        if self.stop_reason is not None:
+            self.stop_epoch = epoch + 1
+            self.model.stop_training = True
+
+
+class plateau_budget:
+    """
+    Budget policy for a width sweep: stop the runs which have converged (see plateau_stopping), and give the
+    epochs they saved to widths near the interpolation threshold.
+
+    A run which used its whole budget without interpolating, but whose final train error is at most
+    near_threshold_train_error, is trained further with epochs from the pool of saved epochs, by at most
+    max_extension times its budget. Widths are handled in the order they are trained, so only the epochs
+    saved by earlier widths can be reallocated, and the epochs left in the pool at the end of the sweep are
+    not trained (see 'unspent_epochs' of budget_summary).
+
+    Reallocation therefore only helps when the widths which stop early are trained before the widths near
+    the interpolation threshold, e.g. the small widths which plateau. In an ascending sweep, the epochs
+    saved by the wide widths, which interpolate quickly, are trained after the threshold and stay unspent.
+    The pool also belongs to the policy object of one training call. Widths trained by separate calls or
+    processes (utils.sweep, utils.experiment_grid, utils.work_queue) each get a copy of the policy with an
+    empty pool, so their runs are only stopped and never extended.
+
+    Every history gets a 'stop_reason' ('interpolated', 'plateau', 'budget' if it used its budget, or
+    'extended' if it used reallocated epochs), a 'stop_epoch' (number of epochs trained) and its nominal
+    'budget_epochs'. See budget_summary for the compute saved.
+    """
+
+    def __init__(
+        self,
+        patience=50,
+        min_delta=1e-3,
+        train_error_threshold=0.0,
+        reallocate=True,
+        near_threshold_train_error=0.1,
+        max_extension=1.0,
+    ):
+        """
+        Parameters
+        ----------
+        patience, min_delta, train_error_threshold:
+            Convergence rule, see plateau_stopping.
+        reallocate: bool
+            Whether to give the saved epochs to widths near the interpolation threshold.
+        near_threshold_train_error: float
+            Largest final train error of a run which gets reallocated epochs.
+        max_extension: float
+            Largest number of reallocated epochs of a run, relative to its budget.
+        """
+        self.patience = patience
+        self.min_delta = min_delta
+        self.train_error_threshold = train_error_threshold
+        self.reallocate = reallocate
+        self.near_threshold_train_error = near_threshold_train_error
+        self.max_extension = max_extension
+
+        # epochs saved by stopped runs which have not been reallocated yet.
+        self.pool = 0
+
+    def callback(self, log_prefix="", require_evaluation=True):
+        """ Returns a new plateau_stopping callback for a run. """
+        return plateau_stopping(
+            self.patience, self.min_delta, self.train_error_threshold, log_prefix, require_evaluation
+        )
+
+    def extra_epochs(self, history, budget_epochs):
+        """ Number of epochs to take from the pool for a run which used its budget, given its history. """
+        final_train_error = 1 - history["accuracy"][-1]
+        near_threshold = self.train_error_threshold < final_train_error <= self.near_threshold_train_error
+        if not self.reallocate or not near_threshold:
+            return 0
+
+        extra = min(self.pool, int(self.max_extension * budget_epochs))
+        self.pool -= extra
+        return extra
+
+    def record(self, history, stop_reason, budget_epochs):
+        """ Write the stop reason, stop epoch and budget into a history, and add the saved epochs to the pool. """
+        stop_epoch = len(history["loss"])
+
+        if stop_reason is None:
+            stop_reason = "extended" if budget_epochs < stop_epoch else "budget"
+        else:
+            self.pool += max(0, budget_epochs - stop_epoch)
+
+        history["stop_reason"] = stop_reason
+        history["stop_epoch"] = stop_epoch
+        history["budget_epochs"] = budget_epochs
+        return history
+
+
+def budget_summary(metrics, steps_per_epoch=None):
+    """
+    Summarize the compute of a sweep trained with a plateau_budget from its histories: the nominal and
+    trained epochs, the epochs saved by stopped runs, reallocated to extended runs and left unspent in the
+    pool, and the stop reason of every model. If steps_per_epoch is given, the totals are also reported in
+    gradient steps.
+    """
+    histories = {model_id: h for model_id, h in metrics.items() if "budget_epochs" in h}
+
+    summary = {
+        "budget_epochs": sum(h["budget_epochs"] for h in histories.values()),
+        "trained_epochs": sum(h["stop_epoch"] for h in histories.values()),
+        "saved_epochs": sum(max(0, h["budget_epochs"] - h["stop_epoch"]) for h in histories.values()),
+        "reallocated_epochs": sum(max(0, h["stop_epoch"] - h["budget_epochs"]) for h in histories.values()),
+        "stop_reasons": {model_id: (h["stop_reason"], h["stop_epoch"]) for model_id, h in histories.items()},
+    }
+    summary["unspent_epochs"] = summary["saved_epochs"] - summary["reallocated_epochs"]
+    summary["saved_fraction"] = 1 - summary["trained_epochs"] / max(1, summary["budget_epochs"])
+
+    if steps_per_epoch is not None:
+        for key in ["budget", "trained", "saved", "reallocated", "unspent"]:
+            summary[f"{key}_steps"] = summary[f"{key}_epochs"] * steps_per_epoch
+
+    return summary
@@ -0,0 +1,184 @@
+import os
+import shutil
+import pickle as pkl
+
+import tensorflow as tf
+
+
+class EpochCheckpoint(tf.keras.callbacks.Callback):
+    """
+    Periodically checkpoint a model during model.fit, so that a preempted run can resume from its last
+    checkpoint (see restore_checkpoint) instead of restarting.
+
+    Every every_n_epochs epochs (and when training ends) the model and optimizer variables are saved with a
+    tf.train.CheckpointManager, along with a small state.pkl file holding the number of finished epochs, the
+    history so far, the step counter of an inverse_squareroot_lr schedule and the config of the run. A
+    checkpoint is only restored by a run with the same config.
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir,
+        every_n_epochs=25,
+        lr_schedule=None,
+        history=None,
+        initial_epoch=0,
+        max_to_keep=1,
+        run_config=None,
+    ):
+        """
+        Parameters
+        ----------
+        checkpoint_dir: str
+            Directory to write the checkpoints to.
+        every_n_epochs: int
+            Number of epochs between checkpoints.
+        lr_schedule: inverse_squareroot_lr
+            Optional learning rate schedule whose step counter is saved with the checkpoint.
+        history: dict
+            History of the epochs trained before this run, when resuming.
+        initial_epoch: int
+            Number of epochs trained before this run, when resuming.
+        max_to_keep: int
+            Number of checkpoints to keep.
+        run_config: dict
+            Config of the run (e.g. seed, label noise, sample size and number of epochs), see restore_checkpoint.
+        """
+        super().__init__()
+
+        self.checkpoint_dir = checkpoint_dir
+        self.every_n_epochs = every_n_epochs
+        self.lr_schedule = lr_schedule
+        self.max_to_keep = max_to_keep
+        self.run_config = run_config
+
+        self.history = {k: list(v) if isinstance(v, list) else v for k, v in (history or {}).items()}
+        self.n_epochs = initial_epoch
+
+    def on_train_begin(self, logs=None):
+        checkpoint = tf.train.Checkpoint(model=self.model, optimizer=self.model.optimizer)
+        self.manager = tf.train.CheckpointManager(
+            checkpoint, self.checkpoint_dir, max_to_keep=self.max_to_keep
+        )
+
+    def on_epoch_end(self, epoch, logs=None):
+        # metrics first logged after a restart are NaN for the earlier epochs.
+        for key, value in (logs or {}).items():
+            self.history.setdefault(key, [float("nan")] * epoch).append(value)
+
+        self.n_epochs = epoch + 1
+        if self.n_epochs % self.every_n_epochs == 0:
+            self.save()
+
+    def on_train_end(self, logs=None):
+        # always save at the end, the history may have been updated since the last checkpoint (see async_evaluator).
+        self.save()
+
+    def save(self):
+        self.manager.save(checkpoint_number=self.n_epochs)
+
+        state = {
+            "epoch": self.n_epochs,
+            "history": self.history,
+            "lr_gradient_steps": getattr(self.lr_schedule, "gradient_steps", None),
+            "run_config": self.run_config,
+        }
+
+        # write the state file last, and atomically, so it always points to a complete checkpoint.
+        tmp_path = os.path.join(self.checkpoint_dir, "state.pkl.tmp")
+        with open(tmp_path, "wb") as f:
+            pkl.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.checkpoint_dir, "state.pkl"))
+
+
+def restore_checkpoint(model, checkpoint_dir, lr_schedule=None, run_config=None):
+    """
+    Restore the latest EpochCheckpoint of a model (and its optimizer) from checkpoint_dir.
+
+    The model must have been built with the same architecture and compiled with the same kind of optimizer.
+    Returns the number of finished epochs (the initial_epoch to pass to model.fit) and the history of those
+    epochs, or (0, {}) if there is no checkpoint to resume from. A checkpoint written with another run_config
+    (e.g. another seed or number of epochs, or before run configs were saved) is ignored, and overwritten
+    by the first checkpoint of the new run.
+
+    Parameters
+    ----------
+    model: tf.keras.Model
+    checkpoint_dir: str
+        Directory the EpochCheckpoint callback wrote to.
+    lr_schedule: inverse_squareroot_lr
+        Optional learning rate schedule whose step counter is restored.
+    run_config: dict
+        Config of the run being trained, as passed to EpochCheckpoint.
+    """
+    state = _load_state(checkpoint_dir, run_config)
+    if state is None:
+        return 0, {}
+
+    checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer)
+    checkpoint.restore(
+        os.path.join(checkpoint_dir, f"ckpt-{state['epoch']}")
+    ).assert_existing_objects_matched()
+
+    if lr_schedule is not None and state["lr_gradient_steps"] is not None:
+        lr_schedule.gradient_steps = state["lr_gradient_steps"]
+
+    return state["epoch"], state["history"]
+
+
+def checkpoint_epoch(checkpoint_dir, run_config=None):
+    """
+    Number of finished epochs of the latest EpochCheckpoint of run_config in checkpoint_dir, 0 if there is
+    none (see restore_checkpoint).
+    """
+    state = _load_state(checkpoint_dir, run_config)
+    return 0 if state is None else state["epoch"]
+
+
+def remove_checkpoint(checkpoint_dir):
+    """ Delete the checkpoints of a run, once its final weights and results are saved. """
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+
+def _load_state(checkpoint_dir, run_config):
+    """ The state of the latest EpochCheckpoint in checkpoint_dir, or None if there is none of run_config. """
+    state_path = os.path.join(checkpoint_dir, "state.pkl")
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path, "rb") as f:
+        state = pkl.load(f)
+
+    if state.get("run_config") != run_config:
+        print(f"ignoring the checkpoint in {checkpoint_dir}, it was written by a run with another config")
+        return None
+    return state
+
+
+def restore_trained_model(model, weights_path, history, lr_schedule=None):
+    """
+    Restore a model saved with model.save_weights at the end of a finished run, to train it further.
+
+    model.save_weights also saves the variables of the optimizer the model was compiled with, so the
+    optimizer state is restored along with the weights. The inverse_squareroot_lr step counter, which is
+    not saved, is set from the restored optimizer step. Returns the number of epochs the model was trained
+    for (the initial_epoch to pass to model.fit) and a copy of its history.
+
+    Parameters
+    ----------
+    model: tf.keras.Model
+        Model with the same architecture, compiled with the same kind of optimizer.
+    weights_path: str
+        Path the weights were saved to, e.g. trained_model_weights_{data_set}/.../{model_id}.
+    history: dict
+        Keras-style history of the finished run, as stored in the results .pkl file.
+    lr_schedule: inverse_squareroot_lr
+        Optional learning rate schedule whose step counter is restored.
+    """
+    model.load_weights(weights_path).assert_existing_objects_matched()
+
+    if lr_schedule is not None:
+        lr_schedule.gradient_steps = int(model.optimizer.iterations.numpy())
+
+    history = {k: list(v) if isinstance(v, list) else v for k, v in history.items()}
+    return len(history["loss"]), history
@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import time
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+
+ARRAY_NAMES = ["x_train", "y_train", "x_test", "y_test"]
+
+
+def data_cache_key(config):
+    """
+    Returns the directory name used to cache a data set with the given load_data configuration.
+
+    config is a dictionary of the form:
+    {
+        'data_set': str,
+        'label_noise': float,
+        'seed': int,
+        'sample_size': int or None,
+        'augment_data': bool,
+    }
+    """
+    key = "{}_{}pct_noise_seed_{}_n_{}".format(
+        # data_set may be a local path such as 'npz:/data/cifar10.npz'.
+        re.sub(r"[^\w.-]", "_", config["data_set"]),
+        int(round(100 * config["label_noise"])),
+        config["seed"],
+        "all" if config["sample_size"] is None else config["sample_size"],
+    )
+
+    if config["augment_data"]:
+        key += "_augmented"
+
+    return key
+
+
+def load_cached_data(cache_dir, config):
+    """
+    Memory map the arrays of a previously cached data set.
+
+    Returns ((x_train, y_train), (x_test, y_test)) as read-only np.memmap arrays, or None if there is
+    no complete cache entry for the configuration.
+    """
+    path = os.path.join(cache_dir, data_cache_key(config))
+    manifest_path = os.path.join(path, "manifest.json")
+
+    # the manifest is written last, so an entry without one is incomplete.
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    if manifest["config"] != config:
+        raise Exception(
+            f"Data cache entry at {path} was created with {manifest['config']}, expected {config}."
+        )
+
+    x_train, y_train, x_test, y_test = [
+        np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAY_NAMES
+    ]
+
+    return (x_train, y_train), (x_test, y_test)
+
+
+def save_cached_data(cache_dir, config, data):
+    """
+    Write the final train and test arrays of a data set to the cache as .npy files plus a manifest, and
+    return them memory mapped from disk.
+
+    The entry is written to a temporary directory and renamed into place, so concurrent writers and
+    interrupted writes never leave a partially written entry behind.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Root directory of the data cache.
+    config: dict
+        load_data configuration, see data_cache_key.
+    data: tuple
+        ((x_train, y_train), (x_test, y_test)) arrays to cache.
+    """
+    path = os.path.join(cache_dir, data_cache_key(config))
+    tmp_path = path + ".tmp_%d" % os.getpid()
+    os.makedirs(tmp_path, exist_ok=True)
+
+    (x_train, y_train), (x_test, y_test) = data
+    arrays = dict(zip(ARRAY_NAMES, [x_train, y_train, x_test, y_test]))
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(array))
+
+    manifest = {
+        "config": config,
+        "arrays": {
+            name: {"shape": list(np.shape(array)), "dtype": str(np.asarray(array).dtype)}
+            for name, array in arrays.items()
+        },
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process cached the same configuration first, keep its entry.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return load_cached_data(cache_dir, config)
+
+
+class LRUDataCache:
+    """
+    In-process memoization of load_data results with a memory budget and least recently used eviction.
+
+    Values are stored as returned by load_data and shared between callers, NumPy arrays are marked
+    read-only so a caller cannot modify the data another sweep is training on.
+    """
+
+    def __init__(self, max_bytes=4 * 2 ** 30):
+        """
+        Parameters
+        ----------
+        max_bytes: int
+            Memory budget of the cache. Entries larger than the budget are never stored.
+        """
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> (value, size in bytes), ordered from least to most recently used.
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """ Returns the cached value for key, or None on a miss. """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value):
+        """ Store value under key, evicting the least recently used entries until it fits in the budget. """
+        n_bytes = _n_bytes(value)
+        if self.max_bytes < n_bytes:
+            return value
+
+        if key in self._entries:
+            self.n_bytes -= self._entries.pop(key)[1]
+
+        _set_read_only(value)
+        self._entries[key] = (value, n_bytes)
+        self.n_bytes += n_bytes
+        self._evict()
+
+        return value
+
+    def resize(self, max_bytes):
+        """ Change the memory budget, evicting entries if needed. """
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self.n_bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "n_bytes": self.n_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _evict(self):
+        while self.max_bytes < self.n_bytes:
+            _, (_, n_bytes) = self._entries.popitem(last=False)
+            self.n_bytes -= n_bytes
+            self.evictions += 1
+
+
+# cache shared by every call to load_data(..., memoize=True) in this process.
+memory_cache = LRUDataCache()
+
+
+def _n_bytes(value):
+    """ Total size in bytes of the NumPy arrays / tensors in a (nested) tuple or list. """
+    if isinstance(value, (tuple, list)):
+        return sum(_n_bytes(v) for v in value)
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+
+    if hasattr(value, "dtype") and hasattr(value, "shape"):
+        # tf.Tensor
+        return value.shape.num_elements() * value.dtype.size
+
+    return 0
+
+
+def _set_read_only(value):
+    if isinstance(value, (tuple, list)):
+        for v in value:
+            _set_read_only(v)
+
+    elif isinstance(value, np.ndarray):
+        value.flags.writeable = False
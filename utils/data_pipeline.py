@@ -0,0 +1,172 @@
+import tensorflow as tf
+import numpy as np
+
+from utils.augmentation import flip_pad_crop_batch
+
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+
+def make_data_pipeline(
+    x,
+    y,
+    batch_size=128,
+    training=True,
+    augment_data=False,
+    crop_height=40,
+    crop_width=40,
+    fill_value=125,
+    seed=None,
+    augment_backend="tf",
+):
+    """
+    Build a streaming tf.data pipeline over an in-memory data set.
+
+    Only an index vector is shuffled, so the shuffle buffer stays small regardless of the data set
+    size. Each batch is gathered, normalized to [0-1] and (optionally) augmented with a random flip and
+    pad-crop in a parallel map, then prefetched so the input stage overlaps with training. Every epoch
+    sees a fresh set of augmentations.
+
+    Parameters
+    ----------
+    x: np.array or tf.Tensor
+        Images with shape [n, height, width, channels]. Either uint8 in [0-255] or float32 in [0-1].
+        If both x and y are NumPy arrays, batches are gathered directly from them without copying the
+        data set into TensorFlow.
+    y: np.array or tf.Tensor
+        Labels with shape [n, 1].
+    batch_size: int
+        Size of the batches produced by the pipeline.
+    training: bool
+        if True, shuffle the data every epoch (and augment it when augment_data is set).
+    augment_data: bool
+        whether or not to use random cropping and horizontal flipping on each batch.
+    crop_height, crop_width: int
+        Padded image size used for the random crop, see augment_data_set in train_utils.
+    fill_value: int
+        Value (on the [0-255] scale) used to pad the images before cropping.
+    seed: int
+        Optional seed for the shuffle order.
+    augment_backend: str
+        'tf' to augment the normalized batch with random_flip_pad_crop, or 'numpy' to augment the raw
+        batch (before normalization, so uint8 batches move 4x less memory) with
+        utils.augmentation.flip_pad_crop_batch inside a tf.numpy_function.
+    """
+
+    # keep a single copy of the data in memory, batches are gathered from it by index.
+    if isinstance(x, np.ndarray) and isinstance(y, np.ndarray):
+        gather = _numpy_gather(x, y)
+    else:
+        x, y = tf.convert_to_tensor(x), tf.convert_to_tensor(y)
+        gather = lambda idx: (tf.gather(x, idx), tf.gather(y, idx))
+
+    n_examples = int(x.shape[0])
+
+    data_set = tf.data.Dataset.range(n_examples)
+    if training:
+        data_set = data_set.shuffle(n_examples, seed=seed, reshuffle_each_iteration=True)
+    data_set = data_set.batch(batch_size)
+
+    augment = training and augment_data
+
+    def get_batch(idx):
+        images, labels = gather(idx)
+
+        if augment and augment_backend == "numpy":
+            images = numpy_flip_pad_crop(images, crop_height, crop_width, fill_value)
+
+        images = normalize_images(images)
+
+        if augment and augment_backend == "tf":
+            images = random_flip_pad_crop(
+                images, crop_height, crop_width, fill_value=fill_value / 255
+            )
+
+        return images, labels
+
+    data_set = data_set.map(get_batch, num_parallel_calls=AUTOTUNE)
+
+    return data_set.prefetch(AUTOTUNE)
+
+
+def _numpy_gather(x, y):
+    """ Returns a function which gathers a batch of (x, y) by index from NumPy arrays inside a tf.data map. """
+
+    def gather(idx):
+        images, labels = tf.numpy_function(
+            lambda i: (x[i], y[i]), [idx], (tf.as_dtype(x.dtype), tf.as_dtype(y.dtype))
+        )
+        images.set_shape((None,) + x.shape[1:])
+        labels.set_shape((None,) + y.shape[1:])
+        return images, labels
+
+    return gather
+
+
+def numpy_flip_pad_crop(images, crop_height=40, crop_width=40, fill_value=125):
+    """
+    tf.data compatible wrapper around utils.augmentation.flip_pad_crop_batch.
+
+    fill_value is on the [0-255] scale and is rescaled for float (already normalized) images.
+    """
+    if images.dtype != tf.uint8:
+        fill_value = fill_value / 255
+
+    augmented = tf.numpy_function(
+        lambda batch: flip_pad_crop_batch(batch, crop_height, crop_width, fill_value),
+        [images],
+        images.dtype,
+    )
+    augmented.set_shape(images.shape)
+    return augmented
+
+
+def normalize_images(images):
+    """ Cast a batch of images to tf.float32 in the range [0-1]. Float inputs are assumed to already be normalized. """
+    if images.dtype == tf.uint8:
+        return tf.cast(images, tf.float32) / 255
+
+    return tf.cast(images, tf.float32)
+
+
+def random_flip_pad_crop(images, crop_height=40, crop_width=40, fill_value=125 / 255):
+    """
+    Randomly flip and pad-crop every image of a batch, using a different flip and offset per image.
+
+    Equivalent to padding each image by (crop_height - height, crop_width - width) pixels on every side
+    with fill_value and taking a random crop of the original size, but without materializing the padded
+    batch: the crop is computed as a gather of shifted row / column indices.
+
+    Parameters
+    ----------
+    images: tf.Tensor
+        Batch of images with shape [batch, height, width, channels].
+    crop_height, crop_width: int
+        Padded image size, as in augment_data_set.
+    fill_value: float
+        Value used for the pixels which fall in the padding.
+    """
+
+    height, width = images.shape[1], images.shape[2]
+    pad_height, pad_width = crop_height - height, crop_width - width
+    batch = tf.shape(images)[0]
+
+    # offset of each crop relative to the original image, in [-pad, pad].
+    offset_height = tf.random.uniform([batch, 1], 0, 2 * pad_height + 1, dtype=tf.int32) - pad_height
+    offset_width = tf.random.uniform([batch, 1], 0, 2 * pad_width + 1, dtype=tf.int32) - pad_width
+
+    rows = tf.range(height)[None, :] + offset_height
+    cols = tf.range(width)[None, :] + offset_width
+
+    # flipping the crop is the same as reading its columns in reverse order.
+    flip = tf.random.uniform([batch, 1]) < 0.5
+    cols = tf.where(flip, width - 1 - cols, cols)
+
+    row_mask = (0 <= rows) & (rows < height)
+    col_mask = (0 <= cols) & (cols < width)
+
+    images = tf.gather(images, tf.clip_by_value(rows, 0, height - 1), axis=1, batch_dims=1)
+    images = tf.gather(images, tf.clip_by_value(cols, 0, width - 1), axis=2, batch_dims=1)
+
+    mask = row_mask[:, :, None, None] & col_mask[:, None, :, None]
+    return tf.where(mask, images, tf.cast(fill_value, images.dtype))
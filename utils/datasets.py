@@ -0,0 +1,307 @@
+import os
+import re
+import glob
+import json
+from functools import partial
+
+import numpy as np
+import tensorflow as tf
+
+from utils.data_pipeline import AUTOTUNE, normalize_images, random_flip_pad_crop
+from utils.evaluation import test_subsample_indices
+
+
+def _keras_loader(name):
+    return lambda: getattr(tf.keras.datasets, name).load_data()
+
+
+# name -> function returning ((x_train, y_train), (x_test, y_test)) as NumPy arrays.
+DATASETS = {
+    "cifar10": _keras_loader("cifar10"),
+    "cifar100": _keras_loader("cifar100"),
+    "mnist": _keras_loader("mnist"),
+}
+
+# name -> directory of TFRecord shards, see load_streaming_data.
+STREAMING_DATASETS = {}
+
+
+def register_dataset(name, loader=None, tfrecord_dir=None):
+    """
+    Register a data set under name, so it can be passed as the data_set argument of load_data and the
+    training functions.
+
+    Parameters
+    ----------
+    name: str
+        Name of the data set. Also used in the results and weights paths.
+    loader: callable
+        Function taking no arguments and returning ((x_train, y_train), (x_test, y_test)) NumPy arrays,
+        e.g. functools.partial(load_npz, "/data/cifar10.npz").
+    tfrecord_dir: str
+        Directory of TFRecord shards to stream from instead (see write_tfrecord_shards).
+    """
+    if (loader is None) == (tfrecord_dir is None):
+        raise Exception("Please specify exactly one of loader or tfrecord_dir.")
+
+    if loader is not None:
+        DATASETS[name] = loader
+    else:
+        STREAMING_DATASETS[name] = tfrecord_dir
+
+
+def get_dataset_loader(data_set):
+    """
+    Returns the loader of an in-memory data set.
+
+    data_set is either a registered name, or a local path prefixed with its format:
+        'npz:/path/to/data.npz'    - see load_npz
+        'imagedir:/path/to/images' - see load_image_directory
+    """
+    if data_set in DATASETS:
+        return DATASETS[data_set]
+
+    scheme, _, path = data_set.partition(":")
+    if scheme in LOCAL_FORMATS:
+        return partial(LOCAL_FORMATS[scheme], path)
+
+    raise Exception(
+        f"Please enter a data set from the following options: {list(DATASETS)}, "
+        f"or a local path prefixed with one of {list(LOCAL_FORMATS) + ['tfrecord']}"
+    )
+
+
+def is_streaming_data_set(data_set):
+    """ True if data_set is read from TFRecord shards rather than loaded into memory. """
+    return data_set in STREAMING_DATASETS or data_set.startswith("tfrecord:")
+
+
+def data_set_name(data_set):
+    """ Short name of a data set for use in file paths, e.g. 'npz:/data/cifar10.npz' -> 'cifar10'. """
+    if data_set in DATASETS or data_set in STREAMING_DATASETS:
+        return data_set
+
+    path = data_set.partition(":")[2].rstrip("/")
+    name = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+def load_npz(path):
+    """
+    Load a data set from a .npz file with the arrays 'x_train', 'y_train', 'x_test' and 'y_test'. The labels
+    are returned with shape [n, 1] like the Keras data sets, whether they were saved as [n] or [n, 1].
+    """
+    with np.load(path) as data:
+        return (
+            (data["x_train"], data["y_train"].reshape(-1, 1)),
+            (data["x_test"], data["y_test"].reshape(-1, 1)),
+        )
+
+
+def load_image_directory(path):
+    """
+    Load a data set from a directory of images with the layout
+
+        path/train/<class_name>/*.png
+        path/test/<class_name>/*.png
+
+    Labels are assigned by the sorted order of the class directory names in path/train.
+    """
+    class_names = sorted(os.listdir(os.path.join(path, "train")))
+
+    def load_split(split):
+        images, labels = [], []
+        for label, class_name in enumerate(class_names):
+            for file_name in sorted(glob.glob(os.path.join(path, split, class_name, "*"))):
+                images.append(tf.io.decode_image(tf.io.read_file(file_name)).numpy())
+                labels.append(label)
+
+        return np.stack(images), np.array(labels, dtype=np.uint8)[:, None]
+
+    return load_split("train"), load_split("test")
+
+
+LOCAL_FORMATS = {"npz": load_npz, "imagedir": load_image_directory}
+
+
+def write_tfrecord_shards(data, path, n_shards=16):
+    """
+    Write an in-memory data set to TFRecord shards which can be streamed with load_streaming_data.
+
+    Parameters
+    ----------
+    data: tuple
+        ((x_train, y_train), (x_test, y_test)) uint8 images and integer labels.
+    path: str
+        Output directory. Shards are written as path/{split}-{i:05d}.tfrecord along with dataset_info.json,
+        which also records the number of examples of every shard.
+    n_shards: int
+        Number of shards to split each of the train and test sets into.
+    """
+    os.makedirs(path, exist_ok=True)
+    (x_train, y_train), (x_test, y_test) = data
+
+    shard_sizes = {}
+    for split, x, y in [("train", x_train, y_train), ("test", x_test, y_test)]:
+        shards = np.array_split(np.arange(x.shape[0]), n_shards)
+        shard_sizes[split] = [int(idx.shape[0]) for idx in shards]
+        for shard, idx in enumerate(shards):
+            with tf.io.TFRecordWriter(os.path.join(path, f"{split}-{shard:05d}.tfrecord")) as writer:
+                for i in idx:
+                    example = tf.train.Example(
+                        features=tf.train.Features(
+                            feature={
+                                "image": tf.train.Feature(
+                                    bytes_list=tf.train.BytesList(value=[x[i].tobytes()])
+                                ),
+                                "label": tf.train.Feature(
+                                    int64_list=tf.train.Int64List(value=[int(y[i].squeeze())])
+                                ),
+                            }
+                        )
+                    )
+                    writer.write(example.SerializeToString())
+
+    info = {
+        "image_shape": list(x_train.shape[1:]),
+        "n_classes": int(y_train.max()) + 1,
+        "n_train": int(x_train.shape[0]),
+        "n_test": int(x_test.shape[0]),
+        "shard_sizes": shard_sizes,
+    }
+    with open(os.path.join(path, "dataset_info.json"), "w") as f:
+        json.dump(info, f, indent=2)
+
+
+def load_streaming_data(
+    data_set,
+    label_noise,
+    batch_size=128,
+    augment_data=False,
+    sample_size=None,
+    seed=None,
+    eval_sample_size=None,
+    shuffle_buffer=10_000,
+    cycle_length=4,
+):
+    """
+    Stream a data set stored as TFRecord shards (see write_tfrecord_shards) without loading it into memory.
+
+    Shards are read with parallel interleaved reads. Every example is indexed by its position in the sorted
+    shards (the offset of its shard plus its position in the shard), so its index does not depend on the
+    order the reads are interleaved in (cycle_length). The subsample and label noise are drawn up front over
+    those indices with the same semantics as load_data (sample_size examples without replacement, then
+    int(label_noise * n) of them get a different random label), and applied per example as it is read. Only
+    an index mask and a label offset per training example are kept in memory. The test subsample of
+    eval_sample_size is drawn over the test indices like utils.evaluation.subsample_test_set.
+
+    Returns the batched train and test tf.data pipelines, the image shape, the number of training examples
+    and the number of classes.
+
+    Parameters
+    ----------
+    data_set: str
+        Registered streaming data set name, or 'tfrecord:/path/to/shards'.
+    label_noise: float
+        percentage of training data to add noise to
+    batch_size: int
+        Size of the batches produced by the pipelines.
+    augment_data: bool
+        whether or not to use random cropping and horizontal flipping on each training batch.
+    sample_size: int
+        The size of the training set to use. Default is the whole training set.
+    seed: int
+        Seed used to draw the subsample and the label noise.
+    eval_sample_size: int
+        if given, evaluate on a fixed random subsample (drawn with seed) of this many test examples.
+    shuffle_buffer: int
+        Number of examples in the training shuffle buffer.
+    cycle_length: int
+        Number of shards read concurrently.
+    """
+    path = STREAMING_DATASETS.get(data_set, data_set.partition(":")[2])
+
+    with open(os.path.join(path, "dataset_info.json"), "r") as f:
+        info = json.load(f)
+
+    image_shape, n_classes, n_train = info["image_shape"], info["n_classes"], info["n_train"]
+    files = {split: sorted(glob.glob(os.path.join(path, f"{split}-*.tfrecord"))) for split in ["train", "test"]}
+
+    # shards written before the shard sizes were recorded were split with np.array_split.
+    shard_sizes = info.get("shard_sizes") or {
+        split: [idx.shape[0] for idx in np.array_split(np.arange(info["n_" + split]), len(files[split]))]
+        for split in ["train", "test"]
+    }
+
+    # draw the subsample and the noisy labels over the example indices.
+    rng = np.random.default_rng(seed)
+    sample_idx = np.arange(n_train)
+    if sample_size is not None:
+        sample_idx = rng.choice(n_train, sample_size, replace=False)
+
+    keep = np.zeros(n_train, dtype=bool)
+    keep[sample_idx] = True
+
+    label_offsets = np.zeros(n_train, dtype=np.int64)
+    if 0 < label_noise:
+        noisy_idx = rng.choice(sample_idx, int(label_noise * sample_idx.shape[0]), replace=False)
+        label_offsets[noisy_idx] = rng.integers(1, n_classes, noisy_idx.shape[0])
+
+    keep, label_offsets = tf.constant(keep), tf.constant(label_offsets)
+
+    test_keep = np.ones(info["n_test"], dtype=bool)
+    if eval_sample_size is not None:
+        test_keep[:] = False
+        test_keep[test_subsample_indices(info["n_test"], eval_sample_size, seed)] = True
+    test_keep = tf.constant(test_keep)
+
+    def parse(serialized):
+        features = tf.io.parse_single_example(
+            serialized,
+            {
+                "image": tf.io.FixedLenFeature([], tf.string),
+                "label": tf.io.FixedLenFeature([], tf.int64),
+            },
+        )
+        image = tf.reshape(tf.io.decode_raw(features["image"], tf.uint8), image_shape)
+        return image, tf.reshape(features["label"], [1])
+
+    def read_split(split):
+        """ (index, serialized example) pairs of a split, indexed by the shard offset and position in the shard. """
+        offsets = np.concatenate([[0], np.cumsum(shard_sizes[split])[:-1]]).astype(np.int64)
+        shards = tf.data.Dataset.from_tensor_slices((files[split], offsets))
+        return shards.interleave(
+            lambda file, offset: tf.data.TFRecordDataset(file).enumerate(offset),
+            cycle_length=cycle_length,
+            num_parallel_calls=AUTOTUNE,
+            deterministic=True,
+        )
+
+    def add_noise(idx, serialized):
+        image, label = parse(serialized)
+        return image, (label + label_offsets[idx]) % n_classes
+
+    train_data = read_split("train")
+    train_data = train_data.filter(lambda idx, _: keep[idx])
+    train_data = train_data.map(add_noise, num_parallel_calls=AUTOTUNE)
+    train_data = train_data.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    def prepare_batch(images, labels):
+        images = normalize_images(images)
+        if augment_data:
+            images = random_flip_pad_crop(images)
+        return images, labels
+
+    train_data = train_data.batch(batch_size).map(prepare_batch, num_parallel_calls=AUTOTUNE)
+    test_data = read_split("test").filter(lambda idx, _: test_keep[idx])
+    test_data = test_data.map(lambda idx, serialized: parse(serialized), num_parallel_calls=AUTOTUNE)
+    test_data = test_data.batch(batch_size)
+    test_data = test_data.map(lambda images, labels: (normalize_images(images), labels))
+
+    return (
+        train_data.prefetch(AUTOTUNE),
+        test_data.prefetch(AUTOTUNE),
+        image_shape,
+        int(sample_idx.shape[0]),
+        n_classes,
+    )
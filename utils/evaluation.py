@@ -0,0 +1,192 @@
+import queue
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+def evaluation_epochs(n_epochs, eval_schedule=None, eval_points=100):
+    """
+    Returns the (1-based) epochs to evaluate the test set at, in the validation_freq format of model.fit.
+
+    The final epoch is always evaluated, so the final test loss and accuracy are exact.
+
+    Parameters
+    ----------
+    n_epochs: int
+        Total number of epochs.
+    eval_schedule: int or str
+        None to evaluate every epoch, an int k to evaluate every k epochs, or 'log' to evaluate at
+        eval_points log-spaced epochs (every epoch at first, then increasingly rarely), which matches the
+        symlog epoch axis of the seaplots.
+    eval_points: int
+        Number of log-spaced evaluations. Fewer epochs are evaluated when they round to the same epoch.
+    """
+    if eval_schedule is None:
+        epochs = np.arange(1, n_epochs + 1)
+    elif eval_schedule == "log":
+        epochs = np.round(np.geomspace(1, n_epochs, eval_points))
+    elif isinstance(eval_schedule, int):
+        epochs = np.arange(eval_schedule, n_epochs + 1, eval_schedule)
+    else:
+        raise Exception(f"Unknown eval_schedule '{eval_schedule}', use None, an int or 'log'.")
+
+    return sorted(set(int(epoch) for epoch in epochs) | {n_epochs})
+
+
+class fill_skipped_evaluations(tf.keras.callbacks.Callback):
+    """
+    Log NaN test metrics for the epochs skipped by validation_freq, so every history list keeps one value per
+    epoch (as read by load_results). Must be the first callback, so the other callbacks see the filled logs.
+    """
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is None:
+            return
+
+        for key in [key for key in logs if not key.startswith("val_")]:
+            logs.setdefault("val_" + key, np.nan)
+
+
+def add_val_epochs(history):
+    """
+    Add the 'val_epochs' entry to a history with NaN test metrics for skipped evaluations: the (0-based)
+    indices of the epochs the test set was evaluated at.
+    """
+    val_key = min(key for key in history if key.startswith("val_") and key.endswith("accuracy"))
+    history["val_epochs"] = [i for i, value in enumerate(history[val_key]) if not np.isnan(value)]
+    return history
+
+
+def test_subsample_indices(n_test, eval_sample_size, seed=None):
+    """ Sorted indices of a fixed random subsample of eval_sample_size of n_test test examples. """
+    return np.sort(np.random.default_rng(seed).choice(n_test, eval_sample_size, replace=False))
+
+
+def subsample_test_set(x_test, y_test, eval_sample_size, seed=None):
+    """
+    Returns a fixed random subsample of eval_sample_size test examples, in their original order.
+    Works on both NumPy arrays and tensors.
+    """
+    idx = test_subsample_indices(y_test.shape[0], eval_sample_size, seed)
+
+    if isinstance(x_test, np.ndarray):
+        return x_test[idx], y_test[idx]
+    return tf.gather(x_test, idx), tf.gather(y_test, idx)
+
+
+class async_evaluator(tf.keras.callbacks.Callback):
+    """
+    Evaluate weight snapshots in a background thread instead of inside model.fit, so that training does not
+    wait for the evaluations.
+
+    At the end of every scheduled epoch the weights of the model are copied into a bounded in-memory buffer,
+    and a worker thread loads them into its own copy of the model and evaluates it on every data set of
+    eval_sets. The results are logged under the data set's prefix (e.g. 'val_loss', 'clean_train_accuracy'),
+    with NaN for the epochs which were not evaluated, and written back into the history by apply (or
+    directly into the history attribute, e.g. the history of an EpochCheckpoint, as results come in).
+
+    Must be the first callback, so the other callbacks see the NaN filled logs.
+    """
+
+    def __init__(self, make_model, eval_sets, eval_epochs=None, buffer_size=4):
+        """
+        Parameters
+        ----------
+        make_model: callable
+            Returns a new compiled and built model with the architecture of the trained model.
+        eval_sets: dict
+            tf.data.Datasets of (images, labels) batches to evaluate, keyed by their log prefix, e.g.
+            {'val_': test_data}.
+        eval_epochs: list[int]
+            The (1-based) epochs to evaluate, see evaluation_epochs. Default is every epoch.
+        buffer_size: int
+            Maximum number of snapshots waiting for evaluation. Training blocks when the buffer is full, which
+            bounds the memory of the snapshots.
+        """
+        super().__init__()
+
+        self.make_model = make_model
+        self.eval_sets = eval_sets
+        self.eval_epochs = None if eval_epochs is None else set(eval_epochs)
+        self.snapshots = queue.Queue(buffer_size)
+
+        # evaluation results keyed by (0-based) epoch, written by the worker thread.
+        self.results = {}
+        self.lock = threading.Lock()
+        self.error = None
+        self.history = None
+
+    def on_train_begin(self, logs=None):
+        self.last_epoch, self.last_snapshot_epoch = None, None
+        self.thread = threading.Thread(target=self._evaluate_snapshots, daemon=True)
+        self.thread.start()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.history is not None:
+            self.apply(self.history)
+
+        if logs is not None:
+            prefixes = tuple(self.eval_sets)
+            for key in [key for key in logs if not key.startswith(prefixes)]:
+                for prefix in prefixes:
+                    logs.setdefault(prefix + key, np.nan)
+
+        self.last_epoch = epoch
+        if self.eval_epochs is None or epoch + 1 in self.eval_epochs:
+            self.snapshots.put((epoch, self.model.get_weights()))
+            self.last_snapshot_epoch = epoch
+
+    def on_train_end(self, logs=None):
+        # always evaluate the final epoch, e.g. of a run stopped early.
+        if self.last_epoch != self.last_snapshot_epoch:
+            self.snapshots.put((self.last_epoch, self.model.get_weights()))
+
+        self.snapshots.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+        if self.history is not None:
+            self.apply(self.history)
+
+    def apply(self, history):
+        """ Write the finished evaluations into a history with one (NaN filled) value per epoch. """
+        with self.lock:
+            results = dict(self.results)
+
+        for epoch, epoch_results in results.items():
+            for key, value in epoch_results.items():
+                if key in history and epoch < len(history[key]):
+                    history[key][epoch] = value
+
+        return history
+
+    def _evaluate_snapshots(self):
+        model = None
+
+        while True:
+            snapshot = self.snapshots.get()
+            if snapshot is None:
+                return
+
+            # keep draining the buffer after an error, so training does not block on a full buffer.
+            if self.error is not None:
+                continue
+
+            epoch, weights = snapshot
+            try:
+                if model is None:
+                    model = self.make_model()
+                model.set_weights(weights)
+
+                epoch_results = {}
+                for prefix, data in self.eval_sets.items():
+                    for key, value in model.evaluate(data, verbose=0, return_dict=True).items():
+                        epoch_results[prefix + key] = float(value)
+
+                with self.lock:
+                    self.results[epoch] = epoch_results
+
+            except Exception as e:
+                self.error = e
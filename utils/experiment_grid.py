@@ -0,0 +1,294 @@
+"""
+Run a grid of double descent experiments described by a JSON config file.
+
+Every cell of the grid (one model family, data set, depth, width, label noise, sample size and seed)
+trains a single width with train_conv_nets or train_resnet18, and is merged into the usual results file
+of its sweep. Cells whose config hash has a completion marker, or whose model is already in its results
+file with saved weights, are skipped, so re-running a partly finished grid only trains the missing cells.
+
+Example config:
+
+    {
+        "grid": {
+            "model": ["conv_net"],
+            "data_set": "cifar10",
+            "depth": [3, 5],
+            "width": [1, 2, 4, 8, 16, 32, 64],
+            "label_noise_as_int": [0, 10, 20],
+            "sample_size": [null],
+            "seed": [0]
+        },
+        "train_kwargs": {"n_batch_steps": 500000, "data_augmentation": true},
+        "executor": "process",
+        "n_workers": 4
+    }
+
+Every grid entry is either a list of values or a single value. train_kwargs are passed on to the
+training function of every cell. Runs with a sample_size or seed are saved with a '_samples_{n}' and
+'_seed_{s}' suffix, so that they do not share a results file.
+
+Usage (from the repository root):
+    python -m utils.experiment_grid config.json [--executor serial] [--n_workers 4] [--dry_run]
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.results_store import load_metrics
+
+
+# grid axes and their default values.
+GRID_AXES = {
+    "model": "conv_net",
+    "data_set": "cifar10",
+    "depth": 5,
+    "width": None,
+    "label_noise_as_int": 10,
+    "sample_size": None,
+    "seed": None,
+}
+
+MODELS = ["conv_net", "resnet18"]
+
+
+def grid_cells(config):
+    """
+    Returns the cells of a grid config as a list of dictionaries with one value for every grid axis and the
+    shared train_kwargs. ResNet18 cells ignore the depth axis.
+    """
+    grid = config["grid"]
+    unknown = set(grid) - set(GRID_AXES)
+    if unknown:
+        raise Exception(f"Unknown grid axes {sorted(unknown)}, use {list(GRID_AXES)}.")
+    if grid.get("width") is None:
+        raise Exception("The grid needs a 'width' axis.")
+
+    axes = {}
+    for axis, default in GRID_AXES.items():
+        values = grid.get(axis, default)
+        axes[axis] = values if isinstance(values, list) else [values]
+
+    cells, hashes = [], set()
+    for values in itertools.product(*axes.values()):
+        cell = dict(zip(axes, values))
+
+        if cell["model"] not in MODELS:
+            raise Exception(f"Unknown model '{cell['model']}', use one of {MODELS}.")
+        if cell["model"] == "resnet18":
+            cell["depth"] = None
+
+        cell["train_kwargs"] = config.get("train_kwargs", {})
+        cell["hash"] = cell_hash(cell)
+
+        if cell["hash"] not in hashes:
+            hashes.add(cell["hash"])
+            cells.append(cell)
+
+    return cells
+
+
+def cell_hash(cell):
+    """ Hash of a cell's config (grid values and train_kwargs), stable across runs and machines. """
+    config = {key: value for key, value in cell.items() if key != "hash"}
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def cell_paths(cell):
+    """ Returns the model id, the weights path and the results .pkl path of a cell. """
+    from utils.datasets import data_set_name
+    from utils.train_utils import _conv_net_paths, _resnet_paths
+
+    train_kwargs = cell["train_kwargs"]
+    data_set = data_set_name(cell["data_set"])
+    prefix = train_kwargs.get("data_save_path_prefix", "")
+    suffix = _cell_suffix(cell)
+
+    if cell["model"] == "conv_net":
+        model_id = f"conv_net_depth_{cell['depth']}_width_{cell['width']}"
+        weights_dir, data_save_path = _conv_net_paths(
+            data_set, cell["depth"], cell["label_noise_as_int"], prefix, suffix
+        )
+    else:
+        model_id = f"ResNet18_width_{cell['width']}"
+        weights_dir, data_save_path = _resnet_paths(data_set, cell["label_noise_as_int"], prefix, suffix)
+
+    return model_id, weights_dir + model_id, data_save_path
+
+
+def is_completed(cell):
+    """
+    Whether a cell has been trained: it has a completion marker, or its model is in the results file and
+    its weights were saved (e.g. trained from a notebook before the grid was run). Both the .pkl results
+    file and the records of the results store are checked.
+    """
+    model_id, weights_path, data_save_path = cell_paths(cell)
+
+    if os.path.exists(_marker_path(cell, data_save_path)):
+        return True
+
+    try:
+        metrics = load_metrics(data_save_path)
+    except FileNotFoundError:
+        return False
+    return model_id in metrics and os.path.exists(weights_path + ".index")
+
+
+def run_cell(cell):
+    """ Train the width of a cell, merge it into its results file and write its completion marker. """
+    from utils.datasets import is_streaming_data_set
+    from utils.train_utils import train_conv_nets, train_resnet18
+
+    kwargs = {
+        **cell["train_kwargs"],
+        "data_set": cell["data_set"],
+        "label_noise_as_int": cell["label_noise_as_int"],
+        "sample_size": cell["sample_size"],
+        "seed": cell["seed"],
+        "data_save_path_suffix": _cell_suffix(cell),
+        "merge_results": True,
+    }
+    # reuse the data set of earlier cells in the same process. Streaming data sets are not held in memory.
+    kwargs.setdefault("memoize", cell["seed"] is not None and not is_streaming_data_set(cell["data_set"]))
+
+    if cell["model"] == "conv_net":
+        metrics = train_conv_nets(convnet_depth=cell["depth"], convnet_widths=[cell["width"]], **kwargs)
+    else:
+        metrics = train_resnet18(resnet_widths=[cell["width"]], **kwargs)
+
+    if kwargs.get("save", True):
+        _, _, data_save_path = cell_paths(cell)
+        marker_path = _marker_path(cell, data_save_path)
+        os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+        with open(marker_path, "w") as f:
+            json.dump({**cell, "finished": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=2)
+
+    return metrics
+
+
+def serial_executor(cells, **kwargs):
+    """ Train the cells one after another in this process. """
+    for i, cell in enumerate(cells):
+        run_cell(cell)
+        print(f"GRID: finished cell {cell['hash']} ({i + 1}/{len(cells)})")
+
+
+def process_executor(cells, n_workers=None, intra_op_threads=None, inter_op_threads=1, **kwargs):
+    """
+    Train the cells in a pool of n_workers worker processes, largest widths first. Finished cells are merged
+    into their results files under a file lock, see utils.sweep.
+    """
+    from utils.sweep import _init_worker
+
+    n_cpus = os.cpu_count()
+    if n_workers is None:
+        n_workers = min(len(cells), max(1, n_cpus // (intra_op_threads or 1)))
+    if intra_op_threads is None:
+        intra_op_threads = max(1, n_cpus // n_workers)
+
+    # TensorFlow is not fork safe, start every worker in a fresh interpreter.
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(intra_op_threads, inter_op_threads),
+    ) as executor:
+        futures = {
+            executor.submit(run_cell, cell): cell
+            for cell in sorted(cells, key=lambda cell: cell["width"], reverse=True)
+        }
+        for i, future in enumerate(as_completed(futures)):
+            future.result()
+            print(f"GRID: finished cell {futures[future]['hash']} ({i + 1}/{len(cells)})")
+
+
+# executors by name. An executor takes the list of cells to train and the executor options of the config.
+EXECUTORS = {
+    "serial": serial_executor,
+    "process": process_executor,
+}
+
+
+def run_grid(config, executor=None, dry_run=False, **executor_kwargs):
+    """
+    Train the cells of a grid config which have not been completed yet. Returns the list of cells trained
+    (or, with dry_run, to be trained).
+
+    Parameters
+    ----------
+    config: dict or str
+        Grid config, or the path to a JSON grid config file. See the module docstring.
+    executor: str
+        Name of the executor in EXECUTORS. Default is the config's 'executor', or 'serial'.
+    dry_run: bool
+        if True, only print the cells to train.
+    executor_kwargs:
+        Options of the executor, e.g. n_workers. Default to the config's 'n_workers', 'intra_op_threads'
+        and 'inter_op_threads'.
+    """
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+
+    executor = executor or config.get("executor", "serial")
+    if executor not in EXECUTORS:
+        raise Exception(f"Unknown executor '{executor}', use one of {list(EXECUTORS)}.")
+    for key in ["n_workers", "intra_op_threads", "inter_op_threads"]:
+        if executor_kwargs.get(key) is None and key in config:
+            executor_kwargs[key] = config[key]
+
+    cells = grid_cells(config)
+    todo = [cell for cell in cells if not is_completed(cell)]
+    print(f"GRID: {len(cells)} cells, {len(cells) - len(todo)} completed, {len(todo)} to train.")
+
+    for cell in todo:
+        print(f"GRID: {cell['hash']} " + ", ".join(f"{axis}={cell[axis]}" for axis in GRID_AXES))
+
+    if todo and not dry_run:
+        EXECUTORS[executor](todo, **{k: v for k, v in executor_kwargs.items() if v is not None})
+
+    return todo
+
+
+def _cell_suffix(cell):
+    """ Results file suffix of a cell, which keeps runs of different sample sizes and seeds apart. """
+    suffix = cell["train_kwargs"].get("data_save_path_suffix", "")
+    if cell["sample_size"] is not None:
+        suffix += f"_samples_{cell['sample_size']}"
+    if cell["seed"] is not None:
+        suffix += f"_seed_{cell['seed']}"
+    return suffix
+
+
+def _marker_path(cell, data_save_path):
+    """ Completion marker of a cell, in a 'grid_cells' directory next to its results file. """
+    return os.path.join(os.path.dirname(data_save_path), "grid_cells", cell["hash"] + ".json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("config", help="path to the JSON grid config")
+    parser.add_argument("--executor", choices=list(EXECUTORS), default=None)
+    parser.add_argument("--n_workers", type=int, default=None)
+    parser.add_argument("--intra_op_threads", type=int, default=None)
+    parser.add_argument("--inter_op_threads", type=int, default=None)
+    parser.add_argument("--dry_run", action="store_true", help="only list the cells to train")
+    args = parser.parse_args()
+
+    run_grid(
+        args.config,
+        executor=args.executor,
+        dry_run=args.dry_run,
+        n_workers=args.n_workers,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Follow training runs while they train, from the per-epoch metric streams written by metrics_stream.
+
+With live_metrics=True, the training functions of utils.train_utils append one JSON line per epoch to the
+stream of every run:
+
+    experimental_results_{data_set}/live_metrics/{sweep}/{model_id}.jsonl
+
+Every training session of a run starts with a {"start": epoch, ...} line (the first epoch it trains), and
+every finished epoch adds an {"epoch": epoch, "loss": ..., "accuracy": ..., ...} line. Test metrics of
+epochs which were not evaluated are null, and evaluations of an async_evaluator are added as they finish
+with a later line of the same epoch. A reader applies the lines in order: a start line cuts the history of
+the run back to its first epoch (e.g. a run restarted from a checkpoint or from scratch), and an epoch
+line sets the metrics of its epoch.
+
+MetricsTail keeps the offset of every stream and only reads the bytes written since the last poll, so
+following a sweep costs the same however long its runs are. serve runs a small HTTP server showing the
+seaplot and the final and optimal early stopping curves (see utils.visualizations) of every sweep, which
+are rendered again only when their streams changed.
+
+Usage (from the repository root):
+    python -m utils.live_metrics [--port 8000] [--refresh 30] [--max_epochs 512]
+"""
+
+import os
+import io
+import glob
+import json
+import html
+import argparse
+import http.server
+import urllib.parse
+
+import numpy as np
+
+from utils.results_catalog import model_width, pad_histories
+
+
+LIVE_DIR = "live_metrics"
+
+
+def stream_path(data_save_path, model_id):
+    """ Path of the metric stream of a run, given the .pkl results path of its sweep (see _conv_net_paths). """
+    results_dir, name = os.path.split(data_save_path)
+    return os.path.join(results_dir, LIVE_DIR, name[: -len(".pkl")], model_id + ".jsonl")
+
+
+def stream_record(epoch, logs, log_prefix=""):
+    """
+    The stream line of an epoch's Keras logs, keeping the metrics of log_prefix (e.g. 'tower_0_', see
+    _tower_log_prefix) without the prefix. Non-finite values are written as null.
+    """
+    record = {"epoch": int(epoch)}
+
+    for key, value in (logs or {}).items():
+        is_val = key.startswith("val_")
+        name = key[len("val_") :] if is_val else key
+        if not name.startswith(log_prefix):
+            continue
+
+        value = float(value)
+        record[("val_" if is_val else "") + name[len(log_prefix) :]] = value if np.isfinite(value) else None
+
+    return record
+
+
+class MetricsTail:
+    """
+    Incremental reader of the metric streams of every experimental_results_* directory under root.
+
+    Runs are kept as {sweep key: {model_id: {metric: list}}}, where the sweep key is
+    '{data_set}/{sweep}' as in utils.aggregation, and the lists have NaN for missing values.
+    """
+
+    def __init__(self, root="."):
+        self.root = root
+        self.runs = {}
+
+        # byte offset and unfinished last line of every stream.
+        self.offsets = {}
+        self.partial = {}
+
+    def poll(self):
+        """ Read the lines appended to the streams since the last poll. Returns the keys of the changed sweeps. """
+        changed = set()
+
+        for path in sorted(glob.glob(os.path.join(self.root, "experimental_results_*", LIVE_DIR, "*", "*.jsonl"))):
+            run_dir, name = os.path.split(path)
+            results_dir = os.path.dirname(os.path.dirname(run_dir))
+            key = os.path.basename(results_dir)[len("experimental_results_") :] + "/" + os.path.basename(run_dir)
+            model_id = name[: -len(".jsonl")]
+
+            size = os.path.getsize(path)
+            offset = self.offsets.get(path, 0)
+
+            # a stream which shrank was replaced, read it again from the start.
+            if size < offset:
+                offset, self.partial[path] = 0, b""
+                self.runs.get(key, {}).pop(model_id, None)
+                changed.add(key)
+            if size == offset:
+                continue
+
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read(size - offset)
+            self.offsets[path] = offset + len(data)
+
+            # the last line may still be being written.
+            lines = (self.partial.get(path, b"") + data).split(b"\n")
+            self.partial[path] = lines.pop()
+
+            history = self.runs.setdefault(key, {}).setdefault(model_id, {})
+            for line in lines:
+                if line.strip():
+                    _apply_record(history, json.loads(line))
+            changed.add(key)
+
+        return changed
+
+    def results(self, key):
+        """ The runs of a sweep in the format of utils.visualizations.load_results. """
+        model_ids = sorted(self.runs[key], key=model_width)
+        results = {"widths": [model_width(model_id) for model_id in model_ids]}
+        for metric in ["loss", "accuracy", "val_loss", "val_accuracy"]:
+            results[metric] = pad_histories([self.runs[key][model_id].get(metric, []) for model_id in model_ids])
+        return results
+
+
+def _apply_record(history, record):
+    if "start" in record:
+        for values in history.values():
+            del values[record["start"] :]
+        return
+
+    epoch = record["epoch"]
+    for metric, value in record.items():
+        if metric in ["epoch", "time"]:
+            continue
+
+        values = history.setdefault(metric, [])
+        values.extend([np.nan] * (epoch + 1 - len(values)))
+        values[epoch] = np.nan if value is None else value
+
+
+def render_figure(kind, results, max_epochs=512):
+    """ PNG bytes of the 'seaplot' or 'final' figure of a sweep's results, or None if there is nothing to plot. """
+    import matplotlib.pyplot as plt
+    from utils.visualizations import plot_loss_from_file, plot_loss_vs_epoch_from_file
+
+    # runs without a finished epoch, or (for the final curves) without an evaluated epoch, are left out.
+    column = "loss" if kind == "seaplot" else "val_accuracy"
+    keep = [i for i, values in enumerate(results[column]) if np.any(~np.isnan(values))]
+    if not keep:
+        return None
+    results = {key: [values[i] for i in keep] for key, values in results.items()}
+    results = {key: np.asarray(values) if key != "widths" else values for key, values in results.items()}
+
+    if kind == "seaplot":
+        x_idx = [width for width in results["widths"] if width == 1 or width % 8 == 0]
+        fig = plot_loss_vs_epoch_from_file(None, x_idx, max_epochs=max_epochs, show=False, results=results)
+    else:
+        fig = plot_loss_from_file(None, show=False, results=results)
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=60)
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def serve(root=".", port=8000, refresh=30, max_epochs=512):
+    """
+    Serve the live figures of every sweep with streams under root at http://localhost:{port}. The page
+    reloads every refresh seconds. Every request first reads the new lines of the streams.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    tail = MetricsTail(root)
+    versions, figures = {}, {}
+
+    def update():
+        for key in tail.poll():
+            versions[key] = versions.get(key, 0) + 1
+
+    class handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            update()
+            path = urllib.parse.unquote(urllib.parse.urlparse(self.path).path)
+
+            if path == "/":
+                self._send(200, "text/html", _index_page(sorted(tail.runs), versions, refresh).encode())
+                return
+
+            # /{kind}/{data_set}/{sweep}.png
+            kind, _, key = path.strip("/").partition("/")
+            key = key[: -len(".png")]
+            if kind not in ["seaplot", "final"] or key not in tail.runs:
+                self._send(404, "text/plain", b"not found")
+                return
+
+            # figures are rendered again only when their sweep changed.
+            cache_key = (kind, key)
+            if cache_key not in figures or figures[cache_key][0] != versions[key]:
+                figures[cache_key] = (versions[key], render_figure(kind, tail.results(key), max_epochs))
+
+            png = figures[cache_key][1]
+            if png is None:
+                self._send(404, "text/plain", b"no finished epochs yet")
+            else:
+                self._send(200, "image/png", png)
+
+        def _send(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    # a single threaded server: matplotlib figures are not thread safe.
+    server = http.server.HTTPServer(("localhost", port), handler)
+    print(f"LIVE: serving the metric streams under {os.path.abspath(root)} at http://localhost:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _index_page(keys, versions, refresh):
+    sections = []
+    for key in keys:
+        url = urllib.parse.quote(key)
+        sections.append(
+            f"<h2>{html.escape(key)}</h2>"
+            f'<img src="/seaplot/{url}.png?v={versions.get(key, 0)}" width="45%">'
+            f'<img src="/final/{url}.png?v={versions.get(key, 0)}" width="50%">'
+        )
+
+    body = "".join(sections) or "<p>No metric streams yet.</p>"
+    return (
+        f'<html><head><meta http-equiv="refresh" content="{refresh}"><title>Live metrics</title></head>'
+        f"<body>{body}</body></html>"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--root", default=".")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--refresh", type=int, default=30, help="seconds between page reloads")
+    parser.add_argument("--max_epochs", type=int, default=512, help="epoch bins of the seaplots")
+    args = parser.parse_args()
+
+    serve(args.root, args.port, args.refresh, args.max_epochs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Per-epoch timing of the training hot path, to tell whether a sweep is bound by its input, its gradient steps,
+its test set evaluations or its checkpoints.
+
+With profile=True, train_conv_nets and train_resnet18 time every epoch of a width with a training_profiler
+and write its summary to
+
+    experimental_results_{data_set}/profiles/{sweep}/{model_id}.json
+
+next to the sweep's results, with the per-epoch times and the totals of the run:
+
+    host_overhead - time outside of the training function between the gradient steps of the epoch (host
+                    side batching of in-memory arrays, the batch callbacks). It is not time spent waiting on
+                    a tf.data pipeline.
+    train_step    - time inside the training function. The batches of a tf.data pipeline are fetched inside
+                    the compiled step, so time waiting on a slow pipeline is counted here. See
+                    input_bound_fraction, or capture a trace for the exact split.
+    validation    - time from the last gradient step to the end of the epoch: the test set evaluation (or
+                    the weight snapshot of an async_evaluator).
+    save          - checkpoints at the end of the epoch, and saving the final weights and results.
+
+plus the training images per second and the peak resident memory of the process. For tf.data pipelines the
+throughput of the training input alone is measured before training (input_images_per_second), and
+input_bound_fraction = images_per_second / input_images_per_second is the share of the train_step time the
+input alone takes: close to 1 the run is bound by its input, not by its gradient steps. With profile_trace_steps
+= (start, stop), a TensorFlow profiler trace of the gradient steps start, ..., stop - 1 (counted from the
+start of training) is written to a '{model_id}_trace' directory next to the summary, for TensorBoard.
+
+Usage (from the repository root):
+    python -m utils.profiling experimental_results_cifar10
+"""
+
+import os
+import glob
+import json
+import time
+import resource
+import argparse
+import contextlib
+
+import numpy as np
+import tensorflow as tf
+
+
+PROFILE_DIR = "profiles"
+
+# per-epoch times of a profile.
+PHASES = ["host_overhead", "train_step", "validation", "save"]
+
+
+def profile_path(data_save_path, model_id):
+    """ Path of the profile summary of a run, given the .pkl results path of its sweep (see _conv_net_paths). """
+    results_dir, name = os.path.split(data_save_path)
+    return os.path.join(results_dir, PROFILE_DIR, name[: -len(".pkl")], model_id + ".json")
+
+
+class training_profiler(tf.keras.callbacks.Callback):
+    """
+    Time the phases of every epoch of a run, see the module docstring. Must be the last callback before
+    the checkpoint callbacks, so the times of the other callbacks are counted in their phase.
+    """
+
+    def __init__(self, n_train, trace_dir=None, trace_steps=None, input_data=None, probe_batches=20):
+        """
+        Parameters
+        ----------
+        n_train: int
+            Number of training images per epoch.
+        trace_dir: str
+            Directory to write the profiler trace to.
+        trace_steps: tuple(int, int)
+            if given, trace the gradient steps start, ..., stop - 1 with the TensorFlow profiler.
+        input_data: tf.data.Dataset
+            if given, time probe_batches batches of the training input alone before training.
+        probe_batches: int
+            Number of batches of the input probe, after one warm-up batch.
+        """
+        super().__init__()
+
+        self.n_train = n_train
+        self.trace_dir = trace_dir
+        self.trace_steps = trace_steps
+        self.input_data = input_data
+        self.probe_batches = probe_batches
+
+        self.epochs = []
+        self.final_save = 0.0
+        self.input_images_per_second = None
+        self.tracing = False
+
+        # gradient steps of the finished epochs.
+        self.n_steps = 0
+
+    def on_train_begin(self, logs=None):
+        if self.input_data is not None and self.input_images_per_second is None:
+            self.input_images_per_second = self._probe_input()
+        self.epoch_end = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        now = time.perf_counter()
+
+        # the checkpoint callbacks run after this one, until the next epoch starts.
+        if self.epoch_end is not None:
+            self.epochs[-1]["save"] = now - self.epoch_end
+
+        self.record = {"epoch": epoch, "n_steps": 0, **{phase: 0.0 for phase in PHASES}}
+        self.last_time = now
+
+    def on_train_batch_begin(self, batch, logs=None):
+        now = time.perf_counter()
+        self.record["host_overhead"] += now - self.last_time
+        self.last_time = now
+
+        # batch is the index of the first step of the call, see fit_compiled with steps_per_execution.
+        step = self.n_steps + batch
+        if self.trace_steps is not None and self.trace_steps[0] <= step < self.trace_steps[1] and not self.tracing:
+            tf.profiler.experimental.start(self.trace_dir)
+            self.tracing = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        self.record["train_step"] += now - self.last_time
+        self.last_time = now
+
+        # batch is the index of the last step of the call.
+        self.record["n_steps"] = batch + 1
+        if self.tracing and self.n_steps + batch + 1 >= self.trace_steps[1]:
+            self._stop_trace()
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.perf_counter()
+        self.record["validation"] = now - self.last_time
+        self.record["images_per_second"] = self.n_train / max(self.record["train_step"], 1e-12)
+        # ru_maxrss is reported in KB on linux.
+        self.record["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        self.epochs.append(self.record)
+        self.n_steps += self.record["n_steps"]
+        self.epoch_end = now
+
+    def on_train_end(self, logs=None):
+        if self.epoch_end is not None:
+            self.epochs[-1]["save"] = time.perf_counter() - self.epoch_end
+        if self.tracing:
+            self._stop_trace()
+
+    @contextlib.contextmanager
+    def time_save(self):
+        """ Count the time of the block (e.g. saving the final weights and results) as save time of the run. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.final_save += time.perf_counter() - start
+
+    def summary(self):
+        """ Totals, shares of the time and median throughput of the run, and the per-epoch times. """
+        totals = {phase: float(sum(record[phase] for record in self.epochs)) for phase in PHASES}
+        totals["save"] += self.final_save
+        total = sum(totals.values())
+
+        images_per_second = [record["images_per_second"] for record in self.epochs]
+        images_per_second = float(np.median(images_per_second)) if images_per_second else None
+
+        input_bound_fraction = None
+        if images_per_second is not None and self.input_images_per_second:
+            input_bound_fraction = images_per_second / self.input_images_per_second
+
+        return {
+            "n_epochs": len(self.epochs),
+            "total_seconds": total,
+            "seconds": totals,
+            "fractions": {phase: value / total if total else np.nan for phase, value in totals.items()},
+            "images_per_second": images_per_second,
+            "input_images_per_second": self.input_images_per_second,
+            "input_bound_fraction": input_bound_fraction,
+            "peak_rss_mb": max([record["peak_rss_mb"] for record in self.epochs], default=None),
+            "trace_dir": self.trace_dir if self.trace_steps is not None else None,
+            "epochs": self.epochs,
+        }
+
+    def save(self, path):
+        """ Write the summary to a JSON file. """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp_%d" % os.getpid()
+        with open(tmp_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _stop_trace(self):
+        tf.profiler.experimental.stop()
+        self.tracing = False
+
+    def _probe_input(self):
+        # the first batch fills the prefetch buffers.
+        iterator = iter(self.input_data)
+        next(iterator)
+
+        n_images, start = 0, time.perf_counter()
+        for _ in range(self.probe_batches):
+            try:
+                images, _ = next(iterator)
+            except StopIteration:
+                break
+            n_images += int(tf.shape(images)[0])
+
+        return n_images / max(time.perf_counter() - start, 1e-12)
+
+
+def compare_profiles(results_dir):
+    """ Print the totals of every profile summary of a results directory, one line per run. """
+    paths = sorted(glob.glob(os.path.join(results_dir, PROFILE_DIR, "*", "*.json")))
+
+    phases = " ".join(f"{phase:>13}" for phase in PHASES)
+    print(
+        f"{'run':<64} {'epochs':>6} {'total s':>9} {phases} {'img/s':>9} {'input img/s':>11} "
+        f"{'input bound':>11} {'rss MB':>8}"
+    )
+    for path in paths:
+        with open(path) as f:
+            profile = json.load(f)
+
+        run = os.path.relpath(path, os.path.join(results_dir, PROFILE_DIR))[: -len(".json")]
+        # profiles written before host_overhead was renamed from input_wait lack the new keys.
+        fractions = " ".join(f"{100 * profile['fractions'].get(phase, np.nan):>12.1f}%" for phase in PHASES)
+        keys = ["images_per_second", "input_images_per_second", "input_bound_fraction", "peak_rss_mb"]
+        rates = [profile.get(key) or np.nan for key in keys]
+        print(
+            f"{run:<64} {profile['n_epochs']:>6} {profile['total_seconds']:>9.1f} {fractions} "
+            f"{rates[0]:>9.0f} {rates[1]:>11.0f} {100 * rates[2]:>10.1f}% {rates[3]:>8.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("results_dirs", nargs="+", help="experimental_results_* directories")
+    args = parser.parse_args()
+
+    for results_dir in args.results_dirs:
+        compare_profiles(results_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Render the double descent plots of every results file into a directory of PNG files, without a display.
+
+For every sweep of the experimental_results_* directories (a legacy .pkl results file and/or its records in
+the results store) the loss/error vs width plot (plot_loss_from_file) and the seaplots
+(plot_loss_vs_epoch_from_file, with the epoch axis decimated to about screen resolution) are rendered. For
+every data set and model family a facet grid of the final and optimal early stopping test error vs width is
+rendered, with one panel per depth and label noise.
+
+Figures are rendered with the Agg backend in a pool of worker processes. The hash of the data of every figure
+and of the render settings is kept in 'report_cache.json' in the output directory, and only the figures
+whose hash changed are rendered again.
+
+Usage (from the repository root):
+    python -m utils.report [--out_dir reports] [--n_workers 4] [--max_epochs 512] [--force]
+"""
+
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+
+CACHE_NAME = "report_cache.json"
+
+
+def render_report(root=".", out_dir="reports", n_workers=None, max_epochs=512, dpi=100, force=False):
+    """
+    Render every figure whose data changed since the last report. Returns the paths of the rendered figures.
+
+    Parameters
+    ----------
+    root: str
+        Directory containing the experimental_results_* directories.
+    out_dir: str
+        Directory to save the figures and the cache of their hashes to.
+    n_workers: int
+        Number of rendering processes. Default is the number of CPUs.
+    max_epochs: int
+        Maximum number of epoch bins of the seaplots, see decimate_epochs.
+    dpi: int
+        Resolution of the saved figures.
+    force: bool
+        if True, render every figure again.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    cache_path = os.path.join(out_dir, CACHE_NAME)
+
+    cache = {}
+    if os.path.exists(cache_path) and not force:
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    settings = {"max_epochs": max_epochs, "dpi": dpi}
+    jobs = [
+        (name, kind, inputs, _hash_inputs(kind, inputs, settings))
+        for name, kind, inputs in report_figures(root)
+    ]
+    todo = [
+        job
+        for job in jobs
+        if cache.get(job[0]) != job[3] or not os.path.exists(os.path.join(out_dir, job[0] + ".png"))
+    ]
+    print(f"REPORT: {len(jobs)} figures, {len(jobs) - len(todo)} up to date, rendering {len(todo)}.")
+
+    rendered = []
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(_render_figure, name, kind, inputs, out_dir, max_epochs, dpi): (name, digest)
+            for name, kind, inputs, digest in todo
+        }
+        for future in as_completed(futures):
+            name, digest = futures[future]
+            try:
+                rendered.append(future.result())
+                cache[name] = digest
+            except Exception as e:
+                print(f"REPORT: could not render {name}: {e}")
+
+    tmp_path = cache_path + ".tmp_%d" % os.getpid()
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+    return rendered
+
+
+def report_figures(root="."):
+    """
+    Returns the (name, kind, inputs) of every figure of the report: a 'loss' and a 'seaplot' figure for the
+    results path of every sweep, and a 'facets' figure for every (results directory, model family), whose
+    inputs are the results paths of the directory.
+    """
+    figures = []
+
+    for results_dir in sorted(glob.glob(os.path.join(root, "experimental_results_*"))):
+        data_set = os.path.basename(results_dir)[len("experimental_results_") :]
+
+        # sweeps are stored as a .pkl results file, a directory of records, or both.
+        sweeps = {path[: -len(".pkl")] for path in glob.glob(os.path.join(results_dir, "*.pkl"))}
+        sweeps |= {os.path.dirname(path) for path in glob.glob(os.path.join(results_dir, "*", "*.npz"))}
+        sweeps = sorted(sweep for sweep in sweeps if "backup_w" not in os.path.basename(sweep))
+
+        for model in ["conv_nets", "resnet18"]:
+            model_paths = [sweep + ".pkl" for sweep in sweeps if os.path.basename(sweep).startswith(model)]
+            if model_paths:
+                figures.append((f"{data_set}_{model}_facets", "facets", model_paths))
+
+        for sweep in sweeps:
+            name = f"{data_set}_{os.path.basename(sweep)}"
+            figures.append((name + "_loss", "loss", [sweep + ".pkl"]))
+            figures.append((name + "_seaplot", "seaplot", [sweep + ".pkl"]))
+
+    return figures
+
+
+def _hash_inputs(kind, inputs, settings):
+    """ Hash of the contents of the results of a figure (.pkl file and records) and of its settings. """
+    digest = hashlib.sha1(json.dumps([kind, settings]).encode())
+
+    for path in inputs:
+        files = sorted(glob.glob(os.path.join(path[: -len(".pkl")], "*.npz")))
+        if os.path.exists(path):
+            files.insert(0, path)
+
+        for file in files:
+            digest.update(os.path.basename(file).encode())
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render_figure(name, kind, inputs, out_dir, max_epochs, dpi):
+    import matplotlib.pyplot as plt
+    from utils.visualizations import load_results, plot_loss_from_file, plot_loss_vs_epoch_from_file
+
+    if kind == "loss":
+        fig = plot_loss_from_file(inputs[0], show=False)
+    elif kind == "seaplot":
+        results = load_results(inputs[0])
+        x_idx = [width for width in results["widths"] if width == 1 or width % 8 == 0]
+        fig = plot_loss_vs_epoch_from_file(inputs[0], x_idx, max_epochs=max_epochs, show=False, results=results)
+    else:
+        fig = _plot_facets(inputs)
+
+    path = os.path.join(out_dir, name + ".png")
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+
+    return path
+
+
+def _plot_facets(paths):
+    """
+    Facet grid of the final and optimal early stopping test error vs width of the given results paths, with
+    one row per depth and one column per label noise level.
+    """
+    import matplotlib.pyplot as plt
+    from utils.visualizations import load_results, _final_values
+
+    facets = {}
+    for path in paths:
+        sweep = os.path.basename(path)[: -len(".pkl")]
+        depth = re.search(r"depth_(\d+)", sweep)
+        noise = re.search(r"(\d+)pct_noise", sweep)
+        key = (None if depth is None else int(depth.group(1)), None if noise is None else int(noise.group(1)))
+        facets.setdefault(key, []).append((sweep, load_results(path)))
+
+    depths = sorted({depth for depth, _ in facets}, key=lambda depth: -1 if depth is None else depth)
+    noises = sorted({noise for _, noise in facets}, key=lambda noise: -1 if noise is None else noise)
+
+    fig, axes = plt.subplots(
+        nrows=len(depths), ncols=len(noises), figsize=(6 * len(noises), 4 * len(depths)), squeeze=False
+    )
+    for (depth, noise), sweeps in facets.items():
+        ax = axes[depths.index(depth)][noises.index(noise)]
+        for sweep, results in sweeps:
+            test_error = 100 * (1 - np.asarray(results["val_accuracy"]))
+            ax.plot(results["widths"], _final_values(test_error), marker="o", markersize=2, label=f"{sweep} final")
+            ax.plot(results["widths"], np.nanmin(test_error, axis=1), marker="o", markersize=2, label=f"{sweep} early")
+
+        ax.set_title(f"depth {depth}, {noise}% label noise" if depth is not None else f"{noise}% label noise")
+        ax.set_xlabel("Layer Width")
+        ax.set_ylabel("Test Error")
+        ax.grid(alpha=0.5)
+        ax.legend(fontsize=7)
+
+    fig.tight_layout()
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--root", default=".")
+    parser.add_argument("--out_dir", default="reports")
+    parser.add_argument("--n_workers", type=int, default=None)
+    parser.add_argument("--max_epochs", type=int, default=512)
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--force", action="store_true", help="render every figure again")
+    args = parser.parse_args()
+
+    rendered = render_report(args.root, args.out_dir, args.n_workers, args.max_epochs, args.dpi, args.force)
+    print(f"REPORT: rendered {len(rendered)} figures into {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
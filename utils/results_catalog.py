@@ -0,0 +1,217 @@
+"""
+Catalog of all training runs in the experimental_results_* directories.
+
+Every run of a legacy .pkl results file or of the results store (see utils.results_store) is described by
+its metadata (data set, model, depth, width, label noise, sample size, seed and number of epochs), which is
+parsed from its paths and model id. The metadata of a file is cached in 'results_catalog.json' in the root
+directory, keyed by the file's size and modification time, so rescans only read new or changed files.
+
+Queries return dense columnar arrays: one metadata array per field, and one [n_runs, n_epochs] array per
+requested metric, NaN padded so runs of different lengths line up. Only the requested metrics are loaded.
+
+Example:
+
+    catalog = ResultsCatalog()
+    results = catalog.load(["loss", "val_accuracy"], data_set="cifar10", depth=5, label_noise_as_int=10)
+    results["width"], results["val_accuracy"]
+"""
+
+import os
+import re
+import json
+import glob
+import functools
+
+import numpy as np
+import pickle as pkl
+
+
+CACHE_NAME = "results_catalog.json"
+
+# metadata fields of a run, in the sort order of query results.
+FIELDS = ["data_set", "model", "depth", "label_noise_as_int", "sample_size", "seed", "width", "n_epochs"]
+
+
+class ResultsCatalog:
+    """
+    Index of the runs of every experimental_results_* directory under root. See the module docstring.
+    """
+
+    def __init__(self, root="."):
+        """
+        Parameters
+        ----------
+        root: str
+            Directory containing the experimental_results_* directories.
+        """
+        self.root = root
+        self.cache_path = os.path.join(root, CACHE_NAME)
+        self.runs = []
+        self.refresh()
+
+    def refresh(self):
+        """ Rescan the results directories, reading only the files which are new or changed since the last scan. """
+        cache = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+
+        files = sorted(
+            glob.glob(os.path.join(self.root, "experimental_results_*", "*.pkl"))
+            + glob.glob(os.path.join(self.root, "experimental_results_*", "*", "*.npz"))
+        )
+
+        # skip the backups written by load_saved_metrics.
+        files = [path for path in files if "backup_w" not in os.path.basename(path)]
+
+        new_cache, self.runs = {}, []
+        for path in files:
+            stat = os.stat(path)
+            key = os.path.relpath(path, self.root)
+            entry = cache.get(key)
+
+            if entry is None or entry["stamp"] != [stat.st_size, stat.st_mtime]:
+                try:
+                    entry = {"stamp": [stat.st_size, stat.st_mtime], "runs": _scan_file(path)}
+                except Exception as e:
+                    print(f"skipping unreadable results file {path}: {e}")
+                    continue
+
+            new_cache[key] = entry
+            self.runs.extend(dict(run, path=key, stamp=entry["stamp"]) for run in entry["runs"])
+
+        # records of the results store replace the runs of their legacy .pkl file.
+        stored = {(run["sweep"], run["model_id"]) for run in self.runs if run["path"].endswith(".npz")}
+        self.runs = [
+            run
+            for run in self.runs
+            if run["path"].endswith(".npz") or (run["sweep"], run["model_id"]) not in stored
+        ]
+
+        if new_cache != cache:
+            tmp_path = self.cache_path + ".tmp_%d" % os.getpid()
+            with open(tmp_path, "w") as f:
+                json.dump(new_cache, f)
+            os.replace(tmp_path, self.cache_path)
+
+    def query(self, **filters):
+        """
+        Returns the metadata of the runs matching all filters, sorted by FIELDS. A filter is a metadata
+        field and either a value, a list of values, or a function returning whether a value matches, e.g.
+        query(depth=5, label_noise_as_int=[0, 10], width=lambda w: w <= 16).
+        """
+        unknown = set(filters) - set(FIELDS) - {"sweep", "model_id"}
+        if unknown:
+            raise Exception(f"Unknown fields {sorted(unknown)}, use {FIELDS}.")
+
+        runs = [run for run in self.runs if all(_matches(run[k], f) for k, f in filters.items())]
+        return sorted(runs, key=lambda run: tuple(_sort_key(run[field]) for field in FIELDS))
+
+    def load(self, metrics=("loss", "accuracy", "val_loss", "val_accuracy"), **filters):
+        """
+        Returns the runs matching the filters (see query) as columnar arrays: every metadata field as an
+        array of n_runs values (plus 'model_id' and 'sweep'), and every metric as an [n_runs, n_epochs] float
+        array padded with NaN after the end of shorter runs. Metrics a run did not log are all NaN.
+        """
+        runs = self.query(**filters)
+
+        results = {field: np.array([run[field] for run in runs]) for field in FIELDS + ["model_id", "sweep"]}
+        histories = [self.history(run, metrics) for run in runs]
+        for metric in metrics:
+            results[metric] = pad_histories([history.get(metric, []) for history in histories])
+
+        return results
+
+    def history(self, run, metrics):
+        """ Load the given metrics of a run (as returned by query), keyed by name. Missing metrics are left out. """
+        path = os.path.join(self.root, run["path"])
+
+        if path.endswith(".npz"):
+            from utils.results_store import JSON_KEY
+
+            with np.load(path, allow_pickle=False) as record:
+                history = {metric: record[metric] for metric in metrics if metric in record.files}
+                if JSON_KEY in record.files:
+                    entries = json.loads(record[JSON_KEY].item())
+                    history.update({metric: entries[metric] for metric in metrics if metric in entries})
+                return history
+
+        history = _load_pickle(path, os.path.getmtime(path))[run["model_id"]]
+        return {metric: history[metric] for metric in metrics if metric in history}
+
+
+def pad_histories(histories):
+    """ Stack per-run metric lists of different lengths into a float [n_runs, max_length] array, NaN padded. """
+    n_epochs = max([len(history) for history in histories], default=0)
+    padded = np.full((len(histories), n_epochs), np.nan)
+    for i, history in enumerate(histories):
+        padded[i, : len(history)] = np.asarray(history, dtype=float)
+    return padded
+
+
+def model_width(model_id):
+    """
+    Width of a model id of the form 'conv_net_depth_{depth}_width_{width}' or 'ResNet18_width_{width}...', or
+    of a file named after one. None if the name has no width.
+    """
+    width = re.search(r"width_(\d+)", model_id)
+    return None if width is None else int(width.group(1))
+
+
+def run_metadata(results_dir, sweep, model_id, n_epochs):
+    """ Metadata of a run, parsed from its results directory, sweep (results file name) and model id. """
+    depth = re.search(r"depth_(\d+)", model_id)
+    noise = re.search(r"(\d+)pct_noise", sweep)
+    sample_size = re.search(r"_samples_(\d+)", sweep)
+    seed = re.search(r"_seed_(\d+)", sweep)
+
+    return {
+        "data_set": os.path.basename(os.path.normpath(results_dir))[len("experimental_results_") :],
+        "model": "resnet18" if model_id.startswith("ResNet18") else "conv_net",
+        "depth": None if depth is None else int(depth.group(1)),
+        "label_noise_as_int": None if noise is None else int(noise.group(1)),
+        "sample_size": None if sample_size is None else int(sample_size.group(1)),
+        "seed": None if seed is None else int(seed.group(1)),
+        "width": model_width(model_id),
+        "n_epochs": n_epochs,
+        "sweep": sweep,
+        "model_id": model_id,
+    }
+
+
+def _scan_file(path):
+    """ Metadata of the runs of a .pkl results file or of a results store record. """
+    if path.endswith(".npz"):
+        run_dir = os.path.dirname(path)
+        model_id = os.path.basename(path)[: -len(".npz")]
+        with np.load(path, allow_pickle=False) as record:
+            n_epochs = len(record["loss"]) if "loss" in record.files else 0
+        return [run_metadata(os.path.dirname(run_dir), os.path.basename(run_dir), model_id, n_epochs)]
+
+    metrics = _load_pickle(path, os.path.getmtime(path))
+    sweep = os.path.basename(path)[: -len(".pkl")]
+    return [
+        run_metadata(os.path.dirname(path), sweep, model_id, len(history.get("loss", [])))
+        for model_id, history in metrics.items()
+        if isinstance(model_id, str) and model_width(model_id) is not None
+    ]
+
+
+@functools.lru_cache(maxsize=8)
+def _load_pickle(path, mtime):
+    """ Load a .pkl results file, cached until it is modified. """
+    with open(path, "rb") as f:
+        return pkl.load(f)
+
+
+def _matches(value, condition):
+    if callable(condition):
+        return condition(value)
+    if isinstance(condition, (list, tuple, set)):
+        return value in condition
+    return value == condition
+
+
+def _sort_key(value):
+    # runs without a value (e.g. the depth of a ResNet18) sort first.
+    return (value is not None, value if value is not None else 0)
@@ -0,0 +1,247 @@
+"""
+Append-only store of training results, one compressed .npz record per finished run.
+
+The runs of a sweep whose results file is 'experimental_results_{data_set}/{sweep}.pkl' are stored as
+
+    experimental_results_{data_set}/{sweep}/{model_id}.npz
+
+holding every entry of the run's history and its config, and are indexed (keyed by sweep and model id,
+with the config) in 'experimental_results_{data_set}/results_index.sqlite'. Every record is written to a
+temporary file and renamed into place, so a crash never corrupts the runs saved before, and saving a run
+costs the same however many runs the sweep already has. The index can always be rebuilt from the records.
+
+load_metrics reads the runs of a sweep (and of its legacy .pkl file) as the usual {model_id: history}
+dictionary, which utils.visualizations.load_results reads in turn.
+
+Usage (from the repository root):
+    python -m utils.results_store migrate experimental_results_cifar10/*.pkl
+    python -m utils.results_store rebuild_index experimental_results_cifar10
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+import pickle as pkl
+
+from utils.results_catalog import model_width
+
+
+INDEX_NAME = "results_index.sqlite"
+
+# name of the config entry of a record.
+CONFIG_KEY = "__config__"
+
+# name of the entry of a record holding the non-numeric history entries (e.g. None, or a list of dicts) as
+# JSON, which np.savez could only store pickled.
+JSON_KEY = "__json__"
+
+
+def save_run(data_save_path, model_id, history, config=None):
+    """
+    Atomically write the history of a finished run as a record of the sweep of data_save_path, replacing an
+    earlier record of the same run (e.g. before it was extended), and add it to the index.
+
+    The record is the source of truth. If the index can not be written (e.g. 'database is locked' on a shared
+    filesystem, see utils.work_queue), the error is logged and the run is still saved. rebuild_index then
+    adds it to the index later.
+
+    Parameters
+    ----------
+    data_save_path: str
+        The .pkl results path of the sweep, see _conv_net_paths.
+    model_id: str
+    history: dict
+        History of the run: lists with one value per epoch, and scalar entries (e.g. 'stop_reason'). Entries
+        which are not numbers or strings are stored as JSON, and must be JSON serializable.
+    config: dict
+        JSON serializable config of the run, e.g. the data set, label noise and seed.
+    """
+    run_dir = sweep_dir(data_save_path)
+    os.makedirs(run_dir, exist_ok=True)
+    config = {} if config is None else config
+
+    arrays, json_entries = {}, {}
+    for key, value in history.items():
+        array = _history_array(value)
+        if array is None:
+            json_entries[key] = value
+        else:
+            arrays[key] = array
+
+    if json_entries:
+        try:
+            arrays[JSON_KEY] = np.asarray(json.dumps(json_entries, sort_keys=True))
+        except TypeError as e:
+            raise Exception(f"The history of {model_id} has entries which can not be saved: {e}")
+    arrays[CONFIG_KEY] = np.asarray(json.dumps(config, sort_keys=True))
+
+    run_path = os.path.join(run_dir, model_id + ".npz")
+    tmp_path = run_path + ".tmp_%d" % os.getpid()
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, run_path)
+
+    try:
+        _index_run(run_path, config, len(history.get("loss", [])))
+    except (sqlite3.Error, OSError) as e:
+        print(f"could not index {run_path}, run rebuild_index on {os.path.dirname(run_dir)} later: {e}")
+
+
+def load_run(run_path):
+    """ Returns the history and config of a record. """
+    with np.load(run_path, allow_pickle=False) as record:
+        history = {
+            key: record[key].item() if record[key].ndim == 0 else record[key].tolist()
+            for key in record.files
+            if key not in [CONFIG_KEY, JSON_KEY]
+        }
+        if JSON_KEY in record.files:
+            history.update(json.loads(record[JSON_KEY].item()))
+        config = json.loads(record[CONFIG_KEY].item()) if CONFIG_KEY in record.files else {}
+
+    return history, config
+
+
+def load_metrics(data_save_path):
+    """
+    Returns the histories of a sweep as the {model_id: history} dictionary of the legacy .pkl results file:
+    the runs of the legacy file (if any), updated with the records of the store in order of width.
+    Raises FileNotFoundError if the sweep has neither.
+    """
+    run_dir = sweep_dir(data_save_path)
+    if not os.path.exists(data_save_path) and not os.path.isdir(run_dir):
+        raise FileNotFoundError(f"No results found at {data_save_path} or {run_dir}")
+
+    metrics = {}
+    if os.path.exists(data_save_path):
+        with open(data_save_path, "rb") as f:
+            metrics = pkl.load(f)
+
+    for run_path in _run_paths(run_dir):
+        metrics[os.path.basename(run_path)[: -len(".npz")]] = load_run(run_path)[0]
+
+    return metrics
+
+
+def query_runs(results_dir, **config):
+    """
+    Returns the (sweep, model_id, width, path, config) of the indexed runs of a results directory whose
+    config matches all given values, e.g. query_runs('experimental_results_cifar10', seed=0).
+    """
+    connection = _connect(results_dir)
+    try:
+        rows = connection.execute("SELECT sweep, model_id, width, path, config FROM runs ORDER BY sweep, width")
+        runs = [(*row[:4], json.loads(row[4])) for row in rows]
+    finally:
+        connection.close()
+
+    return [run for run in runs if all(run[4].get(key) == value for key, value in config.items())]
+
+
+def migrate_pickle(data_save_path, config=None):
+    """
+    Copy every run of a legacy .pkl results file into the store, with the given config. The .pkl file is
+    left in place. Returns the number of runs migrated.
+    """
+    with open(data_save_path, "rb") as f:
+        metrics = pkl.load(f)
+
+    for model_id, history in metrics.items():
+        save_run(data_save_path, model_id, history, {**(config or {}), "migrated_from": data_save_path})
+
+    print(f"migrated {len(metrics)} runs of {data_save_path} to {sweep_dir(data_save_path)}")
+    return len(metrics)
+
+
+def rebuild_index(results_dir):
+    """ Rebuild the index of a results directory from its records, e.g. after copying records by hand. """
+    index_path = os.path.join(results_dir, INDEX_NAME)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    n_runs = 0
+    for name in sorted(os.listdir(results_dir)):
+        for run_path in _run_paths(os.path.join(results_dir, name)):
+            history, config = load_run(run_path)
+            _index_run(run_path, config, len(history.get("loss", [])))
+            n_runs += 1
+
+    print(f"indexed {n_runs} runs in {index_path}")
+    return n_runs
+
+
+def _history_array(value):
+    """ A history entry as a NumPy array, or None if it is not numeric or a string (e.g. None, ragged lists). """
+    try:
+        array = np.asarray(value)
+    except ValueError:
+        return None
+    return None if array.dtype == object else array
+
+
+def sweep_dir(data_save_path):
+    """ Directory of the records of the sweep of a .pkl results path. """
+    assert data_save_path[-4:] == ".pkl"
+    return data_save_path[:-4]
+
+
+def _index_run(run_path, config, n_epochs):
+    run_dir = os.path.dirname(run_path)
+    model_id = os.path.basename(run_path)[: -len(".npz")]
+
+    connection = _connect(os.path.dirname(run_dir))
+    try:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    os.path.basename(run_dir),
+                    model_id,
+                    model_width(model_id),
+                    run_path,
+                    json.dumps(config, sort_keys=True),
+                    n_epochs,
+                    time.time(),
+                ),
+            )
+    finally:
+        connection.close()
+
+
+def _connect(results_dir):
+    connection = sqlite3.connect(os.path.join(results_dir or ".", INDEX_NAME), timeout=60)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS runs (sweep TEXT, model_id TEXT, width INTEGER, path TEXT, config TEXT, "
+        "n_epochs INTEGER, written REAL, PRIMARY KEY (sweep, model_id))"
+    )
+    return connection
+
+
+def _run_paths(run_dir):
+    """ Paths of the records of a sweep directory, in order of width. """
+    if not os.path.isdir(run_dir):
+        return []
+
+    names = [name for name in os.listdir(run_dir) if name.endswith(".npz")]
+    return [os.path.join(run_dir, name) for name in sorted(names, key=lambda name: (model_width(name) or 0, name))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("command", choices=["migrate", "rebuild_index"])
+    parser.add_argument("paths", nargs="+", help=".pkl results files to migrate, or results directories")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if args.command == "migrate":
+            migrate_pickle(path)
+        else:
+            rebuild_index(path)
+
+
+if __name__ == "__main__":
+    main()
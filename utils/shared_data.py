@@ -0,0 +1,75 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+ARRAY_NAMES = ["x_train", "y_train", "x_test", "y_test"]
+
+
+class SharedData:
+    """
+    Hold a loaded data set in multiprocessing.shared_memory blocks, so worker processes can train on it
+    through zero-copy NumPy views instead of each loading their own copy.
+
+    The process which creates the SharedData owns the blocks and must call close() once the workers are
+    done (or use it as a context manager). Workers receive the picklable descriptor and call
+    attach_shared_data.
+    """
+
+    def __init__(self, data):
+        """
+        Parameters
+        ----------
+        data: tuple
+            ((x_train, y_train), (x_test, y_test), image_shape) as returned by load_data(low_memory=True).
+        """
+        (x_train, y_train), (x_test, y_test), image_shape = data
+
+        self._blocks = []
+        self.descriptor = {"image_shape": list(image_shape), "arrays": {}}
+
+        for name, array in zip(ARRAY_NAMES, [x_train, y_train, x_test, y_test]):
+            array = np.asarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+
+            self._blocks.append(block)
+            self.descriptor["arrays"][name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """ Release and remove the shared memory blocks. """
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attach_shared_data(descriptor):
+    """
+    Attach to the blocks of a SharedData from a process started by multiprocessing from the owner (which
+    shares the owner's resource tracker, so the blocks are only removed by SharedData.close).
+
+    Returns ((x_train, y_train), (x_test, y_test), image_shape) as read-only NumPy views of the shared
+    memory, and the list of attached blocks. The blocks must be kept referenced for as long as the views
+    are in use, and closed afterwards.
+    """
+    blocks, arrays = [], []
+
+    for name in ARRAY_NAMES:
+        block_name, shape, dtype = descriptor["arrays"][name]
+        block = shared_memory.SharedMemory(name=block_name)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+
+        blocks.append(block)
+        arrays.append(array)
+
+    x_train, y_train, x_test, y_test = arrays
+
+    return ((x_train, y_train), (x_test, y_test), descriptor["image_shape"]), blocks
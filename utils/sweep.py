@@ -0,0 +1,152 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from utils.train_utils import load_data
+from utils.shared_data import SharedData, attach_shared_data
+
+
+# name of the widths argument of each training function.
+WIDTH_ARGUMENTS = {
+    "train_conv_nets": "convnet_widths",
+    "train_resnet18": "resnet_widths",
+}
+
+
+def run_width_sweep(
+    train_function,
+    widths,
+    n_workers=None,
+    intra_op_threads=None,
+    inter_op_threads=1,
+    shared_data=False,
+    **train_kwargs,
+):
+    """
+    Train each width of a sweep in its own worker process, several widths at a time.
+
+    Every worker calls train_function with a single width and merge_results=True, so each finished
+    width is merged into the usual results file under a file lock as soon as it is done. Widths are
+    scheduled largest first, so the long runs start early and the small widths fill in the gaps.
+
+    Returns the metrics of all widths, keyed by model id in the order of widths.
+
+    Parameters
+    ----------
+    train_function: callable
+        train_conv_nets or train_resnet18 (or any module level function taking the same widths argument).
+    widths: list[int]
+        List of model widths to train.
+    n_workers: int
+        Number of widths trained concurrently. Default is min(len(widths), cpu count // intra_op_threads).
+    intra_op_threads: int
+        Number of threads each worker uses inside an op. Default is cpu count // n_workers.
+    inter_op_threads: int
+        Number of ops each worker runs concurrently.
+    shared_data: bool
+        if True, load the (noised) data set once in this process as uint8 into shared memory, and have
+        the workers train on zero-copy views of it (see utils.shared_data) instead of each loading
+        their own copy.
+    train_kwargs:
+        Keyword arguments passed on to train_function, e.g. data_set, convnet_depth, label_noise_as_int.
+        If no seed is given, one is drawn here so that every worker trains on the same noisy labels.
+    """
+    n_cpus = os.cpu_count()
+
+    if n_workers is None:
+        n_workers = min(len(widths), max(1, n_cpus // (intra_op_threads or 1)))
+    if intra_op_threads is None:
+        intra_op_threads = max(1, n_cpus // n_workers)
+
+    if train_kwargs.get("seed") is None:
+        train_kwargs["seed"] = int(np.random.SeedSequence().entropy % 2 ** 32)
+        print(f"No seed given, using seed {train_kwargs['seed']} for every width.")
+
+    width_argument = WIDTH_ARGUMENTS.get(train_function.__name__, "convnet_widths")
+
+    shared = None
+    if shared_data:
+        shared = SharedData(
+            load_data(
+                train_kwargs["data_set"],
+                train_kwargs.get("label_noise_as_int", 10) / 100,
+                sample_size=train_kwargs.get("sample_size"),
+                low_memory=True,
+                seed=train_kwargs["seed"],
+                cache_dir=train_kwargs.get("cache_dir"),
+            )
+        )
+
+    print(
+        f"Training {len(widths)} widths with {n_workers} workers, "
+        f"{intra_op_threads} intra-op / {inter_op_threads} inter-op threads each."
+    )
+    start_time = time.perf_counter()
+    results = {}
+
+    # TensorFlow is not fork safe, start every worker in a fresh interpreter.
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(intra_op_threads, inter_op_threads),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _train_width,
+                    train_function,
+                    width_argument,
+                    width,
+                    train_kwargs,
+                    None if shared is None else shared.descriptor,
+                ): width
+                for width in sorted(widths, reverse=True)
+            }
+
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                run_time = int(time.perf_counter() - start_time)
+                print(
+                    f"width {futures[future]} finished ({len(results)}/{len(widths)}), "
+                    f"Total Run Time: {run_time // 3600:02}:{run_time // 60 % 60:02}:{run_time % 60:02}"
+                )
+    finally:
+        if shared is not None:
+            shared.close()
+
+    metrics = {}
+    for width in widths:
+        metrics.update(results[width])
+
+    return metrics
+
+
+def _init_worker(intra_op_threads, inter_op_threads):
+    """ Limit the number of threads of a worker. Must run before TensorFlow executes any op. """
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+# shared data sets attached by this worker, keyed by the name of their first block. Attached once per
+# worker and kept for the lifetime of the worker, since the views may still be referenced by TensorFlow.
+_attached_data = {}
+
+
+def _train_width(train_function, width_argument, width, train_kwargs, shared_descriptor=None):
+    train_kwargs = {**train_kwargs, width_argument: [width], "merge_results": True}
+
+    if shared_descriptor is not None:
+        key = shared_descriptor["arrays"]["x_train"][0]
+        if key not in _attached_data:
+            _attached_data[key] = attach_shared_data(shared_descriptor)
+        train_kwargs["data"] = _attached_data[key][0]
+
+    return train_function(**train_kwargs)
@@ -4,12 +4,47 @@ from tensorflow.image import random_crop, resize_with_crop_or_pad
 from tensorflow.keras.losses import SparseCategoricalCrossentropy
 from tensorflow.keras.metrics import Mean, SparseCategoricalAccuracy
 
+import os
+import re
+import json
 import time
+import functools
+import contextlib
+import fcntl
 import numpy as np
 import pickle as pkl
 
-from models.conv_nets import make_convNet
+from models.conv_nets import make_convNet, make_convNet_towers
 from models.resnet import make_resnet18_UniformHe
+from utils.data_pipeline import make_data_pipeline
+from utils.augmentation import flip_pad_crop_data_set
+from utils.data_cache import load_cached_data, save_cached_data, memory_cache
+from utils.training_loop import fit_compiled
+from utils.evaluation import (
+    evaluation_epochs,
+    fill_skipped_evaluations,
+    add_val_epochs,
+    subsample_test_set,
+    async_evaluator,
+)
+from utils.budget import STOP_KEYS, budget_summary
+from utils.results_store import save_run, load_metrics
+from utils.results_catalog import model_width
+from utils.live_metrics import stream_path, stream_record
+from utils.profiling import training_profiler, profile_path
+from utils.checkpointing import (
+    EpochCheckpoint,
+    restore_checkpoint,
+    checkpoint_epoch,
+    remove_checkpoint,
+    restore_trained_model,
+)
+from utils.datasets import (
+    get_dataset_loader,
+    is_streaming_data_set,
+    data_set_name,
+    load_streaming_data,
+)
 
 
 def train_conv_nets(
@@ -25,7 +60,32 @@ def train_conv_nets(
     data_save_path_prefix="",
     data_save_path_suffix="",
     load_saved_metrics=False,
-    data_augmentation=False
+    data_augmentation=False,
+    data_pipeline=False,
+    low_memory=False,
+    seed=None,
+    cache_dir=None,
+    memoize=False,
+    merge_results=False,
+    results_store=True,
+    data=None,
+    supernet=False,
+    supernet_group_size=None,
+    checkpoint_every=None,
+    extend=False,
+    train_engine="fit",
+    steps_per_execution=1,
+    jit_compile=False,
+    graph_lr_schedule=False,
+    eval_schedule=None,
+    eval_points=100,
+    eval_sample_size=None,
+    async_eval=False,
+    async_eval_train_size=None,
+    budget_policy=None,
+    live_metrics=False,
+    profile=False,
+    profile_trace_steps=None,
 ):
     """
     Train and save the results of Conv nets of a given range of model widths.
@@ -36,7 +96,8 @@ def train_conv_nets(
     ----------
 
     data_set: str
-        Which data set to train on. See the load data funciton.
+        Which data set to train on. See the load data funciton. Data sets stored as TFRecord shards
+        ('tfrecord:/path' or registered with a tfrecord_dir) are streamed, see load_streaming_data.
     convnet_depth: int
     convnet_widths: list[int]
         List of model widths to train.
@@ -54,48 +115,238 @@ def train_conv_nets(
     data_save_path_prefix: str
         prefix to add to the save pkl file path.
     data_save_path_suffix: str
-        suffix to add to the save pkl file name.
+        suffix to add to the save pkl file name and the model weights directory.
     load_saved_metrics: bool
         if True, will attempt to load the metrics from a previous training session in the save_path,
         to continue training from there. If True, will load the saved .pkl file instead of starting
         over and overwriting it. 
+    data_augmentation: bool
+        whether or not to use random cropping and horizontal flipping to augment training data. Every
+        data set of 32x32 RGB images is augmented, i.e. cifar10, cifar100 and local copies of them.
+    data_pipeline: bool
+        if True, stream the data through a tf.data pipeline which shuffles, normalizes and augments
+        each batch on the fly (see make_data_pipeline), instead of augmenting the whole data set up front.
+    low_memory: bool
+        if True, keep the images as uint8 and normalize each batch in the data pipeline instead of
+        casting the whole data set to tf.float32. Implies data_pipeline.
+    seed: int
+        Seed used to draw the training subsample and label noise, see load_data.
+    cache_dir: str
+        Directory of the on-disk data set cache, see load_data. Lets separate calls (e.g. width
+        sweeps split across notebook cells) reuse the exact same noisy labels. Requires a seed.
+    memoize: bool
+        if True, reuse the data loaded by earlier calls in this process, see load_data. Requires a seed.
+        low_memory, cache_dir and memoize only apply to in-memory data sets, streaming (TFRecord) data
+        sets raise if any of them is given.
+    merge_results: bool
+        if True, merge each finished width into the existing results file (under a file lock) instead of
+        overwriting it with the results of this call only. Used when several processes train widths of
+        the same sweep, see utils.sweep.
+    results_store: bool
+        if True, save every finished width as its own record of the append-only results store (see
+        utils.results_store) instead of rewriting the whole .pkl results file, so merge_results is not needed.
+        Saved results are read back from either format by load_saved_metrics and load_results.
+    data: tuple
+        Already loaded ((x_train, y_train), (x_test, y_test), image_shape) to train on instead of loading
+        data_set, e.g. zero-copy views of a data set shared between processes (see utils.shared_data).
+        NumPy images are streamed through the data pipeline. data_set is then only used in the save paths.
+    checkpoint_every: int
+        if given, checkpoint the model, optimizer, learning rate step and history of the width being trained
+        every checkpoint_every epochs (see utils.checkpointing), in a '{model_id}_checkpoint' directory next to
+        the saved weights. An interrupted width is then resumed from its last checkpoint on the next call with
+        the same run config (seed, label noise, sample size, number of epochs, ...). The checkpoints are
+        deleted once the final weights and results of the width are saved.
+    extend: bool
+        if True, continue training the widths already in the results file from their saved weights and
+        optimizer state (see restore_trained_model) up to the new number of epochs, and append the new epochs
+        to their history. Used to extend a finished run to a larger training budget, e.g. from 500_000 to
+        1_600_000 batch steps. Widths not in the results file are trained from scratch.
+    train_engine: str
+        'fit' to train with model.fit, or 'compiled' to train with the tf.function compiled training loop of
+        utils.training_loop.fit_compiled. The compiled engine was not faster than fit for conv nets on CPU
+        (see benchmarks/bench_train_engine.py), so benchmark it on the target hardware before using it.
+    steps_per_execution: int
+        Number of gradient steps per call of the compiled training loop. Only used by the compiled engine.
+    jit_compile: bool
+        if True, compile the gradient step with XLA. Only used by the compiled engine.
+    graph_lr_schedule: bool
+        if True, the default SGD optimizer decays its learning rate with the graph-native
+        inverse_squareroot_schedule for both train engines. By default, model.fit runs keep the
+        inverse_squareroot_lr of the earlier results (whose step counter only advances while the training
+        step is traced, see its docstring), and the compiled engine uses inverse_squareroot_schedule. The
+        schedule of every run is saved as 'lr_schedule' in its run config.
+    eval_schedule: int or str
+        When to evaluate the test set: None for every epoch, an int k for every k epochs, or 'log' for
+        eval_points log-spaced epochs (see utils.evaluation.evaluation_epochs). The final epoch is always
+        evaluated. Skipped epochs get NaN test metrics, and the history gets a 'val_epochs' list of the
+        evaluated (0-based) epochs.
+    eval_points: int
+        Number of evaluations of the 'log' eval_schedule.
+    eval_sample_size: int
+        if given, evaluate on a fixed random subsample (drawn with seed) of this many test examples.
+    async_eval: bool
+        if True, evaluate snapshots of the weights (at the epochs of eval_schedule) in a background thread
+        instead of inside model.fit, see utils.evaluation.async_evaluator. The results are written into the
+        history in the same format.
+    async_eval_train_size: int
+        if given with async_eval, also evaluate fixed subsets of this many correctly and incorrectly labelled
+        training examples, logged as 'clean_train_loss', 'clean_train_accuracy', 'noisy_train_loss' and
+        'noisy_train_accuracy' (against their training labels). Requires an explicit seed.
+    budget_policy: utils.budget.plateau_budget
+        if given, stop the widths which have converged (plateau of the train loss and test error, or
+        interpolation) and give the saved epochs to later widths near the interpolation threshold of the same
+        call (see utils.budget.plateau_budget for when that helps). Every history records its 'stop_reason',
+        'stop_epoch' and 'budget_epochs', see utils.budget.budget_summary.
+    live_metrics: bool
+        if True, append the metrics of every epoch to a JSONL stream per width while it trains, which
+        utils.live_metrics follows to plot the sweep as it progresses.
+    profile: bool
+        if True, time the input wait, gradient steps, evaluations and saves of every epoch of every width,
+        with its images per second and peak memory, and save the summary next to the results, see
+        utils.profiling.
+    profile_trace_steps: tuple(int, int)
+        if given with profile, also capture a TensorFlow profiler trace of these gradient steps of every width.
+    supernet: bool
+        if True, train all widths together as independent towers of one model (see make_convNet_towers),
+        sharing one input pipeline and one compiled training step. Each width keeps its own parameters,
+        BatchNorm statistics and optimizer state, and is saved under its usual model id.
+    supernet_group_size: int
+        Number of widths trained together in supernet mode. Default is all of them.
     """
 
     label_noise = label_noise_as_int / 100
+    batch_size = 128 if batch_size is None else batch_size
 
-    # load the relevent dataset. Note that the training data is cast to tf.float32 and normalized by 255.
-    (x_train, y_train), (x_test, y_test), image_shape = load_data(
-        data_set, label_noise, augment_data=data_augmentation, sample_size=sample_size
+    # load the relevent dataset. Note that the training data is cast to tf.float32 and normalized by 255,
+    # unless low_memory is set. When streaming, augmentation is applied per batch by the data pipeline.
+    fit_inputs, image_shape, n_train, n_classes = _load_fit_data(
+        data_set,
+        label_noise,
+        batch_size,
+        data_augmentation=data_augmentation,
+        sample_size=sample_size,
+        data_pipeline=data_pipeline,
+        low_memory=low_memory,
+        seed=seed,
+        cache_dir=cache_dir,
+        memoize=memoize,
+        data=data,
+        eval_sample_size=eval_sample_size,
     )
 
-    batch_size = 128 if batch_size is None else batch_size
+    train_subsets = None
+    if async_eval and async_eval_train_size:
+        train_subsets = _clean_and_noisy_train_subsets(
+            data_set, label_noise, sample_size, seed, cache_dir, async_eval_train_size
+        )
     
     # total number desirec SGD steps / number batches per epoch = n_epochs
-    n_epochs = n_batch_steps // (x_train.shape[0] // batch_size)
-    n_classes = tf.math.reduce_max(y_train).numpy() + 1
+    n_epochs = n_batch_steps // (n_train // batch_size)
+    data_set = data_set_name(data_set)
+    run_config = _run_config(
+        "conv_net", data_set, label_noise_as_int, n_epochs, batch_size, sample_size, seed, data_augmentation,
+        depth=convnet_depth, lr_schedule=_lr_schedule_name(optimizer, train_engine, graph_lr_schedule),
+    )
 
     # store results for later graphing and analysis.
     model_histories = {}
     metrics = {}
 
-    # Paths to save model weights and
-    model_weights_paths = f"trained_model_weights_{data_set}/conv_nets_depth_{convnet_depth}_{label_noise_as_int}pct_noise/"
-    data_save_path = (
-        "experimental_results_{}/conv_nets_depth_{}_{}pct_noise".format(
-            data_set, convnet_depth, label_noise_as_int
-        ) + ".pkl"
+    # Paths to save model weights and experimental results.
+    model_weights_paths, data_save_path = _conv_net_paths(
+        data_set, convnet_depth, label_noise_as_int, data_save_path_prefix, data_save_path_suffix
     )
 
-    # add possilbe data save path identifiers.
-    if data_save_path_prefix:
-        data_save_path = data_save_path_prefix + "/" + data_save_path
+    # load data from prior runs of related experiment.
+    loaded_widths = []
+    if load_saved_metrics or extend:
+        metrics, loaded_widths = _load_saved_metrics(data_save_path)
+
+    if supernet:
+        if extend:
+            raise Exception("extend is not supported in supernet mode, the towers are saved without their optimizer state.")
+        if budget_policy is not None:
+            raise Exception("budget_policy is not supported in supernet mode, the towers can not be stopped separately.")
+
+        convnet_widths = [width for width in convnet_widths if width not in loaded_widths]
+        group_size = len(convnet_widths) if supernet_group_size is None else supernet_group_size
+
+        for start in range(0, len(convnet_widths), group_size):
+            widths = convnet_widths[start : start + group_size]
+            conv_nets, towers, model_ids = make_convNet_towers(
+                image_shape, convnet_depth, widths, n_classes=n_classes
+            )
 
-    if data_save_path_suffix:
-        assert data_save_path[-4:] == ".pkl"
-        data_save_path = data_save_path[:-4] + data_save_path_suffix + ".pkl"
+            conv_optimizer, lr_schedule = _conv_net_optimizer(optimizer, train_engine, graph_lr_schedule)
+            conv_nets.compile(
+                optimizer=conv_optimizer,
+                loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                metrics=_tower_metrics(conv_nets),
+            )
+
+            evaluator = None
+            if async_eval:
+                evaluator = _async_evaluator(
+                    functools.partial(
+                        make_convNet_towers, image_shape, convnet_depth, widths, n_classes=n_classes
+                    ),
+                    image_shape,
+                    fit_inputs,
+                    batch_size,
+                    n_epochs,
+                    eval_schedule,
+                    eval_points,
+                    train_subsets,
+                    n_towers=len(widths),
+                )
+
+            tower_fit_inputs = _tower_fit_inputs(fit_inputs, len(widths))
+            towers_id = "towers_" + "_".join(model_ids)
+            checkpoint_dir = model_weights_paths + towers_id + "_checkpoint/"
+            profiler = _profiler(profile, profile_trace_steps, tower_fit_inputs, n_train, data_save_path, towers_id)
+
+            print(f"STARTING TRAINING: {', '.join(model_ids)}")
+            history = _fit_model(
+                conv_nets,
+                tower_fit_inputs,
+                n_epochs,
+                callbacks=[timer(log_prefix=_tower_log_prefix(len(widths)))]
+                + _live_streams(live_metrics, data_save_path, model_ids, evaluator)
+                + ([] if profiler is None else [profiler]),
+                checkpoint_dir=checkpoint_dir,
+                checkpoint_every=checkpoint_every,
+                lr_schedule=lr_schedule,
+                run_config=run_config,
+                fit=_fit_function(conv_nets, train_engine, steps_per_execution, jit_compile),
+                eval_schedule=eval_schedule,
+                eval_points=eval_points,
+                evaluator=evaluator,
+            )
+            print(f"FINISHED TRAINING: {', '.join(model_ids)}")
+
+            with _timed_save(profiler):
+                for model_id, tower, tower_history in zip(
+                    model_ids, towers, _split_tower_history(history, len(widths))
+                ):
+                    metrics[model_id] = tower_history
+                    if save:
+                        tower.save_weights(model_weights_paths + model_id)
+
+                # Save results to the data file.
+                if save:
+                    _save_results(metrics, model_ids, data_save_path, merge_results, results_store, run_config)
+                    remove_checkpoint(checkpoint_dir)
+
+            if profiler is not None:
+                profiler.save(profile_path(data_save_path, towers_id))
+
+            # clear GPU of prior model to decrease training times.
+            tf.keras.backend.clear_session()
+
+        return metrics
 
     for width in convnet_widths:
-        if load_saved_metrics and width in loaded_widths:
+        if load_saved_metrics and not extend and width in loaded_widths:
             print('width %d results already loaded from .pkl file, training skipped' %width)
             continue
 
@@ -104,38 +355,73 @@ def train_conv_nets(
             image_shape, depth=convnet_depth, init_channels=width, n_classes=n_classes
         )
 
+        conv_optimizer, lr_schedule = _conv_net_optimizer(optimizer, train_engine, graph_lr_schedule)
         conv_net.compile(
-            optimizer=tf.keras.optimizers.SGD(learning_rate=inverse_squareroot_lr())
-            if optimizer is None
-            else optimizer,
+            optimizer=conv_optimizer,
             loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
             metrics=["accuracy"],
         )
 
         model_timer = timer()
 
+        evaluator = None
+        if async_eval:
+            evaluator = _async_evaluator(
+                functools.partial(
+                    make_convNet, image_shape, depth=convnet_depth, init_channels=width, n_classes=n_classes
+                ),
+                image_shape,
+                fit_inputs,
+                batch_size,
+                n_epochs,
+                eval_schedule,
+                eval_points,
+                train_subsets,
+            )
+
+        profiler = _profiler(profile, profile_trace_steps, fit_inputs, n_train, data_save_path, model_id)
+
         print(f"STARTING TRAINING: {model_id}")
-        history = conv_net.fit(
-            x=x_train,
-            y=y_train,
-            validation_data=(x_test, y_test),
-            epochs=n_epochs,
-            batch_size=batch_size,
-            verbose=0,
-            callbacks=[model_timer],
+        history = _fit_model(
+            conv_net,
+            fit_inputs,
+            n_epochs,
+            callbacks=[model_timer]
+            + _live_streams(live_metrics, data_save_path, [model_id], evaluator)
+            + ([] if profiler is None else [profiler]),
+            checkpoint_dir=model_weights_paths + model_id + "_checkpoint/",
+            checkpoint_every=checkpoint_every,
+            lr_schedule=lr_schedule,
+            run_config=run_config,
+            extend_from=(model_weights_paths + model_id, metrics[model_id])
+            if extend and model_id in metrics
+            else None,
+            fit=_fit_function(conv_net, train_engine, steps_per_execution, jit_compile),
+            eval_schedule=eval_schedule,
+            eval_points=eval_points,
+            evaluator=evaluator,
+            budget_policy=budget_policy,
         )
         print(f"FINISHED TRAINING: {model_id}")
 
         # add results to dictionary and store the resulting model weights.
-        metrics[model_id] = history.history
+        metrics[model_id] = history
+
+        # Save results to the data file.
+        with _timed_save(profiler):
+            if save:
+                _save_results(metrics, [model_id], data_save_path, merge_results, results_store, run_config)
+                conv_net.save_weights(model_weights_paths + model_id)
+                remove_checkpoint(model_weights_paths + model_id + "_checkpoint/")
+
+        if profiler is not None:
+            profiler.save(profile_path(data_save_path, model_id))
 
         # clear GPU of prior model to decrease training times.
         tf.keras.backend.clear_session()
 
-        # Save results to the data file.
-        if save:
-            pkl.dump(metrics, open(data_save_path, "wb"))
-            history.model.save_weights(model_weights_paths + model_id)
+    if budget_policy is not None:
+        _print_budget_summary(metrics)
 
     return metrics
 
@@ -152,7 +438,30 @@ def train_resnet18(
     save=True,
     data_save_path_prefix="",
     data_save_path_suffix="",
-    load_saved_metrics=False
+    load_saved_metrics=False,
+    data_augmentation=False,
+    data_pipeline=False,
+    low_memory=False,
+    seed=None,
+    cache_dir=None,
+    memoize=False,
+    merge_results=False,
+    results_store=True,
+    data=None,
+    checkpoint_every=None,
+    extend=False,
+    train_engine="fit",
+    steps_per_execution=1,
+    jit_compile=False,
+    eval_schedule=None,
+    eval_points=100,
+    eval_sample_size=None,
+    async_eval=False,
+    async_eval_train_size=None,
+    budget_policy=None,
+    live_metrics=False,
+    profile=False,
+    profile_trace_steps=None,
 ):
     """
     Train and save the results of ResNets nets of a given range of model widths.
@@ -160,7 +469,8 @@ def train_resnet18(
     Parameters
     ----------
     data_set: str
-        Which data set to train on. See the load data funciton.
+        Which data set to train on. See the load data funciton. Data sets stored as TFRecord shards
+        ('tfrecord:/path' or registered with a tfrecord_dir) are streamed, see load_streaming_data.
     resnet_widths: list[int]
         List of model widths to train.
     label_noise_as_int: int
@@ -180,65 +490,143 @@ def train_resnet18(
     data_save_path_prefix: str
         prefix to add to the save pkl file path.
     data_save_path_suffix: str
-        suffix to add to the save pkl file name.
+        suffix to add to the save pkl file name and the model weights directory.
     load_saved_metrics: bool
         if True, will attempt to load the metrics from a previous training session in the save_path,
         to continue training from there. If True, will load the saved .pkl file instead of starting
         over and overwriting it. 
+    data_augmentation: bool
+        whether or not to use random cropping and horizontal flipping to augment training data. Every
+        data set of 32x32 RGB images is augmented, i.e. cifar10, cifar100 and local copies of them.
+    data_pipeline: bool
+        if True, stream the data through a tf.data pipeline which shuffles, normalizes and augments
+        each batch on the fly (see make_data_pipeline), instead of augmenting the whole data set up front.
+    low_memory: bool
+        if True, keep the images as uint8 and normalize each batch in the data pipeline instead of
+        casting the whole data set to tf.float32. Implies data_pipeline.
+    seed: int
+        Seed used to draw the training subsample and label noise, see load_data.
+    cache_dir: str
+        Directory of the on-disk data set cache, see load_data. Lets separate calls (e.g. width
+        sweeps split across notebook cells) reuse the exact same noisy labels. Requires a seed.
+    memoize: bool
+        if True, reuse the data loaded by earlier calls in this process, see load_data. Requires a seed.
+        low_memory, cache_dir and memoize only apply to in-memory data sets, streaming (TFRecord) data
+        sets raise if any of them is given.
+    merge_results: bool
+        if True, merge each finished width into the existing results file (under a file lock) instead of
+        overwriting it with the results of this call only. Used when several processes train widths of
+        the same sweep, see utils.sweep.
+    results_store: bool
+        if True, save every finished width as its own record of the append-only results store (see
+        utils.results_store) instead of rewriting the whole .pkl results file, so merge_results is not needed.
+        Saved results are read back from either format by load_saved_metrics and load_results.
+    data: tuple
+        Already loaded ((x_train, y_train), (x_test, y_test), image_shape) to train on instead of loading
+        data_set, e.g. zero-copy views of a data set shared between processes (see utils.shared_data).
+        NumPy images are streamed through the data pipeline. data_set is then only used in the save paths.
+    checkpoint_every: int
+        if given, checkpoint the model, optimizer, learning rate step and history of the width being trained
+        every checkpoint_every epochs (see utils.checkpointing), in a '{model_id}_checkpoint' directory next to
+        the saved weights. An interrupted width is then resumed from its last checkpoint on the next call with
+        the same run config (seed, label noise, sample size, number of epochs, ...). The checkpoints are
+        deleted once the final weights and results of the width are saved.
+    extend: bool
+        if True, continue training the widths already in the results file from their saved weights and
+        optimizer state (see restore_trained_model) up to the new number of epochs, and append the new epochs
+        to their history. Used to extend a finished run to a larger training budget, e.g. from 500_000 to
+        1_600_000 batch steps. Widths not in the results file are trained from scratch.
+    train_engine: str
+        'fit' to train with model.fit, or 'compiled' to train with the tf.function compiled training loop of
+        utils.training_loop.fit_compiled. Both use the same default optimizer. The compiled engine was not
+        faster than fit for conv nets on CPU (see benchmarks/bench_train_engine.py), so benchmark it on the
+        target hardware before using it.
+    steps_per_execution: int
+        Number of gradient steps per call of the compiled training loop. Only used by the compiled engine.
+    jit_compile: bool
+        if True, compile the gradient step with XLA. Only used by the compiled engine.
+    eval_schedule: int or str
+        When to evaluate the test set: None for every epoch, an int k for every k epochs, or 'log' for
+        eval_points log-spaced epochs (see utils.evaluation.evaluation_epochs). The final epoch is always
+        evaluated. Skipped epochs get NaN test metrics, and the history gets a 'val_epochs' list of the
+        evaluated (0-based) epochs.
+    eval_points: int
+        Number of evaluations of the 'log' eval_schedule.
+    eval_sample_size: int
+        if given, evaluate on a fixed random subsample (drawn with seed) of this many test examples.
+    async_eval: bool
+        if True, evaluate snapshots of the weights (at the epochs of eval_schedule) in a background thread
+        instead of inside model.fit, see utils.evaluation.async_evaluator. The results are written into the
+        history in the same format.
+    async_eval_train_size: int
+        if given with async_eval, also evaluate fixed subsets of this many correctly and incorrectly labelled
+        training examples, logged as 'clean_train_loss', 'clean_train_accuracy', 'noisy_train_loss' and
+        'noisy_train_accuracy' (against their training labels). Requires an explicit seed.
+    budget_policy: utils.budget.plateau_budget
+        if given, stop the widths which have converged (plateau of the train loss and test error, or
+        interpolation) and give the saved epochs to later widths near the interpolation threshold of the same
+        call (see utils.budget.plateau_budget for when that helps). Every history records its 'stop_reason',
+        'stop_epoch' and 'budget_epochs', see utils.budget.budget_summary.
+    live_metrics: bool
+        if True, append the metrics of every epoch to a JSONL stream per width while it trains, which
+        utils.live_metrics follows to plot the sweep as it progresses.
+    profile: bool
+        if True, time the input wait, gradient steps, evaluations and saves of every epoch of every width,
+        with its images per second and peak memory, and save the summary next to the results, see
+        utils.profiling.
+    profile_trace_steps: tuple(int, int)
+        if given with profile, also capture a TensorFlow profiler trace of these gradient steps of every width.
     """
 
     label_noise = label_noise_as_int / 100
+    batch_size = 128 if batch_size is None else batch_size
 
     # load the relevent dataset
-    (x_train, y_train), (x_test, y_test), image_shape = load_data(
-        data_set, label_noise, augment_data=False, sample_size=sample_size
+    fit_inputs, image_shape, n_train, n_classes = _load_fit_data(
+        data_set,
+        label_noise,
+        batch_size,
+        data_augmentation=data_augmentation,
+        sample_size=sample_size,
+        data_pipeline=data_pipeline,
+        low_memory=low_memory,
+        seed=seed,
+        cache_dir=cache_dir,
+        memoize=memoize,
+        data=data,
+        eval_sample_size=eval_sample_size,
     )
 
-    batch_size = 128 if batch_size is None else batch_size
-    n_classes = tf.math.reduce_max(y_train).numpy() + 1
+    train_subsets = None
+    if async_eval and async_eval_train_size:
+        train_subsets = _clean_and_noisy_train_subsets(
+            data_set, label_noise, sample_size, seed, cache_dir, async_eval_train_size
+        )
 
     # total number desirec SGD steps / number batches per epoch = n_epochs
     if not n_epochs:
-        n_epochs = n_batch_steps // (x_train.shape[0] // batch_size)
+        n_epochs = n_batch_steps // (n_train // batch_size)
+    data_set = data_set_name(data_set)
+    run_config = _run_config(
+        "resnet18", data_set, label_noise_as_int, n_epochs, batch_size, sample_size, seed, data_augmentation
+    )
 
     # store results for later graphing and analysis.
     model_histories = {}
     metrics = {}
 
     # Paths to save model weights and experimental results.
-    model_weights_paths = f"trained_model_weights_{data_set}/resnet18_{label_noise_as_int}pct_noise/"
-    data_save_path = (
-        f"experimental_results_{data_set}/resnet18_{label_noise_as_int}pct_noise" + ".pkl"
+    model_weights_paths, data_save_path = _resnet_paths(
+        data_set, label_noise_as_int, data_save_path_prefix, data_save_path_suffix
     )
 
-    # add possible path identifiers.
-    if data_save_path_prefix:
-        data_save_path = data_save_path_prefix + "/" + data_save_path
-    if data_save_path_suffix:
-        assert data_save_path[-4:] == ".pkl"
-        data_save_path = data_save_path[:-4] + data_save_path_suffix + ".pkl"
-    
     # load data from prior runs of related experiment.
-    if load_saved_metrics:
-        try:
-            with open(data_save_path, 'rb') as f:
-                metrics = pkl.load(f)
-        except Exception as e:
-            print('Could not find saved metrics.pkl file, exiting')
-            raise e
-
-        loaded_widths = [int(i.split('_')[-1]) for i in metrics.keys()]
-        assert resnet_widths[:len(loaded_widths)] == loaded_widths
-        print('loaded results for width %s from existing file at %s' %(', '.join([str(i) for i in loaded_widths]), data_save_path))
-
-        assert data_save_path[-4:] == ".pkl"
-        data_backup_path = data_save_path[:-4] + 'backup_w%d_' %loaded_widths[-1] + time.strftime("%D_%H%M%S").replace('/', '') + ".pkl"
-        print('saving existing result.pkl to backup at %s' %data_backup_path)
-        pkl.dump(metrics, open(data_backup_path, "wb"))
-
+    loaded_widths = []
+    if load_saved_metrics or extend:
+        metrics, loaded_widths = _load_saved_metrics(data_save_path)
 
     for width in resnet_widths:
-        if load_saved_metrics and width in loaded_widths:
+        if load_saved_metrics and not extend and width in loaded_widths:
             print('width %d results already loaded from .pkl file, training skipped' %width)
             continue
 
@@ -259,33 +647,858 @@ def train_resnet18(
         # Custom Timer with cleaner output.
         model_timer = timer()
 
+        evaluator = None
+        if async_eval:
+            evaluator = _async_evaluator(
+                functools.partial(make_resnet18_UniformHe, image_shape, k=width, num_classes=n_classes),
+                image_shape,
+                fit_inputs,
+                batch_size,
+                n_epochs,
+                eval_schedule,
+                eval_points,
+                train_subsets,
+            )
+
+        profiler = _profiler(profile, profile_trace_steps, fit_inputs, n_train, data_save_path, model_id)
+
         print(f"STARTING TRAINING: {model_id}, Label Noise: {label_noise}")
-        history = resnet.fit(
-            x=x_train,
-            y=y_train,
-            validation_data=(x_test, y_test),
-            epochs=n_epochs,
-            batch_size=batch_size,
-            verbose=0,
-            callbacks=[model_timer],
+        history = _fit_model(
+            resnet,
+            fit_inputs,
+            n_epochs,
+            callbacks=[model_timer]
+            + _live_streams(live_metrics, data_save_path, [model_id], evaluator)
+            + ([] if profiler is None else [profiler]),
+            checkpoint_dir=model_weights_paths + model_id + "_checkpoint/",
+            checkpoint_every=checkpoint_every,
+            run_config=run_config,
+            extend_from=(model_weights_paths + model_id, metrics[model_id])
+            if extend and model_id in metrics
+            else None,
+            fit=_fit_function(resnet, train_engine, steps_per_execution, jit_compile),
+            eval_schedule=eval_schedule,
+            eval_points=eval_points,
+            evaluator=evaluator,
+            budget_policy=budget_policy,
         )
         print(f"FINISHED TRAINING: {model_id}")
 
         # add results to dictionary and store the resulting model weights.
-        metrics[model_id] = history.history
+        metrics[model_id] = history
+
+        # Save results to the data file
+        with _timed_save(profiler):
+            if save:
+                _save_results(metrics, [model_id], data_save_path, merge_results, results_store, run_config)
+                resnet.save_weights(model_weights_paths + model_id)
+                remove_checkpoint(model_weights_paths + model_id + "_checkpoint/")
+
+        if profiler is not None:
+            profiler.save(profile_path(data_save_path, model_id))
 
         # clear GPU of prior model to decrease VRAM usage.
         tf.keras.backend.clear_session()
 
-        # Save results to the data file
+    if budget_policy is not None:
+        _print_budget_summary(metrics)
+
+    return metrics
+
+
+def train_conv_net_replicas(
+    data_set,
+    convnet_depth,
+    convnet_width,
+    label_noise_levels=(0, 10, 20),
+    seeds=(0,),
+    n_batch_steps=500_000,
+    batch_size=None,
+    sample_size=None,
+    optimizer=None,
+    save=True,
+    data_save_path_prefix="",
+    data_save_path_suffix="",
+    data_augmentation=False,
+    data_seed=None,
+    results_store=True,
+    live_metrics=False,
+    graph_lr_schedule=False,
+):
+    """
+    Train one replica of a Conv net for every (label noise, seed) pair, all together in one model.
+
+    The replicas are independent towers of a single Keras model (see make_convNet_towers), so they share
+    one input pipeline and one compiled training step, and each replica is trained on its own noisy label
+    vector. This removes most of the per-step Python and kernel launch overhead of small widths.
+
+    Every replica gets its own Keras-style history, saved under the usual conv_net_depth_{d}_width_{w} id in
+    experimental_results_{data_set}/conv_nets_depth_{d}_{noise}pct_noise{suffix}_seed_{seed}.pkl (merged
+    into the file if it exists, or as a record of the results store). Returns a dictionary {(label_noise_as_int, seed): history}.
+
+    Parameters
+    ----------
+    data_set: str
+        Which data set to train on. See the load data funciton.
+    convnet_depth: int
+    convnet_width: int
+        Width of the replicated model.
+    label_noise_levels: list[int]
+        Percentages of label noise to train replicas for.
+    seeds: list[int]
+        Seeds of the label noise. One replica is trained for each seed and noise level. Without a
+        sample_size, the noisy labels match those of load_data with the same seed.
+    n_batch_steps: int
+        number of gradient descent steps to take.
+    batch_size: int
+        Size of batchs to use during model training. Default to 128.
+    sample_size: int
+        Sample size to train the networks on. The same subsample (drawn with data_seed) is used by all replicas.
+    optimizer: tf.keras.optimizer
+        Optimizer to use. Default is SGD with the inverse square root learning rate.
+    save: bool
+        whether to save the data and trained model weights.
+    data_save_path_prefix: str
+        prefix to add to the save pkl file path.
+    data_save_path_suffix: str
+        suffix to add to the save pkl file name and the model weights directory.
+    data_augmentation: bool
+        whether or not to use random cropping and horizontal flipping on each batch.
+    data_seed: int
+        Seed used to draw the training subsample.
+    results_store: bool
+        if True, save every replica as a record of the append-only results store (see utils.results_store)
+        instead of merging it into the .pkl results file.
+    live_metrics: bool
+        if True, append the metrics of every epoch to a JSONL stream per replica while it trains, see
+        utils.live_metrics.
+    graph_lr_schedule: bool
+        if True, the default SGD optimizer uses the graph-native inverse_squareroot_schedule instead of the
+        inverse_squareroot_lr of the earlier results, see train_conv_nets.
+    """
+
+    batch_size = 128 if batch_size is None else batch_size
+    replicas = [(noise, seed) for noise in label_noise_levels for seed in seeds]
+
+    # load the clean data once, and draw a noisy label vector for every replica.
+    (x_train, y_train), (x_test, y_test), image_shape = load_data(
+        data_set, 0, sample_size=sample_size, low_memory=True, seed=data_seed
+    )
+    y_replicas = np.concatenate(
+        [
+            add_label_noise(np.array(y_train), noise / 100, np.random.default_rng(seed))
+            for noise, seed in replicas
+        ],
+        axis=1,
+    )
+
+    n_classes = int(y_train.max()) + 1
+    n_epochs = n_batch_steps // (x_train.shape[0] // batch_size)
+    data_set = data_set_name(data_set)
+    run_config = _run_config(
+        "conv_net", data_set, None, n_epochs, batch_size, sample_size, None, data_augmentation,
+        depth=convnet_depth, data_seed=data_seed,
+        lr_schedule=_lr_schedule_name(optimizer, graph_lr_schedule=graph_lr_schedule),
+    )
+
+    model, towers, model_ids = make_convNet_towers(
+        image_shape, convnet_depth, [convnet_width] * len(replicas), n_classes=n_classes
+    )
+    model_id = model_ids[0]
+
+    model.compile(
+        optimizer=_conv_net_optimizer(optimizer, graph_lr_schedule=graph_lr_schedule)[0],
+        loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+        metrics=_tower_metrics(model),
+    )
+
+    # every tower reads its own column of the stacked label vectors.
+    split_labels = lambda images, labels: (
+        images,
+        {f"tower_{i}": labels[:, i : i + 1] for i in range(len(replicas))},
+    )
+    train_data = make_data_pipeline(
+        x_train, y_replicas, batch_size, augment_data=data_augmentation
+    ).map(split_labels)
+    test_data = make_data_pipeline(x_test, y_test, batch_size, training=False)
+
+    model_timer = timer(log_prefix=_tower_log_prefix(len(replicas)))
+
+    # every replica streams into the sweep of its noise level and seed.
+    streams = []
+    for i, (noise, seed) in enumerate(replicas if live_metrics else []):
+        _, data_save_path = _conv_net_paths(
+            data_set, convnet_depth, noise, data_save_path_prefix, data_save_path_suffix, seed=seed
+        )
+        log_prefix = f"tower_{i}_" if 1 < len(replicas) else ""
+        streams.append(metrics_stream(stream_path(data_save_path, model_id), log_prefix=log_prefix))
+
+    print(f"STARTING TRAINING: {model_id}, {len(replicas)} replicas")
+    history = model.fit(
+        x=train_data,
+        validation_data=_tower_fit_inputs({"validation_data": test_data}, len(replicas))["validation_data"],
+        epochs=n_epochs,
+        verbose=0,
+        callbacks=[model_timer] + streams,
+    )
+    print(f"FINISHED TRAINING: {model_id}")
+
+    metrics = {}
+    for (noise, seed), tower, tower_history in zip(
+        replicas, towers, _split_tower_history(history.history, len(replicas))
+    ):
+        metrics[(noise, seed)] = tower_history
+
+        # Save results to the data file of the replica's noise level and seed.
         if save:
-            pkl.dump(metrics, open(data_save_path, "wb"))
-            history.model.save_weights(model_weights_paths + model_id)
+            model_weights_paths, data_save_path = _conv_net_paths(
+                data_set,
+                convnet_depth,
+                noise,
+                data_save_path_prefix,
+                data_save_path_suffix,
+                seed=seed,
+            )
+            _save_results(
+                {model_id: tower_history},
+                [model_id],
+                data_save_path,
+                True,
+                results_store,
+                {**run_config, "label_noise_as_int": noise, "seed": seed},
+            )
+            tower.save_weights(model_weights_paths + model_id)
+
+    # clear GPU of prior model to decrease training times.
+    tf.keras.backend.clear_session()
 
     return metrics
 
 
-def load_data(data_set, label_noise, augment_data=False, sample_size=None):
+def _fit_model(
+    model,
+    fit_inputs,
+    n_epochs,
+    callbacks,
+    checkpoint_dir=None,
+    checkpoint_every=None,
+    lr_schedule=None,
+    run_config=None,
+    extend_from=None,
+    fit=None,
+    eval_schedule=None,
+    eval_points=100,
+    evaluator=None,
+    budget_policy=None,
+):
+    """
+    Fit a compiled model for n_epochs and return its Keras-style history dictionary.
+
+    fit is the training function to use, model.fit by default (see _fit_function). If eval_schedule is
+    given, the test set is only evaluated at the epochs of utils.evaluation.evaluation_epochs, and the
+    history gets NaN test metrics for the other epochs and a 'val_epochs' list. If an async_evaluator is
+    given, the test set is evaluated by it instead of by fit.
+
+    If checkpoint_every is given, the model is first restored from the last checkpoint of run_config in
+    checkpoint_dir (if any) and only trained for the remaining epochs, and an EpochCheckpoint is written every
+    checkpoint_every epochs and at the end of training. The caller removes the checkpoints once the final
+    weights and results are saved. If extend_from = (weights_path, history) of a
+    finished run is given, training continues from the saved weights and optimizer state instead, unless
+    the checkpoint is further along. The returned history then covers all epochs, including those trained
+    before.
+
+    If a budget_policy (see utils.budget.plateau_budget) is given, training stops once the run has converged,
+    a run near the interpolation threshold may be trained for extra epochs, and the history gets the stop
+    reason, stop epoch and budget of the run.
+    """
+    fit = model.fit if fit is None else fit
+    initial_epoch, history = 0, {}
+    n_saved_epochs = 0 if extend_from is None else len(extend_from[1]["loss"])
+
+    n_checkpoint_epochs = 0 if checkpoint_every is None else checkpoint_epoch(checkpoint_dir, run_config)
+    restored_checkpoint = 0 < n_checkpoint_epochs and n_saved_epochs <= n_checkpoint_epochs
+    if restored_checkpoint:
+        initial_epoch, history = restore_checkpoint(model, checkpoint_dir, lr_schedule, run_config)
+    elif extend_from is not None:
+        initial_epoch, history = restore_trained_model(model, *extend_from, lr_schedule=lr_schedule)
+
+    # the evaluated epochs are recomputed from the full history at the end.
+    has_val_epochs = history.pop("val_epochs", None) is not None or eval_schedule is not None
+    has_val_epochs = has_val_epochs or evaluator is not None
+
+    # a checkpoint with a stop reason is of a finished run.
+    stop_info = {key: history.pop(key) for key in STOP_KEYS if key in history}
+    if restored_checkpoint and stop_info:
+        initial_epoch = n_epochs = max(n_epochs, initial_epoch)
+
+    if evaluator is not None:
+        fit_inputs = {k: v for k, v in fit_inputs.items() if k != "validation_data"}
+        callbacks = [evaluator] + callbacks
+    elif eval_schedule is not None:
+        callbacks = [fill_skipped_evaluations()] + callbacks
+
+    checkpoint = None
+    if checkpoint_every is not None:
+        checkpoint = EpochCheckpoint(
+            checkpoint_dir,
+            checkpoint_every,
+            lr_schedule,
+            history=history,
+            initial_epoch=initial_epoch,
+            run_config=run_config,
+        )
+        if evaluator is not None:
+            evaluator.history = checkpoint.history
+
+    def run_fit(history, start_epoch, end_epoch, run_callbacks):
+        """ Train the epochs start_epoch, ..., end_epoch - 1 and return the full history. """
+        validation_freq = 1
+        if eval_schedule is not None:
+            validation_freq = evaluation_epochs(end_epoch, eval_schedule, eval_points)
+            if evaluator is not None:
+                evaluator.eval_epochs = set(validation_freq)
+
+        new_history = fit(
+            **fit_inputs,
+            epochs=end_epoch,
+            initial_epoch=start_epoch,
+            validation_freq=validation_freq,
+            verbose=0,
+            callbacks=callbacks + run_callbacks + ([] if checkpoint is None else [checkpoint]),
+        ).history
+
+        if checkpoint is not None:
+            return checkpoint.history
+
+        history = {
+            k: history.get(k, [np.nan] * start_epoch) + list(v) for k, v in new_history.items()
+        }
+        if evaluator is not None:
+            evaluator.apply(history)
+        return history
+
+    if initial_epoch < n_epochs:
+        if initial_epoch:
+            print(f"CONTINUING TRAINING FROM EPOCH {initial_epoch}")
+
+        if budget_policy is None:
+            history = run_fit(history, initial_epoch, n_epochs, [])
+        else:
+            stopping = budget_policy.callback(require_evaluation=evaluator is None)
+            history = run_fit(history, initial_epoch, n_epochs, [stopping])
+
+            # give a run near the interpolation threshold extra epochs from the pool.
+            extra_epochs = 0
+            if stopping.stop_reason is None:
+                extra_epochs = budget_policy.extra_epochs(history, n_epochs)
+            if extra_epochs:
+                print(f"EXTENDING TRAINING BY {extra_epochs} REALLOCATED EPOCHS")
+                stopping = budget_policy.callback(require_evaluation=evaluator is None)
+                history = run_fit(history, n_epochs, n_epochs + extra_epochs, [stopping])
+
+            budget_policy.record(history, stopping.stop_reason, n_epochs)
+
+            # keep the stop reason with the final checkpoint, so a restart does not train the run further.
+            if checkpoint is not None:
+                checkpoint.save()
+    else:
+        history.update(stop_info)
+
+    if has_val_epochs:
+        history = add_val_epochs(history)
+
+    return history
+
+
+def _print_budget_summary(metrics):
+    """ Print the stop reason of every model and the epochs saved by a budget policy. """
+    summary = budget_summary(metrics)
+
+    for model_id, (stop_reason, stop_epoch) in summary["stop_reasons"].items():
+        print(f"{model_id}: {stop_reason} at epoch {stop_epoch}")
+    print(
+        f"BUDGET: trained {summary['trained_epochs']} of {summary['budget_epochs']} epochs, "
+        f"saved {summary['saved_epochs']} ({100 * summary['saved_fraction']:.1f}%), "
+        f"reallocated {summary['reallocated_epochs']}, unspent {summary['unspent_epochs']}"
+    )
+
+
+def _async_evaluator(
+    make_model,
+    image_shape,
+    fit_inputs,
+    batch_size,
+    n_epochs,
+    eval_schedule=None,
+    eval_points=100,
+    train_subsets=None,
+    n_towers=None,
+):
+    """
+    Returns an async_evaluator of the test set of fit_inputs and of the train_subsets (see
+    _clean_and_noisy_train_subsets), at the epochs of eval_schedule. make_model returns the model to evaluate
+    as its first output, e.g. a functools.partial of make_convNet. n_towers is the number of outputs of a
+    make_convNet_towers model.
+    """
+    test_data = fit_inputs["validation_data"]
+    if isinstance(test_data, tuple):
+        test_data = make_data_pipeline(*test_data, batch_size, training=False)
+
+    eval_sets = {"val_": test_data}
+    for prefix, (x, y) in (train_subsets or {}).items():
+        eval_sets[prefix] = make_data_pipeline(x, y, batch_size, training=False)
+
+    if n_towers is not None:
+        eval_sets = {
+            prefix: _tower_fit_inputs({"validation_data": data}, n_towers)["validation_data"]
+            for prefix, data in eval_sets.items()
+        }
+
+    def make_eval_model():
+        model = make_model()[0]
+        model(tf.zeros([1] + list(image_shape)), training=False)
+        model.compile(
+            loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+            metrics=["accuracy"] if n_towers is None else _tower_metrics(model),
+        )
+        return model
+
+    eval_epochs = None
+    if eval_schedule is not None:
+        eval_epochs = evaluation_epochs(n_epochs, eval_schedule, eval_points)
+
+    return async_evaluator(make_eval_model, eval_sets, eval_epochs)
+
+
+def _fit_function(model, train_engine="fit", steps_per_execution=1, jit_compile=False):
+    """ Returns model.fit, or the compiled training loop of utils.training_loop with the same signature. """
+    if train_engine == "fit":
+        return model.fit
+    if train_engine == "compiled":
+        return functools.partial(
+            fit_compiled, model, steps_per_execution=steps_per_execution, jit_compile=jit_compile
+        )
+
+    raise Exception(f"Unknown train_engine '{train_engine}', use 'fit' or 'compiled'.")
+
+
+def _conv_net_optimizer(optimizer, train_engine="fit", graph_lr_schedule=False):
+    """
+    Returns the optimizer to train a conv net with, and the inverse_squareroot_lr it uses (if any), whose step
+    counter is checkpointed. Default is SGD with the learning rate schedule of _default_lr_schedule.
+    """
+    if optimizer is not None:
+        return optimizer, None
+
+    lr_schedule = _default_lr_schedule(train_engine, graph_lr_schedule)()
+    optimizer = tf.keras.optimizers.SGD(learning_rate=lr_schedule)
+    return optimizer, lr_schedule if isinstance(lr_schedule, inverse_squareroot_lr) else None
+
+
+def _default_lr_schedule(train_engine="fit", graph_lr_schedule=False):
+    """
+    Learning rate schedule class of the default conv net optimizer: the inverse_squareroot_lr of the earlier
+    model.fit results, or the graph-native inverse_squareroot_schedule for the compiled engine or if
+    graph_lr_schedule is set. The step of the latter is the optimizer's, checkpointed with the optimizer.
+    """
+    if graph_lr_schedule or train_engine == "compiled":
+        return inverse_squareroot_schedule
+    return inverse_squareroot_lr
+
+
+def _lr_schedule_name(optimizer, train_engine="fit", graph_lr_schedule=False):
+    """ Name of the learning rate schedule of a conv net run for its run config, None for a custom optimizer. """
+    if optimizer is not None:
+        return None
+    return _default_lr_schedule(train_engine, graph_lr_schedule).__name__
+
+
+def _load_saved_metrics(data_save_path):
+    """
+    Load the metrics of a previous training session from data_save_path (and its records in the results
+    store), and back the .pkl file up before it is overwritten. Returns the metrics and the list of widths
+    they contain.
+    """
+    try:
+        metrics = load_metrics(data_save_path)
+    except Exception as e:
+        print('Could not find saved metrics.pkl file, exiting')
+        raise e
+
+    loaded_widths = [int(i.split('_')[-1]) for i in metrics.keys()]
+    print('loaded results for width %s from existing file at %s' %(', '.join([str(i) for i in loaded_widths]), data_save_path))
+
+    # records of the results store are never rewritten, only the legacy .pkl file needs a backup.
+    if os.path.exists(data_save_path):
+        assert data_save_path[-4:] == ".pkl"
+        data_backup_path = data_save_path[:-4] + 'backup_w%d_' %loaded_widths[-1] + time.strftime("%D_%H%M%S").replace('/', '') + ".pkl"
+        print('saving existing result.pkl to backup at %s' %data_backup_path)
+        pkl.dump(metrics, open(data_backup_path, "wb"))
+
+    return metrics, loaded_widths
+
+
+def _conv_net_paths(
+    data_set, convnet_depth, label_noise_as_int, data_save_path_prefix="", data_save_path_suffix="", seed=None
+):
+    """
+    Returns the model weights directory and the results .pkl path of a conv net sweep. The suffix (e.g. the
+    '_samples_{n}_seed_{s}' of an experiment grid cell) and seed are added to both, so runs of different
+    sweeps never share weights or checkpoints.
+    """
+
+    # runs of several label noise seeds are stored seperately.
+    seed_suffix = "" if seed is None else f"_seed_{seed}"
+
+    # Paths to save model weights and
+    model_weights_paths = (
+        f"trained_model_weights_{data_set}/conv_nets_depth_{convnet_depth}_{label_noise_as_int}pct_noise"
+        f"{data_save_path_suffix}{seed_suffix}/"
+    )
+    data_save_path = (
+        "experimental_results_{}/conv_nets_depth_{}_{}pct_noise".format(
+            data_set, convnet_depth, label_noise_as_int
+        ) + ".pkl"
+    )
+
+    # add possilbe data save path identifiers.
+    if data_save_path_prefix:
+        data_save_path = data_save_path_prefix + "/" + data_save_path
+
+    if data_save_path_suffix or seed_suffix:
+        assert data_save_path[-4:] == ".pkl"
+        data_save_path = data_save_path[:-4] + data_save_path_suffix + seed_suffix + ".pkl"
+
+    return model_weights_paths, data_save_path
+
+
+def _resnet_paths(data_set, label_noise_as_int, data_save_path_prefix="", data_save_path_suffix=""):
+    """ Returns the model weights directory and the results .pkl path of a ResNet18 sweep, see _conv_net_paths. """
+    model_weights_paths = f"trained_model_weights_{data_set}/resnet18_{label_noise_as_int}pct_noise{data_save_path_suffix}/"
+    data_save_path = (
+        f"experimental_results_{data_set}/resnet18_{label_noise_as_int}pct_noise" + ".pkl"
+    )
+
+    # add possible path identifiers.
+    if data_save_path_prefix:
+        data_save_path = data_save_path_prefix + "/" + data_save_path
+    if data_save_path_suffix:
+        assert data_save_path[-4:] == ".pkl"
+        data_save_path = data_save_path[:-4] + data_save_path_suffix + ".pkl"
+
+    return model_weights_paths, data_save_path
+
+
+def _tower_fit_inputs(fit_inputs, n_towers):
+    """ Repeat the labels of the model.fit data keyword arguments for each output of a make_convNet_towers model. """
+    repeat = lambda labels: {f"tower_{i}": labels for i in range(n_towers)}
+    fit_inputs = dict(fit_inputs)
+
+    if "y" in fit_inputs:
+        fit_inputs["y"] = repeat(fit_inputs["y"])
+    elif "x" in fit_inputs:
+        fit_inputs["x"] = fit_inputs["x"].map(lambda images, labels: (images, repeat(labels)))
+
+    if isinstance(fit_inputs["validation_data"], tuple):
+        x_test, y_test = fit_inputs["validation_data"]
+        fit_inputs["validation_data"] = (x_test, repeat(y_test))
+    else:
+        fit_inputs["validation_data"] = fit_inputs["validation_data"].map(
+            lambda images, labels: (images, repeat(labels))
+        )
+
+    return fit_inputs
+
+
+def _live_streams(live_metrics, data_save_path, model_ids, evaluator=None):
+    """ metrics_stream callbacks of the models (towers) of a model being trained, if live_metrics is set. """
+    if not live_metrics:
+        return []
+
+    return [
+        metrics_stream(
+            stream_path(data_save_path, model_id),
+            log_prefix=f"tower_{i}_" if 1 < len(model_ids) else "",
+            evaluator=evaluator,
+        )
+        for i, model_id in enumerate(model_ids)
+    ]
+
+
+def _profiler(profile, profile_trace_steps, fit_inputs, n_train, data_save_path, model_id):
+    """
+    training_profiler of a model being trained, if profile is set. The input is probed only if the training
+    data is a tf.data pipeline: wrapping in-memory arrays in a Dataset would embed a copy of them in the graph.
+    """
+    if not profile:
+        return None
+
+    input_data = fit_inputs["x"] if isinstance(fit_inputs["x"], tf.data.Dataset) else None
+    trace_dir = profile_path(data_save_path, model_id)[: -len(".json")] + "_trace"
+    return training_profiler(n_train, trace_dir, profile_trace_steps, input_data)
+
+
+def _timed_save(profiler):
+    """ Context counting its block as save time of the profiler, if there is one. """
+    return contextlib.nullcontext() if profiler is None else profiler.time_save()
+
+
+def _tower_metrics(model):
+    """ Accuracy metric of every output of a make_convNet_towers model. Keras 3 does not apply a list to every output. """
+    return {name: ["accuracy"] for name in model.output_names}
+
+
+def _tower_log_prefix(n_towers):
+    """ Prefix of the first tower's metrics in the logs. Keras does not prefix the metrics of single output models. """
+    return "tower_0_" if 1 < n_towers else ""
+
+
+def _split_tower_history(history, n_towers):
+    """ Split the history of a make_convNet_towers model into one Keras-style history per tower. """
+    if n_towers == 1:
+        return [dict(history)]
+
+    histories = [{} for _ in range(n_towers)]
+
+    for key, values in history.items():
+        # the evaluated epochs are shared by all towers.
+        if key == "val_epochs":
+            for tower_history in histories:
+                tower_history[key] = values
+            continue
+
+        # e.g. 'val_tower_3_loss' is the 'val_loss' of tower 3.
+        match = re.fullmatch(r"(.*?)tower_(\d+)_(.+)", key)
+
+        # skip the summed loss of all towers.
+        if match is not None:
+            histories[int(match.group(2))][match.group(1) + match.group(3)] = values
+
+    return histories
+
+
+def _run_config(
+    model, data_set, label_noise_as_int, n_epochs, batch_size, sample_size, seed, data_augmentation, **config
+):
+    """ Config of the runs of a training call, saved with their records in the results store. """
+    return dict(
+        model=model,
+        data_set=data_set,
+        label_noise_as_int=label_noise_as_int,
+        n_epochs=n_epochs,
+        batch_size=batch_size,
+        sample_size=sample_size,
+        seed=seed,
+        data_augmentation=data_augmentation,
+        **config,
+    )
+
+
+def _save_results(metrics, model_ids, data_save_path, merge=False, results_store=True, run_config=None):
+    """
+    Save the histories of the models which just finished training: as records of the results store (with
+    run_config and their model id as config), or by (merging and) rewriting the .pkl results file.
+    """
+    if not results_store:
+        _save_metrics(metrics, data_save_path, merge=merge)
+        return
+
+    for model_id in model_ids:
+        save_run(data_save_path, model_id, metrics[model_id], {**(run_config or {}), "model_id": model_id})
+
+
+def _save_metrics(metrics, data_save_path, merge=False):
+    """
+    Atomically write the metrics dictionary to data_save_path.
+
+    If merge is True, the metrics are merged into the existing file while holding an exclusive lock on
+    data_save_path + '.lock', so concurrent writers do not drop each other's widths. Models are written in
+    order of width, whatever order they finished in.
+    """
+    if not merge:
+        _atomic_pickle_dump(_sort_by_width(metrics), data_save_path)
+        return
+
+    with open(data_save_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.exists(data_save_path):
+            with open(data_save_path, "rb") as f:
+                metrics = {**pkl.load(f), **metrics}
+
+        _atomic_pickle_dump(_sort_by_width(metrics), data_save_path)
+
+
+def _sort_by_width(metrics):
+    return {model_id: metrics[model_id] for model_id in sorted(metrics, key=model_width)}
+
+
+def _atomic_pickle_dump(obj, path):
+    """ Pickle obj to a temporary file and rename it into place, so a crash mid-write never corrupts path. """
+    tmp_path = path + ".tmp_%d" % os.getpid()
+    with open(tmp_path, "wb") as f:
+        pkl.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def _load_fit_data(
+    data_set,
+    label_noise,
+    batch_size,
+    data_augmentation=False,
+    sample_size=None,
+    data_pipeline=False,
+    low_memory=False,
+    seed=None,
+    cache_dir=None,
+    memoize=False,
+    data=None,
+    eval_sample_size=None,
+):
+    """
+    Load a data set for training and return the data keyword arguments for model.fit (either in-memory
+    tensors or streaming tf.data pipelines), the image shape, the number of training examples and the
+    number of classes.
+
+    See train_conv_nets for a description of the parameters.
+    """
+
+    if data is not None:
+        (x_train, y_train), (x_test, y_test), image_shape = data
+        return _make_fit_inputs(
+            x_train,
+            y_train,
+            x_test,
+            y_test,
+            image_shape,
+            batch_size,
+            data_augmentation,
+            data_pipeline or isinstance(x_train, np.ndarray),
+            eval_sample_size,
+            seed,
+        )
+
+    if is_streaming_data_set(data_set):
+        # the shards are read from disk every epoch, there are no in-memory arrays to keep, cache or reuse.
+        options = {"low_memory": low_memory, "cache_dir": cache_dir, "memoize": memoize}
+        unsupported = [name for name, value in options.items() if value]
+        if unsupported:
+            raise Exception(f"{', '.join(unsupported)} cannot be used with the streaming data set '{data_set}'.")
+
+        train_data, test_data, image_shape, n_train, n_classes = load_streaming_data(
+            data_set,
+            label_noise,
+            batch_size,
+            augment_data=data_augmentation,
+            sample_size=sample_size,
+            seed=seed,
+            eval_sample_size=eval_sample_size,
+        )
+
+        return {"x": train_data, "validation_data": test_data}, image_shape, n_train, n_classes
+
+    data_pipeline = data_pipeline or low_memory
+    (x_train, y_train), (x_test, y_test), image_shape = load_data(
+        data_set,
+        label_noise,
+        augment_data=data_augmentation and not data_pipeline,
+        sample_size=sample_size,
+        low_memory=low_memory,
+        seed=seed,
+        cache_dir=cache_dir,
+        memoize=memoize,
+    )
+
+    return _make_fit_inputs(
+        x_train,
+        y_train,
+        x_test,
+        y_test,
+        image_shape,
+        batch_size,
+        data_augmentation,
+        data_pipeline,
+        eval_sample_size,
+        seed,
+    )
+
+
+def _clean_and_noisy_train_subsets(data_set, label_noise, sample_size, seed, cache_dir, n_examples):
+    """
+    Returns fixed random subsets of (at most) n_examples correctly and incorrectly labelled training examples,
+    with their training labels, as {'clean_train_': (x, y), 'noisy_train_': (x, y)}. The noisy labels are
+    found by comparing the training labels of load_data with the clean labels of the same subsample.
+    """
+    if seed is None or is_streaming_data_set(data_set):
+        raise Exception("Evaluating the clean and noisy training examples requires an explicit seed and an in-memory data set.")
+
+    (x_train, y_train), _, _ = load_data(
+        data_set, label_noise, sample_size=sample_size, low_memory=True, seed=seed, cache_dir=cache_dir
+    )
+    (_, y_clean), _ = _prepare_data(data_set, 0, sample_size=sample_size, seed=seed)
+    is_noisy = (np.asarray(y_train) != y_clean).ravel()
+
+    rng = np.random.default_rng(seed)
+    subsets = {}
+    for prefix, mask in [("clean_train_", ~is_noisy), ("noisy_train_", is_noisy)]:
+        idx = np.flatnonzero(mask)
+        if idx.shape[0] == 0:
+            continue
+
+        idx = np.sort(rng.choice(idx, min(n_examples, idx.shape[0]), replace=False))
+        subsets[prefix] = (x_train[idx], np.asarray(y_train)[idx])
+
+    return subsets
+
+
+def _make_fit_inputs(
+    x_train,
+    y_train,
+    x_test,
+    y_test,
+    image_shape,
+    batch_size,
+    data_augmentation,
+    data_pipeline,
+    eval_sample_size=None,
+    seed=None,
+):
+    """ Returns the _load_fit_data outputs for an in-memory data set. """
+    n_classes = int(tf.math.reduce_max(y_train).numpy()) + 1
+
+    if eval_sample_size is not None:
+        x_test, y_test = subsample_test_set(x_test, y_test, eval_sample_size, seed)
+
+    if data_pipeline:
+        fit_inputs = {
+            "x": make_data_pipeline(
+                x_train, y_train, batch_size, augment_data=data_augmentation
+            ),
+            "validation_data": make_data_pipeline(
+                x_test, y_test, batch_size, training=False
+            ),
+        }
+    else:
+        fit_inputs = {
+            "x": x_train,
+            "y": y_train,
+            "validation_data": (x_test, y_test),
+            "batch_size": batch_size,
+        }
+
+    return fit_inputs, image_shape, x_train.shape[0], n_classes
+
+
+def load_data(
+    data_set,
+    label_noise,
+    augment_data=False,
+    sample_size=None,
+    low_memory=False,
+    seed=None,
+    cache_dir=None,
+    memoize=False,
+):
     """
     Helper Function to Load data in the form of a tensorflow data set, apply label noise, and return the
     train data and test data.
@@ -293,39 +1506,117 @@ def load_data(data_set, label_noise, augment_data=False, sample_size=None):
     Parameters
     ----------
     data_set: str 
-        name of data set to load from tf.keras.datasets
+        name of data set to load from tf.keras.datasets, a data set registered in utils.datasets, or a
+        local path such as 'npz:/data/cifar10.npz' (see get_dataset_loader).
     label_noise: float
         percentage of training data to add noise to
     augment_data: boolean
         whether or not to use random cropping and horizontal flipping to augment training data
     sample_size: int
         The size of the data set to return.
+    low_memory: bool
+        if True, return the images as uint8 NumPy arrays (views of the loaded data where possible) and the
+        labels in their original dtype, instead of tf.float32 / tf.int16 tensors. The images then need to be
+        normalized per batch, e.g. by make_data_pipeline.
+    seed: int
+        Seed used to draw the subsample and the label noise. Default is to draw them at random.
+    cache_dir: str
+        if given, the final noised, subsampled and augmented arrays are written once to this directory
+        as .npy files (see utils.data_cache), and memory mapped from there on later calls with the same
+        data_set, label_noise, seed, sample_size and augment_data. Requires an explicit seed, as memoize.
+    memoize: bool
+        if True, keep the returned (read-only) arrays in an in-process LRU cache (utils.data_cache.memory_cache)
+        and return them directly on later calls with the same arguments. Requires an explicit seed, since
+        unseeded calls are expected to draw a new subsample and label noise. Use memory_cache.resize to set
+        the memory budget and memory_cache.stats() to see the hits, misses and evictions.
     """
 
-    datasets = ["cifar10", "cifar100", "mnist"]
+    if memoize:
+        if seed is None:
+            raise Exception("load_data(memoize=True) requires an explicit seed.")
 
-    # load Cifar 10, Cifar 100, or mnis data set
-    if data_set == "cifar10":
-        get_data = tf.keras.datasets.cifar10
-    elif data_set == "cifar100":
-        get_data = tf.keras.datasets.cifar100
-    elif data_set == "mnist":
-        get_data = tf.keras.datasets.mnist
-    else:
-        raise Exception(
-            f"Please enter a data set from the following options: {datasets}"
+        memo_key = (data_set, label_noise, augment_data, sample_size, low_memory, seed)
+        data = memory_cache.get(memo_key)
+        if data is not None:
+            return data
+
+        data = load_data(
+            data_set, label_noise, augment_data, sample_size, low_memory, seed, cache_dir
         )
+        return memory_cache.put(memo_key, data)
+
+    if cache_dir is not None and seed is None:
+        raise Exception("load_data(cache_dir=...) requires an explicit seed.")
+
+    cache_config = {
+        "data_set": data_set,
+        "label_noise": label_noise,
+        "seed": seed,
+        "sample_size": sample_size,
+        "augment_data": augment_data,
+    }
+
+    data = None
+    if cache_dir is not None:
+        data = load_cached_data(cache_dir, cache_config)
+
+    if data is None:
+        data = _prepare_data(data_set, label_noise, augment_data, sample_size, seed)
+
+        if cache_dir is not None:
+            data = save_cached_data(cache_dir, cache_config, data)
+
+    (x_train, y_train), (x_test, y_test) = data
+    image_shape = x_train[0].shape
+
+    if low_memory:
+        return (np.asarray(x_train), y_train), (x_test, y_test), list(image_shape)
+
+    # cast values to tf.float32 and normalize images to range [0-1]
+    x_train, x_test = (
+        tf.cast(x_train, tf.float32) / 255,
+        tf.cast(x_test, tf.float32) / 255,
+    )
+    y_train, y_test = tf.cast(y_train, tf.int16), tf.cast(y_test, tf.int16)
+
+    return (x_train, y_train), (x_test, y_test), list(image_shape)
+
+
+def _prepare_data(data_set, label_noise, augment_data=False, sample_size=None, seed=None):
+    """ Load the raw data set and apply the subsampling, label noise and augmentation. Returns NumPy arrays. """
+
+    # load Cifar 10, Cifar 100, mnist or a local / registered data set, see utils.datasets.
+    (x_train, y_train), (x_test, y_test) = get_dataset_loader(data_set)()
+
+    rng = np.random.default_rng(seed)
 
-    # load the data.
-    (x_train, y_train), (x_test, y_test) = get_data.load_data()
-    
     if sample_size is not None:
-        idx = np.random.choice(y_train.shape[0], sample_size, replace=False)
+        idx = rng.choice(y_train.shape[0], sample_size, replace=False)
         x_train, y_train = x_train[idx], y_train[idx]       
 
     # apply label noise to the data set
+    y_train = add_label_noise(y_train, label_noise, rng)
+        
+    if augment_data:
+        (x_train,y_train) = augment_data_set(data_set, x_train, y_train, rng=rng)
+
+    return (x_train, y_train), (x_test, y_test)
+
+def add_label_noise(y_train, label_noise, rng):
+    """
+    Replace the labels of int(label_noise * n) randomly chosen training examples by a different random label.
+
+    Parameters
+    ----------
+    y_train: np.array
+        Labels with shape [n, 1]. Modified in place.
+    label_noise: float
+        percentage of training data to add noise to
+    rng: np.random.Generator
+        Random generator to draw the noisy examples and labels from.
+    """
     if 0 < label_noise:
-        random_idx = np.random.choice(
+        random_idx = rng.choice(
             y_train.shape[0], int(label_noise * y_train.shape[0]), replace=False
         )
         # To ensure that the random label is incorrct, we apply noise by first adding 
@@ -334,25 +1625,20 @@ def load_data(data_set, label_noise, augment_data=False, sample_size=None):
         # also in the correct range.
         upper = y_train.max() + 1
         N = random_idx.shape[0]
-        y_train[random_idx] = (y_train[random_idx] + np.random.randint(1, upper, (N, 1))) % upper
-        
-    if augment_data:
-        (x_train,y_train) = augment_data_set(data_set, x_train, y_train )
-    
-    image_shape = x_train[0].shape
-    # cast values to tf.float32 and normalize images to range [0-1]
-    x_train, x_test = (
-        tf.cast(x_train, tf.float32) / 255,
-        tf.cast(x_test, tf.float32) / 255,
-    )
-    y_train, y_test = tf.cast(y_train, tf.int16), tf.cast(y_test, tf.int16)
+        y_train[random_idx] = (y_train[random_idx] + rng.integers(1, upper, (N, 1))) % upper
+
+    return y_train
 
-    return (x_train, y_train), (x_test, y_test), list(image_shape)
 
 class inverse_squareroot_lr:
     """
     This is the learning rate used with SGD in the paper (Inverse square root decay).
     Learning Rate starts at 0.1 and then drops every 512 batches.
+
+    Note: its Python step counter only advances when the training step is traced, so inside model.fit the
+    learning rate stays at its value at the start of training. It is kept as the default of model.fit runs
+    so that they stay comparable to the earlier results, pass graph_lr_schedule=True to the training
+    functions for inverse_squareroot_schedule, which decays with the optimizer step.
     """
 
     def __init__(self, n_steps=512, init_lr=0.1):
@@ -367,28 +1653,62 @@ class inverse_squareroot_lr:
         self.gradient_steps += 1
         return lr
 
-def augment_data_set(data_set, x_train, y_train, crop_height=40, crop_width=40):
+
+class inverse_squareroot_schedule(tf.keras.optimizers.schedules.LearningRateSchedule):
+    """
+    Graph-native version of inverse_squareroot_lr, computed from the optimizer step. Unlike the Python
+    counter of inverse_squareroot_lr, it keeps decaying inside compiled training steps, and is restored
+    with the optimizer from checkpoints.
+    """
+
+    def __init__(self, n_steps=512, init_lr=0.1):
+        self.n = n_steps
+        self.init_lr = init_lr
+
+    def __call__(self, step):
+        return self.init_lr / tf.math.sqrt(
+            1.0 + tf.math.floor(tf.cast(step, tf.float32) / self.n)
+        )
+
+    def get_config(self):
+        return {"n_steps": self.n, "init_lr": self.init_lr}
+
+def augment_data_set(data_set, x_train, y_train, crop_height=40, crop_width=40, rng=None):
     """ 
-        data_set: tf.data.Dataset (https://www.tensorflow.org/api_docs/python/tf/data/Dataset)
-    Apply random cropping and random horizontal flip data augmentation as done in Deep Double Descent """
-    
-    # data augmentation is validated only for cifar10
-    
-    [height,width,channels] = x_train[0].shape
+    Apply random cropping and random horizontal flip data augmentation as done in Deep Double Descent.
+
+    The training set is duplicated, and every image of both copies gets its own random flip and pad-crop
+    (see utils.augmentation.flip_pad_crop_batch).
+
+    Parameters
+    ----------
+    data_set: str
+        name of the data set. Data augmentation is validated only for cifar10, but it is keyed on the
+        image shape: all CIFAR shaped (32x32 RGB) images are augmented, whatever their source (e.g.
+        'npz:/data/cifar10.npz'), so cifar100 is augmented too. Other data sets, e.g. mnist, are
+        returned unchanged.
+    x_train, y_train: np.array
+        Training images and labels.
+    crop_height, crop_width: int
+        Size of the padded images the random crops are taken from.
+    rng: np.random.Generator
+        Random generator to draw the flips and crops from.
+    """
     
-    if data_set == "cifar10":
+    # data augmentation is validated only for cifar10, keyed on the image shape so copies of it are augmented too
+    if x_train.shape[1:] == (32, 32, 3):
+        n_examples = x_train.shape[0]
+
         # duplicate the data so you will more data to train after random flip and crop
-        data_x = np.concatenate((x_train, x_train), axis=0)
+        data_x = np.empty((2 * n_examples,) + x_train.shape[1:], dtype=x_train.dtype)
         y_train = np.concatenate((y_train, y_train), axis=0)
 
-        #flip the images randomly
-        data_x = tf.image.random_flip_left_right(data_x)
-
-        #pad the data before croping
-        npad = ((0, 0),(crop_height-height, crop_width-width), (crop_height-height, crop_width-width), (0, 0))
-        data_x = np.pad(data_x, npad,'constant', constant_values = 125)
-
-        x_train = tf.image.random_crop(data_x,[100000,32,32,3])
+        # flip, pad and crop both copies in chunks, writing straight into the output.
+        for out in [data_x[:n_examples], data_x[n_examples:]]:
+            flip_pad_crop_data_set(
+                x_train, crop_height, crop_width, fill_value=125, rng=rng, out=out
+            )
+        x_train = data_x
 
     return (x_train, y_train)
 
@@ -398,11 +1718,20 @@ class timer(tf.keras.callbacks.Callback):
     Simle call back class to track total training time.
     """
 
-    def __init__(self, n_epochs=25):
+    def __init__(self, n_epochs=25, log_prefix=""):
+        """
+        Parameters
+        ----------
+        n_epochs: int
+            Print the progress every n_epochs.
+        log_prefix: str
+            Prefix of the logged metric names, e.g. 'tower_0_' for a make_convNet_towers model.
+        """
         super().__init__()
 
         self.start_time = time.perf_counter()
         self.n_epochs = n_epochs
+        self.log_prefix = log_prefix
 
     def on_epoch_end(self, epoch, logs=None):
         """ Help keep track of total training time needed for various models. """
@@ -418,8 +1747,9 @@ class timer(tf.keras.callbacks.Callback):
             template = "Epoch: {:04}, Total Run Time: {:02}:{:02}:{:02}"
             template += " - Loss: {:.4e}, Accuracy: {:.3f}, Test Loss: {:.4e}, Test Accuracy: {:.3f}"
 
-            train_loss, train_accuracy = logs["loss"], logs["accuracy"]
-            test_loss, test_accuracy = logs["val_loss"], logs["val_accuracy"]
+            prefix = self.log_prefix
+            train_loss, train_accuracy = logs[prefix + "loss"], logs[prefix + "accuracy"]
+            test_loss, test_accuracy = logs["val_" + prefix + "loss"], logs["val_" + prefix + "accuracy"]
             print(
                 template.format(
                     epoch,
@@ -434,6 +1764,64 @@ class timer(tf.keras.callbacks.Callback):
             )
 
 
+class metrics_stream(tf.keras.callbacks.Callback):
+    """
+    Append the metrics of every epoch to the JSONL stream of a run, see utils.live_metrics. The stream is
+    line buffered, so every finished epoch can be read right away.
+    """
+
+    def __init__(self, path, log_prefix="", evaluator=None):
+        """
+        Parameters
+        ----------
+        path: str
+            Path of the stream, see utils.live_metrics.stream_path.
+        log_prefix: str
+            Prefix of the logged metric names, e.g. 'tower_0_' for a make_convNet_towers model.
+        evaluator: async_evaluator
+            if given, also stream its evaluations as they finish.
+        """
+        super().__init__()
+
+        self.path = path
+        self.log_prefix = log_prefix
+        self.evaluator = evaluator
+        self.streamed_evaluations = set()
+
+    def on_train_begin(self, logs=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "a", buffering=1)
+        self.started = False
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if not self.started:
+            self._write({"start": epoch, "time": time.time()})
+            self.started = True
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._write({**stream_record(epoch, logs, self.log_prefix), "time": time.time()})
+        self._write_evaluations()
+
+    def on_train_end(self, logs=None):
+        # the async_evaluator comes first, so its final evaluations are finished here.
+        self._write_evaluations()
+        self.file.close()
+
+    def _write_evaluations(self):
+        if self.evaluator is None:
+            return
+
+        with self.evaluator.lock:
+            results = dict(self.evaluator.results)
+
+        for epoch in sorted(set(results) - self.streamed_evaluations):
+            self._write(stream_record(epoch, results[epoch], self.log_prefix))
+            self.streamed_evaluations.add(epoch)
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+
 class Model_Trainer:
     # Training Wrapper For Tensorflow Models. Allows a predifined model to be easily trained
     # while also tracking parameter and gradient information.
@@ -526,9 +1914,9 @@ class Model_Trainer:
 
         return self.train_loss.result(), self.train_accuracy.result() * 100
 
-    # Evaluate Model on Test Data
-    def test_step(self, data_set):
-        predictions = self.model.predict(images)
+    # Evaluate Model on a batch of Test Data
+    def test_step(self, images, labels):
+        predictions = self.model(images, training=False)
         test_loss = self.loss_function(labels, predictions)
 
         self.test_loss(test_loss)
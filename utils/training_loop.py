@@ -0,0 +1,214 @@
+import tensorflow as tf
+
+from utils.data_pipeline import AUTOTUNE
+
+
+def fit_compiled(
+    model,
+    x,
+    y=None,
+    validation_data=None,
+    validation_freq=1,
+    batch_size=None,
+    epochs=1,
+    initial_epoch=0,
+    callbacks=None,
+    verbose=0,
+    steps_per_execution=1,
+    jit_compile=False,
+):
+    """
+    Drop-in replacement for model.fit which trains with a tf.function compiled training loop.
+
+    Every call into the graph runs up to steps_per_execution gradient steps, so the Python overhead per
+    batch is paid once per steps_per_execution batches, and the gradient step itself can be compiled with
+    XLA (jit_compile=True). The learning rate should be a tf.keras.optimizers.schedules.LearningRateSchedule
+    (e.g. inverse_squareroot_schedule), which is evaluated from the optimizer step inside the graph.
+
+    The model must be compiled with an optimizer and a sparse categorical loss. The train and test loss and
+    accuracy of every epoch are logged under the same names as model.fit, including the per-output metrics
+    of a make_convNet_towers model, and the epoch level hooks of the callbacks are called as in model.fit.
+    Returns a tf.keras.callbacks.History.
+
+    Parameters
+    ----------
+    model: tf.keras.Model
+        Compiled model to train.
+    x, y:
+        Training images and labels, or a tf.data.Dataset of (images, labels) batches passed as x.
+    validation_data:
+        (x_test, y_test) tuple or tf.data.Dataset evaluated at the end of every epoch.
+    validation_freq: int or list[int]
+        Evaluate validation_data every validation_freq epochs, or at the given (1-based) epochs, as in model.fit.
+    batch_size: int
+        Batch size of in-memory data. Default is 32, as in model.fit.
+    epochs, initial_epoch: int
+        Train the epochs initial_epoch, ..., epochs - 1.
+    callbacks: list[tf.keras.callbacks.Callback]
+    verbose: int
+        Passed on to the callbacks.
+    steps_per_execution: int
+        Number of gradient steps run per call of the compiled training loop.
+    jit_compile: bool
+        if True, compile the gradient step with XLA.
+    """
+    batch_size = 32 if batch_size is None else batch_size
+
+    train_data = _as_dataset(x, y, batch_size, shuffle=True)
+    test_data = validation_data
+    if isinstance(validation_data, tuple):
+        test_data = _as_dataset(*validation_data, batch_size, shuffle=False)
+
+    # multi output models are trained on a dictionary of labels, keyed by output name.
+    output_names = None
+    if isinstance(train_data.element_spec[1], dict):
+        output_names = list(model.output_names)
+
+    # build the model and optimizer variables up front, since they can not be created inside XLA.
+    if not model.built:
+        model(tf.zeros([1] + train_data.element_spec[0].shape[1:]), training=False)
+    if hasattr(model.optimizer, "build"):
+        model.optimizer.build(model.trainable_variables)
+
+    loss_function = tf.keras.losses.get(model.loss)
+    train_metrics = _make_metrics(output_names)
+    test_metrics = _make_metrics(output_names)
+
+    @tf.function(jit_compile=jit_compile)
+    def train_step(images, labels):
+        with tf.GradientTape() as tape:
+            loss = _forward(
+                model, loss_function, images, labels, output_names, train_metrics, training=True
+            )
+        gradients = tape.gradient(loss, model.trainable_variables)
+        model.optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+
+    @tf.function(jit_compile=jit_compile)
+    def test_step(images, labels):
+        _forward(model, loss_function, images, labels, output_names, test_metrics, training=False)
+
+    def make_loop_function(step):
+        @tf.function
+        def loop_function(iterator):
+            n_steps = tf.constant(0)
+            for _ in tf.range(steps_per_execution):
+                batch = iterator.get_next_as_optional()
+                if not batch.has_value():
+                    break
+                step(*batch.get_value())
+                n_steps += 1
+            return n_steps
+
+        return loop_function
+
+    train_function = make_loop_function(train_step)
+    test_function = make_loop_function(test_step)
+
+    callback_list = tf.keras.callbacks.CallbackList(
+        callbacks, add_history=True, model=model, epochs=epochs, verbose=verbose
+    )
+
+    model.stop_training = False
+    logs = {}
+    callback_list.on_train_begin()
+
+    for epoch in range(initial_epoch, epochs):
+        callback_list.on_epoch_begin(epoch)
+
+        for metric in train_metrics.values():
+            metric.reset_state()
+
+        step = 0
+        iterator = iter(train_data)
+        while True:
+            callback_list.on_train_batch_begin(step)
+            n_steps = int(train_function(iterator))
+            step += n_steps
+            callback_list.on_train_batch_end(step - 1)
+
+            if n_steps < steps_per_execution:
+                break
+
+        logs = {name: float(metric.result()) for name, metric in train_metrics.items()}
+
+        if test_data is not None and _should_evaluate(epoch, validation_freq):
+            for metric in test_metrics.values():
+                metric.reset_state()
+
+            iterator = iter(test_data)
+            while int(test_function(iterator)) == steps_per_execution:
+                pass
+
+            logs.update({"val_" + name: float(metric.result()) for name, metric in test_metrics.items()})
+
+        callback_list.on_epoch_end(epoch, logs)
+        if model.stop_training:
+            break
+
+    callback_list.on_train_end(logs)
+
+    return model.history
+
+
+def _should_evaluate(epoch, validation_freq):
+    """ Whether model.fit evaluates the validation data at the end of the (0-based) epoch. """
+    if isinstance(validation_freq, int):
+        return (epoch + 1) % validation_freq == 0
+    return epoch + 1 in validation_freq
+
+
+def _as_dataset(x, y, batch_size, shuffle):
+    """ Batch in-memory (images, labels) into a tf.data.Dataset, reshuffled every epoch. Datasets are returned as is. """
+    if isinstance(x, tf.data.Dataset):
+        return x
+
+    n_examples = tf.nest.flatten(x)[0].shape[0]
+    indices = tf.data.Dataset.range(n_examples)
+    if shuffle:
+        indices = indices.shuffle(n_examples)
+
+    gather = lambda idx: tf.nest.map_structure(lambda t: tf.gather(t, idx), (x, y))
+    return indices.batch(batch_size).map(gather, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
+
+def _make_metrics(output_names):
+    """ Returns the loss and accuracy metrics of a model, keyed by their model.fit log names. """
+    names = ["loss"]
+    for prefix in [""] if output_names is None else [name + "_" for name in output_names]:
+        if prefix:
+            names.append(prefix + "loss")
+        names.append(prefix + "accuracy")
+
+    return {
+        name: tf.keras.metrics.SparseCategoricalAccuracy() if name.endswith("accuracy") else tf.keras.metrics.Mean()
+        for name in names
+    }
+
+
+def _forward(model, loss_function, images, labels, output_names, metrics, training):
+    """ Run the model on a batch, update the metrics and return the total loss. """
+    predictions = model(images, training=training)
+    batch_size = tf.shape(images)[0]
+
+    if output_names is None:
+        predictions, labels, prefixes = [predictions], [labels], [""]
+    else:
+        predictions = tf.nest.flatten(predictions)
+        labels = [labels[name] for name in output_names]
+        prefixes = [name + "_" for name in output_names]
+
+    losses = []
+    for prefix, output_labels, output_predictions in zip(prefixes, labels, predictions):
+        loss = tf.reduce_mean(loss_function(output_labels, output_predictions))
+        losses.append(loss)
+
+        if prefix:
+            metrics[prefix + "loss"].update_state(loss, sample_weight=batch_size)
+        metrics[prefix + "accuracy"].update_state(output_labels, output_predictions)
+
+    loss = tf.add_n(losses)
+    if model.losses:
+        loss += tf.add_n(model.losses)
+    metrics["loss"].update_state(loss, sample_weight=batch_size)
+
+    return loss
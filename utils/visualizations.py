@@ -4,12 +4,16 @@ import matplotlib as mpl
 import matplotlib
 
 import numpy as np
-import pickle as pkl
+
+from utils.results_store import load_metrics
+from utils.results_catalog import model_width, pad_histories
+from utils.aggregation import sweep_statistics
 
 
 def load_results(path):
     """
-    Helper method to read in and format the results from training convnets.
+    Helper method to read in and format the results from training convnets. path is the .pkl results
+    path of a sweep, whose runs are read from the .pkl file and/or the results store (see utils.results_store).
     returns dictionary of form:
     {
         'widths': np.array,
@@ -18,32 +22,22 @@ def load_results(path):
         'val_loss': np.array,
         'val_accuracy': np.array
     }
+    The arrays are [n_widths, n_epochs], with NaN after the last epoch of runs shorter than the longest.
+    See utils.results_catalog for the runs of several results files.
     """
 
-    metrics = pkl.load(open(path, "rb"))
-
-    # extract train/test loss and accuracy  for each model.
-    widths = []
-    train_losses = []
-    train_accuracy = []
-    test_losses = []
-    test_accuracy = []
-
-    for model_id, history in metrics.items():
-        # all models are named in the form 'conv_net_depth_{depth}_width_{init_channels}'
-        # or ResNet18_width_{width}_UniformHe_init.
-        width = list(filter(lambda x: x.isnumeric(), model_id.split("_")))[-1]
-        widths.append(int(width))
+    metrics = load_metrics(path)
 
-        train_losses.append(history.get("loss"))
-        train_accuracy.append(history.get("accuracy"))
-        test_losses.append(history.get("val_loss"))
-        test_accuracy.append(history.get("val_accuracy"))
+    # all models are named in the form 'conv_net_depth_{depth}_width_{init_channels}'
+    # or ResNet18_width_{width}_UniformHe_init. Models are sorted by width.
+    model_ids = sorted(metrics, key=model_width)
+    widths = [model_width(model_id) for model_id in model_ids]
 
-    train_losses = np.array(train_losses)
-    train_accuracy = np.array(train_accuracy)
-    test_losses = np.array(test_losses)
-    test_accuracy = np.array(test_accuracy)
+    # extract train/test loss and accuracy for each model, NaN padded after the end of shorter runs.
+    train_losses, train_accuracy, test_losses, test_accuracy = [
+        pad_histories([metrics[model_id].get(key, []) for model_id in model_ids])
+        for key in ["loss", "accuracy", "val_loss", "val_accuracy"]
+    ]
 
     return {
         "widths": widths,
@@ -54,7 +48,7 @@ def load_results(path):
     }
 
 
-def plot_loss_from_file(path):
+def plot_loss_from_file(path, error_bands=None, show=True, results=None):
     """
     Function to plot the results from previous runs stored in the experimental_results folder.
 
@@ -71,9 +65,21 @@ def plot_loss_from_file(path):
 
     This is a dictionary where the key is the model id generated by the _get() function for the desired model, and
     the items being the history returned by calling model.fit().
+
+    Parameters
+    ----------
+    path: str
+        path to the results file. see load_results.
+    error_bands: str
+        if 'std' or 'ci', also plot the mean over all seeds of the sweep (its '_seed_{s}' results files, see
+        utils.aggregation) with a band of one standard deviation or the bootstrap confidence interval.
+    show: bool
+        whether to display the figure. The figure is returned either way.
+    results: dict
+        Already loaded load_results(path), to avoid reading the results again.
     """
 
-    results = load_results(path)
+    results = load_results(path) if results is None else results
 
     widths = results.get("widths")
     train_losses = results.get("loss")
@@ -81,8 +87,9 @@ def plot_loss_from_file(path):
     test_losses = results.get("val_loss")
     test_accuracy = results.get("val_accuracy")
 
-    # optimal early stopping values
-    optimal_test_idx = test_accuracy.argmax(axis=1)
+    # optimal early stopping values. Test metrics are NaN at epochs which were not evaluated, and all metrics
+    # are NaN after the end of runs shorter than the longest.
+    optimal_test_idx = np.nanargmax(test_accuracy, axis=1)
     optimal_early_train_losses = np.array(
         [train_losses[i, idx] for i, idx in enumerate(optimal_test_idx)]
     )
@@ -108,7 +115,7 @@ def plot_loss_from_file(path):
     # plot final and optimal early stopping train loss
     train_loss_plt.plot(
         widths,
-        train_losses[:, -1],
+        _final_values(train_losses),
         marker="o",
         markersize=mrkr_size,
         label="Final Train Loss",
@@ -125,7 +132,7 @@ def plot_loss_from_file(path):
     # plot final and optimal early stopping test loss
     test_loss_plt.plot(
         widths,
-        test_losses[:, -1],
+        _final_values(test_losses),
         marker="o",
         markersize=mrkr_size,
         label="Final Test Loss",
@@ -142,7 +149,7 @@ def plot_loss_from_file(path):
     # plot final and optimal early stopping train error
     train_accy_plt.plot(
         widths,
-        100 * (1 - train_accuracy[:, -1]),
+        100 * (1 - _final_values(train_accuracy)),
         marker="o",
         markersize=mrkr_size,
         label="Final Train Error",
@@ -159,7 +166,7 @@ def plot_loss_from_file(path):
     # plot final and optimal early stopping test error
     test_accy_plt.plot(
         widths,
-        100 * (1 - test_accuracy[:, -1]),
+        100 * (1 - _final_values(test_accuracy)),
         marker="o",
         markersize=mrkr_size,
         label="Final Test Error",
@@ -173,16 +180,24 @@ def plot_loss_from_file(path):
     )
     test_accy_plt.set_ylabel("Test Error", fontsize=16)
 
+    if error_bands is not None:
+        _plot_seed_statistics(axes, sweep_statistics(path), error_bands)
+
     for ax in axes.flatten():
         ax.set_xlabel("Layer Width", fontsize=16)
         ax.legend(fontsize=14)
         ax.grid(alpha=0.5)
 
     fig.tight_layout(pad=1.15, h_pad=2)
-    plt.show()
+    if show:
+        plt.show()
+
+    return fig
 
 
-def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=None):
+def plot_loss_vs_epoch_from_file(
+    path, x_idx, contour_levels=[0.1], save_fig=None, max_epochs=None, show=True, results=None
+):
     """
     Plots the Seaplots as seen on page 2 of Deep Double Descent. Plots them in the form of 1 1x2 matplotlib figure.
 
@@ -195,14 +210,21 @@ def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=Non
     path: str
         path to pickled file. see load load_results function
     x_idx: list
-        list of tick marks for the x axis. Should correspond to the model width parameter.
+        list of tick marks for the x axis, as model widths. Widths which were not trained are skipped.
     contour_levels: list[float]
         a list of the contour line values to add to the training loss plot.
     save_fig: str
         A file name to save the resulting image to.
+    max_epochs: int
+        if given, average the epochs into at most max_epochs log-spaced bins (see decimate_epochs), which keeps
+        the early epochs and draws the late epochs at about screen resolution.
+    show: bool
+        whether to display the figure. The figure is returned either way.
+    results: dict
+        Already loaded load_results(path), to avoid reading the results again.
     """
 
-    results = load_results(path)
+    results = load_results(path) if results is None else results
 
     widths = results.get("widths")
     train_losses = results.get("loss")
@@ -216,7 +238,17 @@ def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=Non
 
     # 1e-15 is there since imshow sometimes raises errors for non-positive input.
     train_error = 1 - train_accuracy + 1e-15
-    test_error = 1 - test_accuracy + 1e-15
+    test_error = 1 - _fill_skipped_epochs(test_accuracy) + 1e-15
+    test_error[np.isnan(train_error)] = np.nan
+
+    # cell edges of the seaplots, in (0-based) width and epoch index coordinates.
+    n_epochs = train_error.shape[1]
+    epoch_starts = np.arange(n_epochs)
+    if max_epochs is not None:
+        train_error, epoch_starts = decimate_epochs(train_error, max_epochs)
+        test_error, _ = decimate_epochs(test_error, max_epochs)
+    x_edges = np.arange(train_error.shape[0] + 1) - 0.5
+    y_edges = np.append(epoch_starts, n_epochs) - 0.5
 
     ax_label_fs = 14
     ax_label_pad = 15
@@ -224,22 +256,21 @@ def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=Non
     plt_title_pad = 15
 
     # normalize the color range relative to the input values
-    vmin = np.min(train_error)
-    vmax = np.max(train_error)
+    vmin = np.nanmin(train_error)
+    vmax = np.nanmax(train_error)
     norm = matplotlib.colors.Normalize(vmin, vmax)
     # seaplot train data
-    train_im = train_plot.imshow(
-        train_error.T, aspect="auto", origin="lower", norm=norm, interpolation="nearest"
-    )
+    train_im = train_plot.pcolormesh(x_edges, y_edges, train_error.T, norm=norm)
 
     # set axis labels and title
     train_plot.set_xlabel(f"Width", fontsize=ax_label_fs, labelpad=ax_label_pad)
     train_plot.set_ylabel("Epoch", fontsize=ax_label_fs, labelpad=ax_label_pad)
     train_plot.set_title("Train", fontsize=plt_title_fs, pad=plt_title_pad)
 
-    # set x axis ticks. (note that there is an offset of 1 since the array is 0 indexed)
-    x_vals = [idx - 1 for idx in x_idx]
-    x_labels = [f"{tick}" for tick in x_idx]
+    # set x axis ticks at the columns of the widths in x_idx, which need not be contiguous.
+    widths = list(widths)
+    x_vals = [widths.index(tick) for tick in x_idx if tick in widths]
+    x_labels = [f"{tick}" for tick in x_idx if tick in widths]
     train_plot.set_xticks(x_vals)
     train_plot.set_xticklabels(x_labels, fontsize=16)
 
@@ -253,9 +284,11 @@ def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=Non
     cbar = fig.colorbar(train_im, ax=train_plot, pad=0.025, ticks=ticks, fraction=0.1)
     cbar.ax.set_xlabel("% Error", labelpad=15)
 
-    # add interpolation point contour and label
-    if contour_levels is not None:
+    # add interpolation point contour and label (contours need at least 2 widths and epochs).
+    if contour_levels is not None and min(train_error.shape) > 1:
         train_plot.contour(
+            (x_edges[:-1] + x_edges[1:]) / 2,
+            (y_edges[:-1] + y_edges[1:]) / 2,
             train_error.T,
             levels=contour_levels,
             colors="white",
@@ -265,21 +298,19 @@ def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=Non
         )
 
     # normalize the color range relative to the input values
-    vmin = round(np.min(test_error), 1)
-    vmax = np.max(test_error)
+    vmin = round(np.nanmin(test_error), 1)
+    vmax = np.nanmax(test_error)
     norm = matplotlib.colors.Normalize(vmin, vmax)
     # Plot the test error sea plot
-    test_im = test_plot.imshow(test_error.T, aspect="auto", norm=norm, origin="lower")
+    test_im = test_plot.pcolormesh(x_edges, y_edges, test_error.T, norm=norm)
 
     # set axis labels and title
     test_plot.set_xlabel(f"Width", fontsize=ax_label_fs, labelpad=ax_label_pad)
     test_plot.set_ylabel("Epoch", fontsize=ax_label_fs, labelpad=ax_label_pad)
     test_plot.set_title("Test", fontsize=plt_title_fs, pad=plt_title_pad)
 
-    # set x axis ticks (note that there is an offset of 1 since the array is 0 indexed)
-    x_vals = [idx - 1 for idx in x_idx]
-    x_labels = [f"{tick}" for tick in x_idx]
-    test_plot.set_xticks(x_idx)
+    # set x axis ticks at the columns of the widths in x_idx.
+    test_plot.set_xticks(x_vals)
     test_plot.set_xticklabels(x_labels, fontsize=14)
 
     # set y ticks and adjust scale
@@ -293,8 +324,9 @@ def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=Non
     cbar.ax.set_xlabel("% Error", labelpad=15)
 
     # display the image.
-    plt.tight_layout(h_pad=2)
-    plt.show()
+    fig.tight_layout(h_pad=2)
+    if show:
+        plt.show()
 
     # if a path is provided, save image.
     if isinstance(save_fig, str):
@@ -305,3 +337,83 @@ def plot_loss_vs_epoch_from_file(path, x_idx, contour_levels=[0.1], save_fig=Non
             else save_fig + ".png"
         )
         fig.savefig(save_fig, dpi=300)
+
+    return fig
+
+
+def decimate_epochs(values, max_epochs):
+    """
+    Average the epochs of a [n_widths, n_epochs] array into max_epochs bins with log-spaced boundaries, so
+    the first epochs keep one bin each and later bins cover more and more epochs, matching the symlog epoch
+    axis of the seaplots. When n_epochs is too close to max_epochs for log-spaced bins of at least one epoch
+    each, the bins are linearly spaced instead. NaN values are ignored. Returns the binned array and the
+    (0-based) first epoch of every bin.
+    """
+    values = np.asarray(values, dtype=float)
+    n_epochs = values.shape[1]
+    if n_epochs <= max_epochs:
+        return values, np.arange(n_epochs)
+
+    # grow the number of boundaries until max_epochs distinct bins remain after rounding.
+    n_points = max_epochs
+    while True:
+        starts = np.unique(np.floor(np.geomspace(1, n_epochs + 1, n_points)).astype(int) - 1)
+        starts = starts[starts < n_epochs]
+        if len(starts) >= max_epochs or n_points > n_epochs:
+            break
+        n_points += max_epochs - len(starts)
+    starts = starts[:max_epochs]
+
+    if len(starts) < max_epochs:
+        starts = np.floor(np.linspace(0, n_epochs, max_epochs, endpoint=False)).astype(int)
+
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=1)
+    counts = np.add.reduceat(valid, starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts, starts
+
+
+def _fill_skipped_epochs(values):
+    """
+    Forward fill the NaN test metrics of epochs which were not evaluated (see utils.evaluation) along the
+    epoch axis of a [n_widths, n_epochs] array, so every epoch shows the last evaluated value.
+    """
+    values = np.array(values, dtype=float)
+    idx = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return np.take_along_axis(values, idx, axis=1)
+
+
+def _plot_seed_statistics(axes, stats, error_bands="std"):
+    """ Plot the seed means of the final and optimal early stopping metrics, with error bands, on the 2x2 axes. """
+    if error_bands not in ["std", "ci"]:
+        raise Exception(f"Unknown error_bands '{error_bands}', use 'std' or 'ci'.")
+
+    widths = stats["widths"]
+    n_seeds = int(stats["n_seeds"].max())
+    panels = [
+        (axes[0][0], "train_loss", "Train Loss", 1),
+        (axes[0][1], "test_loss", "Test Loss", 1),
+        (axes[1][0], "train_error", "Train Error", 100),
+        (axes[1][1], "test_error", "Test Error", 100),
+    ]
+
+    for ax, metric, name, scale in panels:
+        for stop, label in [("final", "Final"), ("early", "Optimal Early Stopping")]:
+            summary = stats[f"{stop}_{metric}"]
+            mean = scale * summary["mean"]
+            if error_bands == "std":
+                low, high = mean - scale * summary["std"], mean + scale * summary["std"]
+            else:
+                low, high = scale * summary["ci_low"], scale * summary["ci_high"]
+
+            line = ax.plot(widths, mean, linestyle="--", label=f"{label} {name} (mean of {n_seeds} seeds)")[0]
+            ax.fill_between(widths, low, high, color=line.get_color(), alpha=0.2)
+
+
+def _final_values(values):
+    """ The last non-NaN value of every row of a [n_widths, n_epochs] array, i.e. the final epoch of each run. """
+    values = np.asarray(values, dtype=float)
+    last = values.shape[1] - 1 - np.argmax(~np.isnan(values[:, ::-1]), axis=1)
+    return values[np.arange(values.shape[0]), last]
@@ -0,0 +1,152 @@
+import numpy as np
+
+from utils.sweep import WIDTH_ARGUMENTS, run_width_sweep
+from utils.results_catalog import model_width
+
+
+def adaptive_width_search(
+    train_function,
+    coarse_widths,
+    max_rounds=3,
+    widths_per_round=4,
+    min_spacing=1,
+    interpolation_error=0.01,
+    metrics=None,
+    sweep_kwargs=None,
+    **train_kwargs,
+):
+    """
+    Locate the double descent peak with fewer trainings than a full width grid.
+
+    First the coarse_widths are trained. Every round then estimates the interpolation threshold (the
+    smallest width whose final train error is at most interpolation_error) and the peak of the final test
+    error from the trained widths, and bisects the largest gaps between trained widths in the region
+    between the trained widths bracketing both, until the gaps are at most min_spacing or max_rounds
+    rounds have been trained.
+
+    Every width is trained with merge_results=True, so all trained widths end up in the usual results file
+    and can be plotted with utils.visualizations as before.
+
+    Returns the metrics of all trained widths, keyed by model id, and a list with the widths trained, the
+    estimated interpolation threshold and the estimated peak of every round.
+
+    Parameters
+    ----------
+    train_function: callable
+        train_conv_nets or train_resnet18.
+    coarse_widths: list[int]
+        Widths trained in the first round, e.g. [1, 2, 4, 8, 16, 32, 64]. Should span the interpolation
+        threshold.
+    max_rounds: int
+        Maximum number of refinement rounds after the coarse round.
+    widths_per_round: int
+        Maximum number of widths trained per refinement round.
+    min_spacing: int
+        Stop refining once the trained widths in the region are at most this far apart.
+    interpolation_error: float
+        Final train error at or below which a width counts as interpolating the training data.
+    metrics: dict
+        Metrics of widths trained earlier (e.g. loaded from the results file), keyed by model id. These
+        widths are not trained again.
+    sweep_kwargs: dict
+        if given, train the widths of every round in parallel worker processes with these arguments of
+        utils.sweep.run_width_sweep, e.g. {'n_workers': 4}.
+    train_kwargs:
+        Keyword arguments passed on to train_function, e.g. data_set, convnet_depth, label_noise_as_int.
+        If no seed is given, one is drawn here so that every round trains on the same noisy labels.
+    """
+    metrics = {} if metrics is None else dict(metrics)
+
+    if train_kwargs.get("seed") is None:
+        train_kwargs["seed"] = int(np.random.SeedSequence().entropy % 2 ** 32)
+        print(f"No seed given, using seed {train_kwargs['seed']} for every round.")
+
+    rounds = []
+    new_widths = sorted(set(coarse_widths) - set(_trained_widths(metrics)))
+
+    for round_idx in range(max_rounds + 1):
+        if new_widths:
+            print(f"WIDTH SEARCH round {round_idx}: training widths {new_widths}")
+            metrics.update(_train_widths(train_function, new_widths, sweep_kwargs, train_kwargs))
+
+        widths, train_error, test_error = width_curves(metrics)
+        threshold, peak = estimate_threshold_and_peak(widths, train_error, test_error, interpolation_error)
+        rounds.append({"widths": new_widths, "threshold": threshold, "peak": peak})
+        print(f"WIDTH SEARCH round {round_idx}: interpolation threshold ~{threshold}, test error peak ~{peak}")
+
+        if round_idx == max_rounds:
+            break
+
+        new_widths = refinement_widths(widths, threshold, peak, widths_per_round, min_spacing)
+        if not new_widths:
+            break
+
+    print(f"WIDTH SEARCH finished: trained {len(_trained_widths(metrics))} widths in {len(rounds)} rounds.")
+
+    return metrics, rounds
+
+
+def width_curves(metrics):
+    """
+    Returns the sorted widths of metrics and their final train and test error. The test error is that of the
+    last evaluated epoch, as test metrics are NaN at epochs which were not evaluated (see utils.evaluation).
+    """
+    widths, train_error, test_error = [], [], []
+
+    for model_id, history in metrics.items():
+        widths.append(model_width(model_id))
+        train_error.append(1 - history["accuracy"][-1])
+
+        test_accuracy = np.array(history["val_accuracy"], dtype=float)
+        test_accuracy = test_accuracy[~np.isnan(test_accuracy)]
+        test_error.append(1 - test_accuracy[-1] if test_accuracy.size else np.nan)
+
+    order = np.argsort(widths)
+    return np.array(widths)[order], np.array(train_error)[order], np.array(test_error)[order]
+
+
+def estimate_threshold_and_peak(widths, train_error, test_error, interpolation_error=0.01):
+    """
+    Estimate the interpolation threshold, the smallest width with a final train error of at most
+    interpolation_error (the largest width if none interpolates), and the width with the largest final test
+    error, from the sorted width curves of width_curves.
+    """
+    interpolating = np.flatnonzero(train_error <= interpolation_error)
+    threshold = widths[interpolating[0]] if interpolating.size else widths[-1]
+
+    if np.all(np.isnan(test_error)):
+        return int(threshold), int(threshold)
+
+    peak = widths[np.nanargmax(test_error)]
+    return int(threshold), int(peak)
+
+
+def refinement_widths(widths, threshold, peak, widths_per_round=4, min_spacing=1):
+    """
+    Returns the untrained widths to train next: the midpoints of the largest gaps between the trained widths
+    from the one below min(threshold, peak) to the one above max(threshold, peak).
+    """
+    widths = np.sort(widths)
+    low = max(np.searchsorted(widths, min(threshold, peak)) - 1, 0)
+    high = min(np.searchsorted(widths, max(threshold, peak)) + 1, len(widths) - 1)
+    region = widths[low : high + 1]
+
+    gaps = [(right - left, left, right) for left, right in zip(region[:-1], region[1:]) if right - left > min_spacing]
+    gaps.sort(reverse=True)
+
+    return sorted(int((left + right) // 2) for _, left, right in gaps[:widths_per_round])
+
+
+def _train_widths(train_function, widths, sweep_kwargs, train_kwargs):
+    # the workers of run_width_sweep already merge every width into the results file.
+    if sweep_kwargs is not None:
+        return run_width_sweep(train_function, widths, **sweep_kwargs, **train_kwargs)
+
+    # every round trains only its own widths. With results_store=False the .pkl file would otherwise be
+    # rewritten with the widths of the last round only.
+    width_argument = WIDTH_ARGUMENTS.get(train_function.__name__, "convnet_widths")
+    return train_function(**{width_argument: widths}, **{**train_kwargs, "merge_results": True})
+
+
+def _trained_widths(metrics):
+    return sorted(model_width(model_id) for model_id in metrics)
@@ -0,0 +1,333 @@
+"""
+Coordinate a sweep across several machines through a directory on a shared filesystem (e.g. NFS).
+
+The cells of an experiment grid (see utils.experiment_grid) are submitted as jobs into a queue directory:
+
+    {queue_dir}/jobs/{hash}.json     - the cell config of every job.
+    {queue_dir}/leases/{hash}.lease  - the claim of a worker, created exclusively (O_EXCL). The worker
+                                       refreshes its modification time every heartbeat_interval seconds.
+    {queue_dir}/done/{hash}.json     - written once the job's results are merged into its results file.
+    {queue_dir}/failed/{hash}.json   - jobs which raised, or crashed their workers max_attempts times.
+
+Workers on any machine claim the pending jobs, largest width first, train them and merge their results
+under a file lock. A lease without a heartbeat for lease_timeout seconds belongs to a crashed worker. It
+is taken over atomically (by rename) by the next worker looking for a job. lease_timeout should be well
+above heartbeat_interval plus the clock skew between the machines.
+
+Usage (from the repository root, on every machine):
+    python -m utils.work_queue submit config.json --queue_dir /shared/queue
+    python -m utils.work_queue worker --queue_dir /shared/queue [--n_workers 2]
+    python -m utils.work_queue status --queue_dir /shared/queue
+"""
+
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+from utils.experiment_grid import grid_cells, is_completed, run_cell
+
+
+QUEUE_DIRS = ["jobs", "leases", "done", "failed"]
+
+
+def submit_grid(queue_dir, config):
+    """
+    Submit the cells of a grid config (dict or path to a JSON file) which are not completed yet as jobs.
+    Jobs which are already in the queue are left as they are. Returns the number of new jobs.
+    """
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+
+    for name in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+    n_submitted = 0
+    for cell in grid_cells(config):
+        job_path = _path(queue_dir, "jobs", cell["hash"])
+        if os.path.exists(job_path) or is_completed(cell):
+            continue
+
+        _atomic_json_dump(cell, job_path)
+        n_submitted += 1
+
+    print(f"QUEUE: submitted {n_submitted} jobs to {queue_dir}")
+    return n_submitted
+
+
+def queue_status(queue_dir):
+    """ Returns the number of pending, running, done and failed jobs of a queue. """
+    jobs = set(_hashes(queue_dir, "jobs"))
+    done = jobs & set(_hashes(queue_dir, "done"))
+    failed = (jobs & set(_hashes(queue_dir, "failed"))) - done
+    running = (jobs & set(_hashes(queue_dir, "leases"))) - done - failed
+
+    return {
+        "pending": len(jobs - done - failed - running),
+        "running": len(running),
+        "done": len(done),
+        "failed": len(failed),
+    }
+
+
+def run_worker(
+    queue_dir,
+    worker_id=None,
+    lease_timeout=600,
+    heartbeat_interval=60,
+    max_attempts=3,
+    wait=False,
+    poll_interval=30,
+):
+    """
+    Claim and train jobs of a queue until no job is left to claim. Returns the number of jobs trained.
+
+    Parameters
+    ----------
+    queue_dir: str
+        Queue directory on the shared filesystem, see submit_grid.
+    worker_id: str
+        Name of the worker in its leases. Default is '{hostname}_{pid}'.
+    lease_timeout: float
+        Seconds without a heartbeat after which a lease is considered abandoned and its job is reclaimed.
+    heartbeat_interval: float
+        Seconds between heartbeats of the lease of the job being trained.
+    max_attempts: int
+        Number of claims of a job (i.e. crashed workers) after which it is marked as failed.
+    wait: bool
+        if True, keep polling every poll_interval seconds until every job is done or failed, so that the
+        jobs of workers which crash later are reclaimed too.
+    poll_interval: float
+        Seconds between polls of the queue when waiting.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}_{os.getpid()}"
+    n_trained = 0
+
+    while True:
+        job_hash = claim_job(queue_dir, worker_id, lease_timeout, max_attempts)
+
+        if job_hash is None:
+            status = queue_status(queue_dir)
+            if not wait or status["pending"] + status["running"] == 0:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        with open(_path(queue_dir, "jobs", job_hash)) as f:
+            cell = json.load(f)
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat, args=(queue_dir, job_hash, heartbeat_interval, stop), daemon=True
+        )
+        heartbeat.start()
+
+        print(f"QUEUE: {worker_id} training job {job_hash}")
+        try:
+            if not is_completed(cell):
+                run_cell(cell)
+                n_trained += 1
+            _atomic_json_dump({"worker": worker_id, "finished": time.time()}, _path(queue_dir, "done", job_hash))
+
+        except Exception:
+            print(f"QUEUE: job {job_hash} failed on {worker_id}")
+            _atomic_json_dump(
+                {"worker": worker_id, "error": traceback.format_exc()}, _path(queue_dir, "failed", job_hash)
+            )
+
+        finally:
+            stop.set()
+            heartbeat.join()
+            _release_lease(_path(queue_dir, "leases", job_hash, ".lease"), worker_id)
+
+    print(f"QUEUE: {worker_id} finished, trained {n_trained} jobs.")
+    return n_trained
+
+
+def claim_job(queue_dir, worker_id, lease_timeout=600, max_attempts=3):
+    """
+    Claim a pending job of the queue, largest width first, by exclusively creating its lease. Abandoned
+    leases are taken over. Returns the hash of the claimed job, or None if no job can be claimed.
+    """
+    finished = set(_hashes(queue_dir, "done")) | set(_hashes(queue_dir, "failed"))
+    jobs = []
+    for job_hash in set(_hashes(queue_dir, "jobs")) - finished:
+        try:
+            with open(_path(queue_dir, "jobs", job_hash)) as f:
+                jobs.append((json.load(f)["width"], job_hash))
+        except (OSError, ValueError):
+            continue
+
+    for _, job_hash in sorted(jobs, reverse=True):
+        lease_path = _path(queue_dir, "leases", job_hash, ".lease")
+
+        attempts = 0
+        if os.path.exists(lease_path):
+            attempts = _take_over_abandoned_lease(lease_path, worker_id, lease_timeout)
+            if attempts is None:
+                continue
+
+        if attempts >= max_attempts:
+            print(f"QUEUE: job {job_hash} abandoned {attempts} times, marking it as failed")
+            _atomic_json_dump({"error": f"abandoned by {attempts} workers"}, _path(queue_dir, "failed", job_hash))
+            continue
+
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"worker": worker_id, "claimed": time.time(), "attempts": attempts + 1}, f)
+        return job_hash
+
+    return None
+
+
+def run_local_workers(queue_dir, n_workers, intra_op_threads=None, inter_op_threads=1, **worker_kwargs):
+    """
+    Run n_workers workers of a queue as separate processes on this machine, e.g. to use a multi core box
+    or to test the queue locally. Keyword arguments are passed on to run_worker.
+    """
+    intra_op_threads = intra_op_threads or max(1, os.cpu_count() // n_workers)
+
+    # TensorFlow is not fork safe, start every worker in a fresh interpreter.
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=_local_worker,
+            args=(queue_dir, intra_op_threads, inter_op_threads, worker_kwargs),
+        )
+        for _ in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return queue_status(queue_dir)
+
+
+def _local_worker(queue_dir, intra_op_threads, inter_op_threads, worker_kwargs):
+    from utils.sweep import _init_worker
+
+    _init_worker(intra_op_threads, inter_op_threads)
+    run_worker(queue_dir, **worker_kwargs)
+
+
+def _take_over_abandoned_lease(lease_path, worker_id, lease_timeout):
+    """
+    Remove a lease without a heartbeat for lease_timeout seconds, and return its number of attempts. Only
+    one worker wins the rename of an abandoned lease. Returns None if the lease is alive or was taken.
+    """
+    try:
+        if time.time() - os.path.getmtime(lease_path) < lease_timeout:
+            return None
+
+        stale_path = f"{lease_path}.stale_{worker_id}"
+        os.rename(lease_path, stale_path)
+    except OSError:
+        return None
+
+    try:
+        with open(stale_path) as f:
+            attempts = json.load(f).get("attempts", 1)
+    except (OSError, ValueError):
+        attempts = 1
+    _remove(stale_path)
+
+    print(f"QUEUE: {worker_id} reclaiming abandoned job {os.path.basename(lease_path)[:-6]}")
+    return attempts
+
+
+def _release_lease(lease_path, worker_id):
+    """ Remove a lease, unless it was taken over by another worker in the meantime. """
+    try:
+        with open(lease_path) as f:
+            owner = json.load(f).get("worker")
+    except (OSError, ValueError):
+        return
+
+    if owner == worker_id:
+        _remove(lease_path)
+
+
+def _heartbeat(queue_dir, job_hash, heartbeat_interval, stop):
+    """ Refresh the lease of a job every heartbeat_interval seconds until stop is set. """
+    lease_path = _path(queue_dir, "leases", job_hash, ".lease")
+    while not stop.wait(heartbeat_interval):
+        try:
+            os.utime(lease_path)
+        except OSError:
+            print(f"QUEUE: lost the lease of job {job_hash}")
+
+
+def _path(queue_dir, name, job_hash, extension=".json"):
+    return os.path.join(queue_dir, name, job_hash + extension)
+
+
+def _hashes(queue_dir, name):
+    """ Hashes of the jobs with a file in the given queue subdirectory. """
+    try:
+        files = os.listdir(os.path.join(queue_dir, name))
+    except FileNotFoundError:
+        return []
+
+    extension = ".lease" if name == "leases" else ".json"
+    return [file[: -len(extension)] for file in files if file.endswith(extension)]
+
+
+def _atomic_json_dump(obj, path):
+    """ Write obj as JSON to a temporary file and rename it into place, so readers never see partial files. """
+    tmp_path = f"{path}.tmp_{socket.gethostname()}_{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("command", choices=["submit", "worker", "status"])
+    parser.add_argument("config", nargs="?", help="path to the JSON grid config (submit only)")
+    parser.add_argument("--queue_dir", required=True)
+    parser.add_argument("--n_workers", type=int, default=1, help="number of local worker processes")
+    parser.add_argument("--lease_timeout", type=float, default=600)
+    parser.add_argument("--heartbeat_interval", type=float, default=60)
+    parser.add_argument("--max_attempts", type=int, default=3)
+    parser.add_argument("--wait", action="store_true", help="wait for running jobs to reclaim crashed ones")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        if args.config is None:
+            raise Exception("submit needs the path to a grid config.")
+        submit_grid(args.queue_dir, args.config)
+
+    elif args.command == "worker":
+        worker_kwargs = dict(
+            lease_timeout=args.lease_timeout,
+            heartbeat_interval=args.heartbeat_interval,
+            max_attempts=args.max_attempts,
+            wait=args.wait,
+        )
+        if args.n_workers == 1:
+            run_worker(args.queue_dir, **worker_kwargs)
+        else:
+            run_local_workers(args.queue_dir, args.n_workers, **worker_kwargs)
+
+    print(f"QUEUE: {queue_status(args.queue_dir)}")
+
+
+if __name__ == "__main__":
+    main()